@@ -0,0 +1,350 @@
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+
+import numpy as np
+
+from grid import Tile, TileGrid
+from level import BAT_DTYPE, CRAB_DTYPE, LEVEL_HEIGHT, LEVEL_WIDTH, POISON_DTYPE, Level
+from simulation import GRID_SIZE, Action, Player, Simulation
+
+# Reproducible throughput benchmarks on synthetic levels. Each case scales the
+# debug room (create_cave_level) up in size and entity density, and measures
+# turns and ticks per second through Game.update, grapple raycasts and fall
+# checks per second, and the time Game.draw takes per frame under the SDL
+# dummy driver.
+# Every measurement is repeated; the median run is kept along with the spread
+# between runs (the range of the middle half, relative to the median). Results
+# are saved as JSON; --compare reruns the suite and flags metrics that got
+# worse than a saved baseline by more than the threshold and by more than
+# NOISE_FACTOR times the two runs' spreads together, so run-to-run noise on
+# unchanged code is not reported as a regression. Cases with a regression are
+# measured again (--confirm) and a regression only counts if every rerun shows
+# it too, which filters out bursts of load that slow a whole run down.
+# Before measuring anything, rulecheck.py's checks run (unless --no-rulecheck),
+# and the benchmark fails if any copy of the turn rules disagrees.
+
+BASELINE_VERSION = 2
+# name -> (scale, density): the level is scale times the debug room in each
+# direction, with density times its platforms, enemies and poison per cell
+CASES = {
+    "room": (1, 1),
+    "large": (4, 1),
+    "huge": (16, 1),
+    "crowded": (4, 8),
+}
+# name -> (unit, higher is better)
+METRICS = {
+    "turns_per_sec": ("turns/s", True),
+    "updates_per_sec": ("updates/s", True),
+    "raycasts_per_sec": ("calls/s", True),
+    "falls_per_sec": ("calls/s", True),
+    "draw_ms": ("ms/frame", False),
+    "draw_full_ms": ("ms/frame", False),
+}
+DURATION = 0.5  # Seconds per measurement
+REPEATS = 7  # Runs per measurement; the median is kept
+THRESHOLD = 0.10  # Smallest relative change that counts as a regression
+NOISE_FACTOR = 1.5  # Multiple of the two runs' spreads a change must exceed (Tukey's fence)
+CONFIRM = 1  # Reruns of the cases with regressions; only regressions every rerun shows count
+QUERIES = 4096  # Random raycast and fall queries per case
+ACTIONS = list(Action)
+
+
+def synthetic_level(scale, density, seed=0):
+    # The debug room's layout scaled up: rock border, a floor, and random
+    # platforms, bats, crabs and poison clouds in the room's proportions
+    rng = random.Random(seed)
+    width = LEVEL_WIDTH * scale
+    height = LEVEL_HEIGHT * scale
+    world = TileGrid(width, height)
+    world.fill(0, height - 2, width, height - 1, Tile.ROCK)
+    world.fill(0, 0, 1, height - 2, Tile.ROCK)
+    world.fill(width - 1, 0, width, height - 2, Tile.ROCK)
+    world.fill(0, 0, width, 1, Tile.ROCK)
+
+    # The room has 3 platforms, 1 bat, 3 crabs and 3 poison clouds
+    per_room = scale * scale * density
+    for _ in range(3 * per_room):
+        x = rng.randrange(2, width - 6)
+        y = rng.randrange(4, height - 4)
+        world.fill(x, y, x + rng.randrange(3, 6), y + 1, Tile.ROCK)
+
+    spawn = (2, 5)
+    exit_cell = (width - 2, 2)
+    for x, y in (spawn, exit_cell):
+        world.set(x, y, Tile.AIR)
+    # Crabs walk on whatever is below them; poison sits anywhere in the air
+    free = [(x, y) for y in range(1, height - 2) for x in range(1, width - 1)
+            if not world.is_solid(x, y) and (x, y) not in (spawn, exit_cell)]
+    standing = [(x, y) for x, y in free if world.is_solid(x, y + 1)]
+    bats = [(x, y, 1, height - 2) for x, y in rng.sample(free, per_room)]
+    crabs = [(x, y, 4) for x, y in rng.sample(standing, 3 * per_room)]
+    poison = rng.sample(free, 3 * per_room)
+    return Level(world, spawn, exit_cell, np.array(bats, BAT_DTYPE), np.array(crabs, CRAB_DTYPE),
+                 np.array(poison, POISON_DTYPE))
+
+
+def summarize(values):
+    # (median, spread) of one measurement's runs. The spread is the range of the
+    # middle half of the runs relative to the median, so one stalled run (a
+    # scheduler hiccup, a garbage collection) does not widen it.
+    values = sorted(values)
+    middle = len(values) // 2
+    median = values[middle] if len(values) % 2 else (values[middle - 1] + values[middle]) / 2
+    quarter = len(values) // 4
+    return median, (values[-1 - quarter] - values[quarter]) / median if median else 0.0
+
+
+def rates(run, duration, repeats):
+    # Rate of run() (which returns how many operations it did) in each of the repeats
+    result = []
+    for _ in range(repeats):
+        done = 0
+        start = time.perf_counter()
+        while True:
+            done += run()
+            elapsed = time.perf_counter() - start
+            if elapsed >= duration:
+                break
+        result.append(done / elapsed)
+    return result
+
+
+def bench_turns(game_module, level, duration, repeats, seed=0):
+    # Random-agent (turns, updates) per second through Game.update, deaths and
+    # fades included, in each of the repeats. Falls and grapples take more
+    # updates on bigger levels.
+    turn_rates = []
+    update_rates = []
+    for _ in range(repeats):
+        game = game_module.Game(idle_wait=False, level=level)
+        rng = random.Random(seed)
+        turns = updates = 0
+        start = time.perf_counter()
+        while True:
+            for _ in range(100):
+                if game.ready():
+                    game.act(rng.choice(ACTIONS))
+                    turns += 1
+                game.update()
+            updates += 100
+            elapsed = time.perf_counter() - start
+            if elapsed >= duration:
+                break
+        turn_rates.append(turns / elapsed)
+        update_rates.append(updates / elapsed)
+    return turn_rates, update_rates
+
+
+def queries(level, seed=0):
+    # Random air cells (in pixels) and grapple directions
+    rng = random.Random(seed)
+    world = level.world
+    result = []
+    while len(result) < QUERIES:
+        x = rng.randrange(world.width)
+        y = rng.randrange(world.height)
+        if not world.is_solid(x, y):
+            dx, dy = rng.choice(((-1, 0), (0, -1), (1, 0)))
+            result.append((x * GRID_SIZE, y * GRID_SIZE, dx, dy))
+    return result
+
+
+def bench_raycasts(level, duration, repeats):
+    sim = Simulation(level)
+    start = sim.snapshot()
+    batch = queries(level)
+
+    def run():
+        sim.restore(start)  # The hook kills crabs
+        find = sim.find_grapple_target
+        for x, y, dx, dy in batch:
+            find(x, y, dx, dy)
+        return len(batch)
+
+    return rates(run, duration, repeats)
+
+
+def bench_falls(level, duration, repeats):
+    world = level.world
+    world.build_distance_index()
+    player = Player(0, 0)
+    batch = queries(level)
+
+    def run():
+        for x, y, _, _ in batch:
+            player.x = x
+            player.y = y
+            player.start_falling(world)
+        return len(batch)
+
+    return rates(run, duration, repeats)
+
+
+def bench_draw(game_module, level, duration, repeats, full, seed=0):
+    # Median Game.draw time while a random agent plays, in each of the repeats;
+    # full=True redraws everything every frame
+    medians = []
+    for _ in range(repeats):
+        game = game_module.Game(idle_wait=False, level=level)
+        rng = random.Random(seed)
+        game.draw()
+        times = []
+        start = time.perf_counter()
+        while time.perf_counter() - start < duration:
+            if game.ready():
+                game.act(rng.choice(ACTIONS))
+            game.update()
+            if full:
+                game.scene_rects = None
+            before = time.perf_counter()
+            game.draw()
+            times.append(time.perf_counter() - before)
+        medians.append(sorted(times)[len(times) // 2] * 1000)
+    return medians
+
+
+def run_suite(cases, duration=DURATION, repeats=REPEATS, log=None):
+    # ({"case.metric": median}, {"case.metric": spread}) for the named cases
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")  # Headless; draw timings exclude the display
+    import game as game_module
+
+    results = {}
+    spreads = {}
+
+    def record(key, values):
+        results[key], spreads[key] = summarize(values)
+        if log:
+            log(format_result(key, results[key], spreads[key]))
+
+    for name in cases:
+        scale, density = CASES[name]
+        level = synthetic_level(scale, density)
+        turns, updates = bench_turns(game_module, level, duration, repeats)
+        record(name + ".turns_per_sec", turns)
+        record(name + ".updates_per_sec", updates)
+        record(name + ".raycasts_per_sec", bench_raycasts(level, duration, repeats))
+        record(name + ".falls_per_sec", bench_falls(level, duration, repeats))
+        record(name + ".draw_ms", bench_draw(game_module, level, duration, repeats, full=False))
+        record(name + ".draw_full_ms", bench_draw(game_module, level, duration, repeats, full=True))
+    return results, spreads
+
+
+def format_result(key, value, spread):
+    unit, _ = METRICS[key.split(".", 1)[1]]
+    return "%-28s %12.3f %-10s +-%.1f%%" % (key, value, unit, 100 * spread)
+
+
+def environment():
+    import pygame
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pygame": pygame.version.ver,
+        "machine": platform.machine(),
+        "system": platform.system(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def save_baseline(path, results, spreads):
+    with open(path, "w") as f:
+        json.dump({"version": BASELINE_VERSION, "environment": environment(), "results": results,
+                   "spreads": spreads}, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+
+def load_baseline(path):
+    with open(path) as f:
+        baseline = json.load(f)
+    if baseline.get("version") != BASELINE_VERSION:
+        raise ValueError("%s: unsupported baseline version %r" % (path, baseline.get("version")))
+    return baseline
+
+
+def compare(baseline, results, threshold=THRESHOLD, baseline_spreads=None, spreads=None):
+    # (lines of text, keys that regressed). A change only counts when it is
+    # larger than threshold and than NOISE_FACTOR times both runs' spreads added up.
+    lines = []
+    regressions = []
+    for key in sorted(results):
+        if key not in baseline:
+            continue
+        old = baseline[key]
+        new = results[key]
+        _, higher_is_better = METRICS[key.split(".", 1)[1]]
+        change = (new - old) / old if old else 0.0
+        worse = -change if higher_is_better else change
+        noise = NOISE_FACTOR * ((baseline_spreads or {}).get(key, 0.0) + (spreads or {}).get(key, 0.0))
+        limit = max(threshold, noise)
+        flag = ""
+        if worse > limit:
+            flag = "  REGRESSION"
+            regressions.append(key)
+        elif -worse > limit:
+            flag = "  improved"
+        lines.append("%-28s %12.3f -> %12.3f  %+6.1f%% (noise %4.1f%%)%s" % (
+            key, old, new, 100 * change, 100 * noise, flag))
+    return lines, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Grapplecore on synthetic levels")
+    parser.add_argument("--cases", default=",".join(CASES),
+                        help="comma-separated cases to run (default: %(default)s)")
+    parser.add_argument("--duration", type=float, default=DURATION, help="seconds per measurement")
+    parser.add_argument("--repeats", type=int, default=REPEATS, help="runs per measurement, median kept")
+    parser.add_argument("--save", metavar="PATH", help="write the results as a JSON baseline")
+    parser.add_argument("--compare", metavar="PATH", help="compare against a saved baseline")
+    parser.add_argument("--threshold", type=float, default=THRESHOLD,
+                        help="smallest relative slowdown that counts as a regression; larger run-to-run "
+                             "spreads raise it (default: %(default)s)")
+    parser.add_argument("--confirm", type=int, default=CONFIRM,
+                        help="reruns of cases with regressions before they count (default: %(default)s)")
+    parser.add_argument("--no-rulecheck", action="store_true",
+                        help="skip checking that every copy of the turn rules agrees")
+    args = parser.parse_args()
+
+    cases = args.cases.split(",")
+    for name in cases:
+        if name not in CASES:
+            parser.error("unknown case %r (choose from %s)" % (name, ", ".join(CASES)))
+    baseline = load_baseline(args.compare) if args.compare else None
+
+    if not args.no_rulecheck:
+        import rulecheck
+        mismatches = []
+        failures = rulecheck.run_checks(rulecheck.LEVELS, rulecheck.CHECKS, log=mismatches.append)
+        if failures:
+            print("\n".join(line for line in mismatches if "MISMATCH" in line))
+            print("%d rule check(s) failed; see python rulecheck.py" % failures)
+            sys.exit(1)
+
+    results, spreads = run_suite(cases, args.duration, args.repeats, log=None if baseline else print)
+    if args.save:
+        save_baseline(args.save, results, spreads)
+    if baseline is not None:
+        lines, regressions = compare(baseline["results"], results, args.threshold, baseline["spreads"], spreads)
+        print("\n".join(lines))
+        for _ in range(args.confirm):
+            if not regressions:
+                break
+            rerun = [name for name in cases if any(key.startswith(name + ".") for key in regressions)]
+            again, again_spreads = run_suite(rerun, args.duration, args.repeats)
+            _, still = compare(baseline["results"], again, args.threshold, baseline["spreads"], again_spreads)
+            for key in regressions:
+                if key not in still:
+                    print("%-28s not confirmed by a rerun (%.3f)" % (key, again[key]))
+            regressions = [key for key in regressions if key in still]
+        if regressions:
+            print("%d metric(s) regressed by more than %.0f%%" % (len(regressions), 100 * args.threshold))
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import argparse
+import os
+import queue
+import struct
+import sys
+import threading
+import zlib
+
+import numpy as np
+import pygame
+
+# Gameplay capture without stalling the frame loop. Capture.frame() copies the
+# displayed frame into one of a fixed pool of preallocated buffers and hands it
+# to a worker thread, which encodes it (zlib and file writes release the GIL)
+# and gives the buffer back. The pool bounds how many frames can be waiting:
+# when every buffer is in use, frames are dropped (drop=True, for live play)
+# or frame() waits for the worker (drop=False, for offline rendering).
+#
+# Output: a path ending in .rgb or .raw gets raw RGB24 video, which ffmpeg
+# reads with -f rawvideo -pix_fmt rgb24 -s WxH -r FPS; any other path is a
+# directory for a PNG sequence (frame-000000.png, ... numbered by captured
+# frame, so dropped frames leave gaps).
+
+POOL_SIZE = 8  # Frame buffers, so at most this many frames wait for the worker
+PNG_LEVEL = 1  # zlib level for PNG frames; higher is smaller and slower
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+RAW_EXTENSIONS = (".rgb", ".raw")
+PNG_HEADER = struct.Struct(">2I5B")  # IHDR: width, height, bit depth, color type, compression, filter, interlace
+
+
+def png_chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(data, zlib.crc32(kind)))
+
+
+class Capture:
+    def __init__(self, path, size, fps, pool=POOL_SIZE, drop=True, png_level=PNG_LEVEL):
+        self.path = path
+        self.width, self.height = size
+        self.fps = fps  # Frames per second of the recording, for the ffmpeg hint
+        self.drop = drop
+        self.png_level = png_level
+        self.png = not path.lower().endswith(RAW_EXTENSIONS)
+        self.captured = 0  # Frames offered to frame()
+        self.written = 0
+        self.dropped = 0
+        self.error = None  # Exception raised by the worker, re-raised by close()
+
+        # PNG rows start with a filter type byte (always 0), so PNG buffers carry
+        # that column and the worker compresses them as they are
+        columns = self.width * 3 + (1 if self.png else 0)
+        self.free = queue.Queue()
+        for _ in range(pool):
+            self.free.put(np.zeros((self.height, columns), np.uint8))
+        self.pending = queue.Queue()  # (frame number, buffer), then None to stop
+
+        self.file = None
+        if self.png:
+            os.makedirs(path, exist_ok=True)
+        else:
+            self.file = open(path, "wb")
+        self.worker = threading.Thread(target=self.work, name="capture", daemon=True)
+        self.worker.start()
+
+    def pixels(self, buffer):
+        # The (height, width, 3) RGB part of a pool buffer
+        if self.png:
+            buffer = buffer[:, 1:]
+        return buffer.reshape(self.height, self.width, 3)
+
+    def frame(self, surface):
+        # Copy the surface (as displayed) into a free buffer and queue it for encoding
+        number = self.captured
+        self.captured += 1
+        try:
+            buffer = self.free.get(block=not self.drop)
+        except queue.Empty:
+            self.dropped += 1
+            return False
+        view = pygame.surfarray.pixels3d(surface)  # (width, height, 3), no copy
+        np.copyto(self.pixels(buffer), view.transpose(1, 0, 2))
+        del view  # Unlocks the surface
+        self.pending.put((number, buffer))
+        return True
+
+    def work(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                return
+            number, buffer = item
+            try:
+                if self.error is None:
+                    self.write(number, buffer)
+                    self.written += 1
+            except Exception as error:
+                self.error = error  # Keep taking frames so frame() never waits forever
+            self.free.put(buffer)
+
+    def write(self, number, buffer):
+        if not self.png:
+            self.file.write(buffer)
+            return
+        header = PNG_HEADER.pack(self.width, self.height, 8, 2, 0, 0, 0)  # 8-bit RGB
+        with open(os.path.join(self.path, "frame-%06d.png" % number), "wb") as f:
+            f.write(PNG_SIGNATURE)
+            f.write(png_chunk(b"IHDR", header))
+            f.write(png_chunk(b"IDAT", zlib.compress(buffer, self.png_level)))
+            f.write(png_chunk(b"IEND", b""))
+
+    def close(self):
+        # Wait for every queued frame to be written
+        self.pending.put(None)
+        self.worker.join()
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        if self.error is not None:
+            raise self.error
+
+    def report(self):
+        line = "captured %d frames to %s (%d dropped)" % (self.written, self.path, self.dropped)
+        if not self.png:
+            line += "; ffmpeg -f rawvideo -pix_fmt rgb24 -s %dx%d -r %d -i %s" % (
+                self.width, self.height, self.fps, self.path)
+        return line
+
+
+def render_replay(game, replayer, capture, max_frames=None):
+    # Play a replay to its end as fast as frames can be drawn and captured,
+    # one simulation step per frame (so the video runs at the tick rate)
+    frames = 0
+    game.draw()
+    capture.frame(game.screen)
+    while not (replayer.finished and game.is_idle()) and frames != max_frames:
+        game.handle_input([])
+        game.remember_positions()
+        game.update()
+        game.draw()
+        capture.frame(game.screen)
+        frames += 1
+    return frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render a Grapplecore input log to frames without a window")
+    parser.add_argument("log")
+    parser.add_argument("out", help="directory for a PNG sequence, or a .rgb/.raw file for raw RGB24 video")
+    parser.add_argument("--seek", type=int, metavar="TURN", help="start rendering at this turn")
+    parser.add_argument("--max-frames", type=int, metavar="N")
+    parser.add_argument("--png-level", type=int, default=PNG_LEVEL, help="zlib level for PNG frames")
+    args = parser.parse_args()
+
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import game
+    from replay import InputLog, Replayer
+
+    log = InputLog.load(args.log)
+    session = game.Game(idle_wait=False, level=game.open_level(log.level, log.chunks))
+    replayer = Replayer(session, log)
+    session.replay = replayer
+    if args.seek:
+        replayer.seek(args.seek)
+    capture = Capture(args.out, session.screen.get_size(), session.tick_rate, drop=False, png_level=args.png_level)
+    render_replay(session, replayer, capture, args.max_frames)
+    capture.close()
+    print(capture.report(), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
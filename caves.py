@@ -0,0 +1,238 @@
+import argparse
+import hashlib
+import json
+import os
+import sys
+
+import numpy as np
+
+from grid import Tile, TileGrid
+from level import BAT_DTYPE, CRAB_DTYPE, POISON_DTYPE, Level, load_level, write_level
+from solver import solve
+
+# Seeded procedural caves. Every pass works on whole NumPy arrays: random
+# fill, cellular-automata smoothing, ledges in open space, and a flood fill
+# that spreads along entire horizontal and vertical runs of air at a time.
+# Layouts where the spawn point's cave is too small a part of the open space
+# are rejected and re-rolled; with verify=True, so are caves the solver
+# cannot finish (air connectivity alone ignores how the player moves).
+# Entities follow the debug room's rules: crabs patrol `range` cells to the
+# right along ground, bats patrol a column between its ceiling and floor,
+# poison lies on the ground, and the exit sits on the ground far from the
+# spawn point.
+#
+# cached_cave() keeps every generated level as a level file named after a hash
+# of the generator version and parameters, so the same cave loads instantly
+# the next time.
+
+GENERATOR_VERSION = 1  # Bump when the output for the same parameters changes
+CACHE_DIR = "caves"
+WIDTH = 160
+HEIGHT = 120
+FILL = 0.45  # Initial share of rock
+SMOOTHING = 5  # Cellular-automata passes
+LEDGES = 1 / 300  # Ledges per cell of open space
+CRABS = 1 / 256  # Entities per cell of level area, as in the debug room
+BATS = 1 / 768
+POISON = 1 / 256
+CRAB_RANGE = 4
+SAFE_RADIUS = 6  # Cells around the spawn point kept free of enemies and poison
+MIN_REACHABLE = 0.6  # Share of the open space the spawn point's cave must cover
+MAX_ATTEMPTS = 20
+VERIFY_STATES = 200000  # Solver states per attempt with verify=True
+
+
+def neighbor_counts(solid):
+    # Solid cells among the 8 neighbors of every cell; outside the level counts as solid
+    padded = np.pad(solid, 1, constant_values=True).astype(np.uint8)
+    height, width = solid.shape
+    counts = np.zeros(solid.shape, np.uint8)
+    for dy in (0, 1, 2):
+        for dx in (0, 1, 2):
+            if dx != 1 or dy != 1:
+                counts += padded[dy:dy + height, dx:dx + width]
+    return counts
+
+
+def smooth(solid, passes):
+    # 4-5 rule: rock with 4 or more rock neighbors stays, air with 5 or more turns to rock
+    for _ in range(passes):
+        counts = neighbor_counts(solid)
+        solid = (counts >= 5) | (solid & (counts >= 4))
+    return solid
+
+
+def run_labels(air):
+    # Label every maximal horizontal run of air cells (1, 2, ...); rock is 0
+    starts = air.copy()
+    starts[:, 1:] &= ~air[:, :-1]
+    return np.cumsum(starts).reshape(air.shape) * air
+
+
+def flood(air, start):
+    # Air cells 4-connected to start. Each pass spreads through whole rows and then
+    # whole columns of air, so it takes as many passes as the path has bends.
+    rows = run_labels(air)
+    columns = run_labels(air.T).T
+    reached = np.zeros(air.shape, bool)
+    reached[start[1], start[0]] = True
+    count = 1
+    while True:
+        for labels in (rows, columns):
+            hit = np.zeros(labels.max() + 1, bool)
+            hit[labels[reached]] = True
+            hit[0] = False
+            reached = hit[labels]
+        new_count = int(reached.sum())
+        if new_count == count:
+            return reached
+        count = new_count
+
+
+def place_ledges(solid, rng, density):
+    # Short horizontal rock ledges in open space, so high caves can be climbed
+    open_space = neighbor_counts(solid) == 0
+    ys, xs = np.nonzero(open_space)
+    count = int(len(xs) * density)
+    if count == 0:
+        return solid
+    chosen = rng.choice(len(xs), count, replace=False)
+    lengths = rng.integers(3, 7, count)
+    solid = solid.copy()
+    width = solid.shape[1]
+    for x, y, length in zip(xs[chosen].tolist(), ys[chosen].tolist(), lengths.tolist()):
+        solid[y, max(x - length // 2, 1):min(x + (length + 1) // 2, width - 1)] = True
+    return solid
+
+
+def pick(rng, mask, count):
+    # Up to count random (x, y) cells where mask is True
+    ys, xs = np.nonzero(mask)
+    chosen = rng.choice(len(xs), min(count, len(xs)), replace=False)
+    return xs[chosen], ys[chosen]
+
+
+def layout(width, height, rng, fill, smoothing, ledges):
+    solid = rng.random((height, width)) < fill
+    solid = smooth(solid, smoothing)
+    solid = place_ledges(solid, rng, ledges)
+    solid[0, :] = solid[-1, :] = True
+    solid[:, 0] = solid[:, -1] = True
+    return solid
+
+
+def generate_cave(seed, width=WIDTH, height=HEIGHT, fill=FILL, smoothing=SMOOTHING, ledges=LEDGES,
+                  crabs=CRABS, bats=BATS, poison=POISON, verify=False):
+    # A random, reachable cave Level; the same arguments always give the same cave
+    for attempt in range(MAX_ATTEMPTS):
+        rng = np.random.default_rng([seed, attempt])
+        solid = layout(width, height, rng, fill, smoothing, ledges)
+        air = ~solid
+        standing = air.copy()  # Air with rock right below
+        standing[:-1] &= solid[1:]
+        standing[-1] = False
+        if not standing.any():
+            continue
+
+        # Spawn on the ground nearest the left edge, then keep its cave
+        columns = np.nonzero(standing.any(axis=0))[0]
+        spawn_x = int(columns[0])
+        spawn_y = int(rng.choice(np.nonzero(standing[:, spawn_x])[0]))
+        reached = flood(air, (spawn_x, spawn_y))
+        if reached.sum() < MIN_REACHABLE * air.sum():
+            continue
+        ground = standing & reached
+
+        # Exit: the reachable ground cell farthest from the spawn point
+        ys, xs = np.nonzero(ground)
+        far = np.argmax(np.abs(xs - spawn_x) + np.abs(ys - spawn_y))
+        exit_x, exit_y = int(xs[far]), int(ys[far])
+
+        ys, xs = np.mgrid[0:height, 0:width]
+        allowed = reached & ((np.abs(xs - spawn_x) > SAFE_RADIUS) | (np.abs(ys - spawn_y) > SAFE_RADIUS))
+        allowed[exit_y, exit_x] = False
+
+        # Crabs need ground under their whole patrol
+        labels = run_labels(ground)
+        ends = ground.copy()
+        ends[:, :-1] &= ~ground[:, 1:]
+        run_end = np.zeros(labels.max() + 1, np.int64)
+        run_end[labels[ends]] = xs[ends]
+        walk = (run_end[labels] - xs + 1) * ground  # Ground cells from each cell to the end of its run
+        crab_x, crab_y = pick(rng, allowed & (walk > CRAB_RANGE), int(width * height * crabs))
+
+        # Bats patrol from the top to the bottom of their column of air
+        rows = np.arange(height)[:, None]
+        ceiling = np.maximum.accumulate(np.where(solid, rows, -1), axis=0) + 1  # First air row of the run
+        floor = np.flip(np.minimum.accumulate(np.flip(np.where(solid, rows, height), axis=0), axis=0), axis=0) - 1
+        bat_x, bat_y = pick(rng, allowed & (floor - ceiling >= 4), int(width * height * bats))
+
+        poison_x, poison_y = pick(rng, allowed & ground, int(width * height * poison))
+
+        tiles = np.where(solid, np.uint8(Tile.ROCK), np.uint8(Tile.AIR))
+        surface = solid.copy()  # Rock with air right above is ground
+        surface[1:] &= air[:-1]
+        surface[0] = False
+        tiles[surface] = Tile.GROUND
+        world = TileGrid(width, height)
+        world.tiles[:, :] = tiles
+
+        level = Level(
+            world,
+            spawn_cell=(spawn_x, spawn_y),
+            exit_cell=(exit_x, exit_y),
+            bats=np.array(list(zip(bat_x.tolist(), bat_y.tolist(), ceiling[bat_y, bat_x].tolist(),
+                                   floor[bat_y, bat_x].tolist())), BAT_DTYPE).reshape(-1),
+            crabs=np.array([(x, y, CRAB_RANGE) for x, y in zip(crab_x.tolist(), crab_y.tolist())],
+                           CRAB_DTYPE).reshape(-1),
+            poison=np.array(list(zip(poison_x.tolist(), poison_y.tolist())), POISON_DTYPE).reshape(-1),
+        )
+        if verify and not solve(level, VERIFY_STATES, stop_at_exit=True).reachable:
+            continue
+        return level
+    raise ValueError("no reachable cave for seed %d after %d attempts" % (seed, MAX_ATTEMPTS))
+
+
+def cave_path(seed, cache_dir=CACHE_DIR, **params):
+    # Cached level file for a seed and generate_cave() parameters, generated if missing
+    params = dict(dict(width=WIDTH, height=HEIGHT, fill=FILL, smoothing=SMOOTHING, ledges=LEDGES,
+                       crabs=CRABS, bats=BATS, poison=POISON, verify=False), **params)
+    key = json.dumps({"version": GENERATOR_VERSION, "seed": seed, "params": params}, sort_keys=True)
+    path = os.path.join(cache_dir, "cave-%d-%s.gclv" % (seed, hashlib.sha1(key.encode()).hexdigest()[:12]))
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        partial = path + ".tmp"
+        write_level(partial, generate_cave(seed, **params))
+        os.replace(partial, path)  # Never leave a half-written cave in the cache
+    return path
+
+
+def cached_cave(seed, cache_dir=CACHE_DIR, **params):
+    return load_level(cave_path(seed, cache_dir, **params))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate (or find in the cache) a procedural Grapplecore cave")
+    parser.add_argument("seed", type=int)
+    parser.add_argument("--width", type=int, default=WIDTH)
+    parser.add_argument("--height", type=int, default=HEIGHT)
+    parser.add_argument("--fill", type=float, default=FILL, help="initial share of rock")
+    parser.add_argument("--smoothing", type=int, default=SMOOTHING, help="cellular-automata passes")
+    parser.add_argument("--verify", action="store_true", help="only keep caves the solver can finish")
+    parser.add_argument("--cache", default=CACHE_DIR, metavar="DIR")
+    parser.add_argument("--out", metavar="PATH", help="also copy the level file here")
+    args = parser.parse_args()
+
+    path = cave_path(args.seed, args.cache, width=args.width, height=args.height,
+                     fill=args.fill, smoothing=args.smoothing, verify=args.verify)
+    level = load_level(path)
+    if args.out:
+        write_level(args.out, level)
+    print(path)
+    print("%dx%d, spawn %d,%d, exit %d,%d, %d bats, %d crabs, %d poison" % (
+        level.world.width, level.world.height, level.spawn_x, level.spawn_y, level.exit_x, level.exit_y,
+        len(level.bats), len(level.crabs), len(level.poison)), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
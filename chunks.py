@@ -0,0 +1,182 @@
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from grid import TILE_SOLID, Tile, TileGrid
+
+# Chunked, streamed worlds for levels much larger than the screen. Tiles live
+# on disk as fixed-size square chunks; ChunkedWorld loads them on demand,
+# keeps recently used ones in an LRU cache under a memory budget and offers
+# the same queries as TileGrid (is_solid, free_run, set, region, ...).
+
+CHUNK_SIZE = 64  # Chunk width and height in cells
+MEMORY_BUDGET = 64 * 1024 * 1024  # Bytes of resident chunks (tiles plus distance index)
+META_FILE = "level.json"
+
+
+class ChunkStore:
+    # A directory holding level.json (size, chunk size, fill tile) and one
+    # raw file per chunk, chunk_size * chunk_size bytes in row-major order.
+    # Chunks without a file are filled with the fill tile.
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, META_FILE)) as f:
+            meta = json.load(f)
+        self.width = meta["width"]
+        self.height = meta["height"]
+        self.chunk_size = meta["chunk_size"]
+        self.fill = meta.get("fill", Tile.AIR)
+
+    @classmethod
+    def create(cls, directory, width, height, chunk_size=CHUNK_SIZE, fill=Tile.AIR):
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, META_FILE), "w") as f:
+            json.dump({"width": width, "height": height, "chunk_size": chunk_size, "fill": int(fill)}, f)
+        return cls(directory)
+
+    def chunk_path(self, cx, cy):
+        return os.path.join(self.directory, "%d_%d.chunk" % (cx, cy))
+
+    def read_chunk(self, cx, cy):
+        try:
+            with open(self.chunk_path(cx, cy), "rb") as f:
+                return bytearray(f.read())
+        except FileNotFoundError:
+            return bytearray([self.fill]) * (self.chunk_size * self.chunk_size)
+
+    def write_chunk(self, cx, cy, cells):
+        with open(self.chunk_path(cx, cy), "wb") as f:
+            f.write(cells)
+
+
+def save_chunked(grid, directory, chunk_size=CHUNK_SIZE):
+    # Split a TileGrid into a chunk store on disk
+    store = ChunkStore.create(directory, grid.width, grid.height, chunk_size)
+    for cy in range(0, grid.height, chunk_size):
+        for cx in range(0, grid.width, chunk_size):
+            block = np.full((chunk_size, chunk_size), store.fill, np.uint8)
+            part = grid.tiles[cy:cy + chunk_size, cx:cx + chunk_size]
+            block[:part.shape[0], :part.shape[1]] = part
+            store.write_chunk(cx // chunk_size, cy // chunk_size, block.tobytes())
+    return store
+
+
+class ChunkedWorld:
+    def __init__(self, store, memory_budget=MEMORY_BUDGET):
+        self.store = store
+        self.width = store.width
+        self.height = store.height
+        self.chunk_size = store.chunk_size
+        self.columns = -(-self.width // self.chunk_size)
+        self.rows = -(-self.height // self.chunk_size)
+
+        # Each resident chunk costs its tiles plus four uint16 distance arrays
+        chunk_bytes = self.chunk_size * self.chunk_size * 9
+        self.max_chunks = max(1, memory_budget // chunk_bytes)
+        self.chunks = OrderedDict()  # (cx, cy) -> TileGrid, least recently used first
+        self.dirty = set()  # Edited chunks to write back on eviction
+        self.version = 0
+        self.loads = 0
+
+    def chunk(self, cx, cy):
+        key = (cx, cy)
+        chunk = self.chunks.get(key)
+        if chunk is not None:
+            self.chunks.move_to_end(key)
+            return chunk
+
+        chunk = TileGrid(self.chunk_size, self.chunk_size, self.store.read_chunk(cx, cy))
+        # Cells past the world edge are solid so runs stop at the boundary
+        edge_x = self.width - cx * self.chunk_size
+        edge_y = self.height - cy * self.chunk_size
+        chunk.tiles[:, max(edge_x, 0):] = Tile.ROCK
+        chunk.tiles[max(edge_y, 0):, :] = Tile.ROCK
+        chunk.build_distance_index()
+        self.chunks[key] = chunk
+        self.loads += 1
+
+        while len(self.chunks) > self.max_chunks:
+            self.evict()
+        return chunk
+
+    def evict(self):
+        key, chunk = self.chunks.popitem(last=False)
+        if key in self.dirty:
+            self.store.write_chunk(key[0], key[1], chunk.cells)
+            self.dirty.discard(key)
+
+    def flush(self):
+        # Write every edited chunk back to disk
+        for key in self.dirty:
+            self.store.write_chunk(key[0], key[1], self.chunks[key].cells)
+        self.dirty.clear()
+
+    def prefetch(self, x0, y0, x1, y1):
+        # Make sure the chunks covering cells [x0, x1) x [y0, y1) are resident
+        size = self.chunk_size
+        for cy in range(max(y0, 0) // size, min(-(-y1 // size), self.rows)):
+            for cx in range(max(x0, 0) // size, min(-(-x1 // size), self.columns)):
+                self.chunk(cx, cy)
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def get(self, x, y):
+        cx, lx = divmod(x, self.chunk_size)
+        cy, ly = divmod(y, self.chunk_size)
+        return self.chunk(cx, cy).get(lx, ly)
+
+    def is_solid(self, x, y):
+        # Anything outside the world counts as solid
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return TILE_SOLID[self.get(x, y)] == 1
+        return True
+
+    def set(self, x, y, tile):
+        cx, lx = divmod(x, self.chunk_size)
+        cy, ly = divmod(y, self.chunk_size)
+        chunk = self.chunk(cx, cy)
+        if chunk.get(lx, ly) != tile:
+            chunk.set(lx, ly, tile)
+            self.dirty.add((cx, cy))
+            self.version += 1
+
+    def build_distance_index(self):
+        pass  # Every chunk indexes itself when it is loaded
+
+    def free_run(self, x, y, dx, dy):
+        # Same as TileGrid.free_run, following the run across chunk borders
+        size = self.chunk_size
+        run = 0
+        while True:
+            cx, lx = divmod(x, size)
+            cy, ly = divmod(y, size)
+            local = self.chunk(cx, cy).free_run(lx, ly, dx, dy)
+            run += local
+            next_x = x + dx * (local + 1)
+            next_y = y + dy * (local + 1)
+            # Stopped inside the chunk means a solid tile (or the world edge) was hit
+            if 0 <= lx + dx * (local + 1) < size and 0 <= ly + dy * (local + 1) < size:
+                return run
+            if self.is_solid(next_x, next_y):
+                return run
+            run += 1
+            x, y = next_x, next_y
+
+    def region(self, x0, y0, x1, y1):
+        # Tile codes for cells [x0, x1) x [y0, y1), clipped to the world
+        x0, y0 = max(x0, 0), max(y0, 0)
+        x1, y1 = min(x1, self.width), min(y1, self.height)
+        tiles = np.zeros((max(y1 - y0, 0), max(x1 - x0, 0)), np.uint8)
+        size = self.chunk_size
+        for cy in range(y0 // size, -(-y1 // size)):
+            for cx in range(x0 // size, -(-x1 // size)):
+                chunk = self.chunk(cx, cy)
+                top, left = cy * size, cx * size
+                ys = slice(max(y0, top), min(y1, top + size))
+                xs = slice(max(x0, left), min(x1, left + size))
+                tiles[ys.start - y0:ys.stop - y0, xs.start - x0:xs.stop - x0] = \
+                    chunk.tiles[ys.start - top:ys.stop - top, xs.start - left:xs.stop - left]
+        return tiles
@@ -0,0 +1,351 @@
+from array import array
+
+import numpy as np
+
+# Structure-of-arrays storage for patrolling enemies. Every enemy of a kind
+# lives in one PatrolGroup and the whole group advances in one vectorized step.
+#
+# A step can be limited to an area: enemies whose patrol cannot reach it stay
+# where they are and count the steps they missed (lag). Patrols repeat, so an
+# enemy catches up in at most a couple of patrol lengths once its patrol
+# reaches the area again, and ends where it would have been had it never
+# stopped. As long as the area keeps containing the player (Game's camera
+# area does), limiting steps to it does not change the game; rulecheck.py's
+# "camera" check plays the same inputs with and without it to confirm that.
+
+HORIZONTAL = 0  # Patrols along x (amber crabs)
+VERTICAL = 1  # Patrols along y (bats)
+VECTORIZE_MIN = 32  # Below this many enemies a plain loop beats NumPy's per-call overhead
+
+# Packed columns: name, array typecode, NumPy dtype of the same layout
+FIELDS = (
+    ("x", "i", np.int32),
+    ("y", "i", np.int32),
+    ("direction", "i", np.int32),  # +1 towards high, -1 towards low
+    ("low", "i", np.int32),  # Patrol bounds along the axis
+    ("high", "i", np.int32),
+    ("alive", "b", np.bool_),
+    ("lag", "i", np.int32),  # Steps missed while outside the stepped area
+)
+ROW_BYTES = sum(array(typecode).itemsize for _, typecode, _ in FIELDS)  # One enemy in a snapshot
+
+
+class PatrolGroup:
+    # Each column is an array.array (fast scalar access, raw_<name>) with a
+    # zero-copy NumPy view of the same memory (vectorized access, <name>)
+    def __init__(self, axis, cell_size, occupancy=None, capacity=16):
+        self.axis = axis
+        self.cell_size = cell_size
+        self.occupancy = occupancy  # Optional OccupancyGrid kept in step with positions
+        self.count = 0
+        self.capacity = 0
+        self.grow(capacity)
+
+    def __len__(self):
+        return self.count
+
+    def grow(self, capacity):
+        for name, typecode, dtype in FIELDS:
+            raw = array(typecode, bytes(capacity * array(typecode).itemsize))
+            if self.capacity:
+                raw[:self.count] = getattr(self, "raw_" + name)[:self.count]
+            setattr(self, "raw_" + name, raw)
+            setattr(self, name, np.frombuffer(raw, dtype))
+        # Byte views of the columns with their item sizes, for snapshots
+        self.column_bytes = [(memoryview(getattr(self, "raw_" + name)).cast("B"), array(typecode).itemsize)
+                             for name, typecode, _ in FIELDS]
+        self.capacity = capacity
+
+    def add(self, x, y, low, high, direction=1):
+        # Returns the new enemy's index
+        if self.count == self.capacity:
+            self.grow(self.capacity * 2)
+        i = self.count
+        self.raw_x[i] = x
+        self.raw_y[i] = y
+        self.raw_direction[i] = direction
+        self.raw_low[i] = low
+        self.raw_high[i] = high
+        self.raw_alive[i] = 1
+        self.raw_lag[i] = 0
+        self.count += 1
+        if self.occupancy is not None:
+            self.occupancy.add(self.cell(i))
+        return i
+
+    def add_many(self, xs, ys, low, high):
+        # Append a batch of enemies from arrays, all starting towards high
+        count = len(xs)
+        if self.count + count > self.capacity:
+            self.grow(max(self.capacity * 2, self.count + count))
+        new = slice(self.count, self.count + count)
+        self.x[new] = xs
+        self.y[new] = ys
+        self.direction[new] = 1
+        self.low[new] = low
+        self.high[new] = high
+        self.alive[new] = True
+        self.lag[new] = 0
+        self.count += count
+        if self.occupancy is not None:
+            self.occupancy.add_many(self.x[new] // self.cell_size, self.y[new] // self.cell_size)
+
+    def cell(self, i):
+        return self.raw_x[i] // self.cell_size, self.raw_y[i] // self.cell_size
+
+    def cells(self, mask):
+        # Grid cells of the enemies selected by mask, as (xs, ys)
+        n = self.count
+        return self.x[:n][mask] // self.cell_size, self.y[:n][mask] // self.cell_size
+
+    def in_area(self, area):
+        # Mask of enemies whose cell lies in area = (x0, y0, x1, y1), half-open
+        n = self.count
+        x0, y0, x1, y1 = area
+        cell_x = self.x[:n] // self.cell_size
+        cell_y = self.y[:n] // self.cell_size
+        return (cell_x >= x0) & (cell_x < x1) & (cell_y >= y0) & (cell_y < y1)
+
+    def reaches(self, area):
+        # Mask of enemies whose patrol (with a cell to spare, and the current
+        # position) touches area = (x0, y0, x1, y1) in cells, half-open
+        n = self.count
+        x0, y0, x1, y1 = area
+        if self.axis == HORIZONTAL:
+            along, across, start, end = self.x[:n], self.y[:n], x0, x1
+            cross_start, cross_end = y0, y1
+        else:
+            along, across, start, end = self.y[:n], self.x[:n], y0, y1
+            cross_start, cross_end = x0, x1
+        low = np.minimum(self.low[:n], along) // self.cell_size - 1
+        high = np.maximum(self.high[:n], along) // self.cell_size + 1
+        across = across // self.cell_size
+        return (high >= start) & (low < end) & (across >= cross_start) & (across < cross_end)
+
+    def reaches_one(self, i, area):
+        # Scalar version of reaches()
+        x0, y0, x1, y1 = area
+        along, across = (self.raw_x[i], self.raw_y[i]) if self.axis == HORIZONTAL else (self.raw_y[i], self.raw_x[i])
+        start, end, cross_start, cross_end = (x0, x1, y0, y1) if self.axis == HORIZONTAL else (y0, y1, x0, x1)
+        low = min(self.raw_low[i], along) // self.cell_size - 1
+        high = max(self.raw_high[i], along) // self.cell_size + 1
+        return high >= start and low < end and cross_start <= across // self.cell_size < cross_end
+
+    def catch_up(self, area=None):
+        # Bring lagging living enemies whose patrol reaches area (None: all of them) up to date
+        n = self.count
+        behind = self.alive[:n] & (self.lag[:n] > 0)
+        if area is not None and behind.any():
+            behind &= self.reaches(area)
+        if not behind.any():
+            return
+        if self.occupancy is not None:
+            self.occupancy.remove_many(*self.cells(behind))
+        # After reaching its patrol bounds an enemy repeats every 2 * length steps
+        # (2 for a patrol of no length), so skip whole rounds beyond that
+        position = (self.x if self.axis == HORIZONTAL else self.y)[:n]
+        low = self.low[:n]
+        high = self.high[:n]
+        period = np.maximum(2, 2 * (high - low) // self.cell_size)
+        settle = period + np.maximum(0, np.maximum(low - position, position - high)) // self.cell_size + 2
+        lag = self.lag[:n]
+        remaining = np.where(lag > settle, settle + (lag - settle) % period, lag) * behind
+        while True:
+            moving = remaining > 0
+            if not moving.any():
+                break
+            self.advance(moving)
+            remaining -= moving
+        lag[behind] = 0
+        if self.occupancy is not None:
+            self.occupancy.add_many(*self.cells(behind))
+
+    def advance(self, mask):
+        # Move the enemies selected by mask one grid space, without touching the occupancy index
+        n = self.count
+        position = (self.x if self.axis == HORIZONTAL else self.y)[:n]
+        direction = self.direction[:n]
+        position += direction * mask * self.cell_size
+        turn = mask & (((direction == 1) & (position >= self.high[:n])) | ((direction == -1) & (position <= self.low[:n])))
+        direction[turn] *= -1
+
+    def step(self, area=None):
+        # Move every living enemy one grid space along its patrol, turning at the bounds.
+        # With an area, enemies whose patrol cannot reach it only count the missed step.
+        n = self.count
+        if n < VECTORIZE_MIN:
+            for i in range(n):
+                if not self.raw_alive[i]:
+                    continue
+                if area is None or self.reaches_one(i, area):
+                    if self.raw_lag[i]:
+                        self.catch_up_one(i)
+                    self.step_one(i)
+                else:
+                    self.raw_lag[i] += 1
+            return
+
+        alive = self.alive[:n]
+        if area is not None:
+            active = alive & self.reaches(area)
+            self.lag[:n] += alive & ~active
+            alive = active
+        if (self.lag[:n][alive] > 0).any():
+            self.catch_up(area)
+
+        if self.occupancy is not None:
+            self.occupancy.remove_many(*self.cells(alive))
+        self.advance(alive)
+        if self.occupancy is not None:
+            self.occupancy.add_many(*self.cells(alive))
+
+    def catch_up_one(self, i):
+        # Scalar version of catch_up() for a single enemy
+        low = self.raw_low[i]
+        high = self.raw_high[i]
+        position = self.raw_x[i] if self.axis == HORIZONTAL else self.raw_y[i]
+        period = max(2, 2 * (high - low) // self.cell_size)
+        settle = period + max(0, low - position, position - high) // self.cell_size + 2
+        lag = self.raw_lag[i]
+        if lag > settle:
+            lag = settle + (lag - settle) % period
+        self.raw_lag[i] = 0
+        for _ in range(lag):
+            self.step_one(i)
+
+    def step_one(self, i):
+        # Scalar version of step() for a single enemy
+        if not self.raw_alive[i]:
+            return
+        old_cell = self.cell(i)
+        position = self.raw_x if self.axis == HORIZONTAL else self.raw_y
+        if self.raw_direction[i] == 1:
+            position[i] += self.cell_size
+            if position[i] >= self.raw_high[i]:
+                self.raw_direction[i] = -1
+        else:
+            position[i] -= self.cell_size
+            if position[i] <= self.raw_low[i]:
+                self.raw_direction[i] = 1
+        if self.occupancy is not None:
+            self.occupancy.move(old_cell, self.cell(i))
+
+    def move_to(self, i, x, y):
+        old_cell = self.cell(i)
+        self.raw_x[i] = x
+        self.raw_y[i] = y
+        if self.occupancy is not None and self.raw_alive[i]:
+            self.occupancy.move(old_cell, self.cell(i))
+
+    def kill(self, i):
+        if self.raw_alive[i]:
+            self.raw_alive[i] = 0
+            if self.occupancy is not None:
+                self.occupancy.remove(self.cell(i))
+
+    def revive(self, i):
+        if not self.raw_alive[i]:
+            self.raw_alive[i] = 1
+            if self.occupancy is not None:
+                self.occupancy.add(self.cell(i))
+
+    def find_at(self, cell):
+        # Lowest index of a living enemy in the grid cell, or None
+        n = self.count
+        hits = np.flatnonzero(self.alive[:n] & (self.x[:n] // self.cell_size == cell[0]) & (self.y[:n] // self.cell_size == cell[1]))
+        if len(hits) == 0:
+            return None
+        return int(hits[0])
+
+    def snapshot(self):
+        # The first `count` entries of every column, packed back to back (count * ROW_BYTES bytes)
+        n = self.count
+        return b"".join([column[:n * size] for column, size in self.column_bytes])
+
+    def restore(self, data):
+        # Inverse of snapshot() for a group of the same size
+        self.occupy(-1)
+        n = self.count
+        offset = 0
+        for column, size in self.column_bytes:
+            size *= n
+            column[:size] = data[offset:offset + size]
+            offset += size
+        self.occupy(1)
+
+    def occupy(self, sign):
+        # Add (1) or remove (-1) every living enemy in the occupancy index
+        if self.occupancy is None:
+            return
+        n = self.count
+        if n < VECTORIZE_MIN:
+            change = self.occupancy.add if sign > 0 else self.occupancy.remove
+            for i in range(n):
+                if self.raw_alive[i]:
+                    change(self.cell(i))
+        elif sign > 0:
+            self.occupancy.add_many(*self.cells(self.alive[:n]))
+        else:
+            self.occupancy.remove_many(*self.cells(self.alive[:n]))
+
+    def alive_positions(self, area=None):
+        # Pixel positions of every living enemy (optionally only those in area), as plain Python ints
+        n = self.count
+        alive = self.alive[:n]
+        if area is not None:
+            alive = alive & self.in_area(area)
+        return zip(self.x[:n][alive].tolist(), self.y[:n][alive].tolist())
+
+
+class PatrolView:
+    # Object-style access to one enemy in a PatrolGroup
+    __slots__ = ("group", "index")
+
+    def __init__(self, group, index):
+        self.group = group
+        self.index = index
+
+    @classmethod
+    def of(cls, group, index):
+        # View of an enemy already in the group
+        view = cls.__new__(cls)
+        PatrolView.__init__(view, group, index)
+        return view
+
+    @property
+    def x(self):
+        return self.group.raw_x[self.index]
+
+    @x.setter
+    def x(self, value):
+        self.group.move_to(self.index, value, self.y)
+
+    @property
+    def y(self):
+        return self.group.raw_y[self.index]
+
+    @y.setter
+    def y(self, value):
+        self.group.move_to(self.index, self.x, value)
+
+    @property
+    def direction(self):
+        return self.group.raw_direction[self.index]
+
+    @direction.setter
+    def direction(self, value):
+        self.group.raw_direction[self.index] = value
+
+    @property
+    def alive(self):
+        return self.group.raw_alive[self.index] == 1
+
+    @alive.setter
+    def alive(self, value):
+        if value:
+            self.group.revive(self.index)
+        else:
+            self.group.kill(self.index)
+
+    def update(self):
+        self.group.step_one(self.index)
@@ -1,14 +1,36 @@
+import argparse
 import pygame
+import struct
 import sys
-import math
+import time
+from collections import OrderedDict, deque
+
+from capture import Capture
+from caves import cave_path
+from chunks import ChunkedWorld, ChunkStore
+from grid import TILE_SOLID_LOOKUP, Tile
+from level import default_level, load_level
+from profiler import Profiler
+from replay import UNDO, InputLog, Replayer
+from simulation import GRID_SIZE, Action, Outcome, Simulation
 
 # Initialize Pygame
 pygame.init()
 
 # Constants
-GRID_SIZE = 32
 SCREEN_WIDTH = 1024
 SCREEN_HEIGHT = 768
+RENDER_CHUNK = 16  # Terrain is pre-rendered in square blocks of this many cells
+RENDER_CACHE_SIZE = 48  # Pre-rendered terrain blocks kept around
+TICK_RATE = 60  # Simulation steps per second, whatever the frame rate
+FPS = 60  # Frame rate cap (0 draws as fast as possible)
+MAX_CATCH_UP = 5  # Steps per frame at most after a hitch; time beyond that is dropped
+SIM_MARGIN = 16  # Cells beyond the screen edge where enemies keep moving
+UNDO_DEPTH = 100  # Moves that can be taken back
+UNDO_KEY = pygame.K_z
+PROFILER_KEY = pygame.K_F3  # Shows or hides the profiler overlay
+PROFILER_REFRESH = 15  # Frames between overlay text updates
+GAME_STATE = struct.Struct("<3i2Bi")  # Snapshot header: camera x/y, fade alpha, fading out/in, frame
 CAVE_COLOR = (40, 30, 20)
 PLAYER_COLOR = (200, 150, 100)
 AMBER_COLOR = (255, 191, 0)
@@ -18,416 +40,189 @@ GROUND_COLOR = (60, 45, 30)
 POISON_COLOR = (100, 255, 100)
 EXIT_COLOR = (255, 255, 0)
 CRAB_COLOR = (200, 100, 100)
+TILE_COLORS = {
+    Tile.ROCK: ROCK_COLOR,
+    Tile.GROUND: GROUND_COLOR,
+}
 
-class Bat:
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
-        self.direction = 1  # 1 = moving down, -1 = moving up
-        self.ceiling_y = GRID_SIZE
-        self.floor_y = (SCREEN_HEIGHT // GRID_SIZE - 2) * GRID_SIZE
-    
-    def update(self):
-        # Move one grid space per tick
-        if self.direction == 1:  # Moving down
-            self.y += GRID_SIZE
-            if self.y >= self.floor_y:
-                self.direction = -1  # Switch to moving up
-        else:  # Moving up
-            self.y -= GRID_SIZE
-            if self.y <= self.ceiling_y:
-                self.direction = 1  # Switch to moving down
-
-class AmberCrab:
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
-        self.alive = True
-        self.direction = 1  # 1 = moving right, -1 = moving left
-        self.start_x = x
-        self.move_range = GRID_SIZE * 4  # Move 4 grid spaces back and forth
-    
-    def update(self):
-        if self.alive:
-            # Move one grid space per tick
-            if self.direction == 1:  # Moving right
-                self.x += GRID_SIZE
-                if self.x >= self.start_x + self.move_range:
-                    self.direction = -1  # Switch to moving left
-            else:  # Moving left
-                self.x -= GRID_SIZE
-                if self.x <= self.start_x:
-                    self.direction = 1  # Switch to moving right
-
-class Player:
-    def __init__(self, x, y):
-        self.x = x
-        self.y = y
-        self.grappling = False
-        self.hook_target_x = 0
-        self.hook_target_y = 0
-        self.grapple_ticks_remaining = 0
-        self.falling = False
-        self.fall_ticks_remaining = 0
-        self.fall_delay = 0
-        self.just_moved = False
-        
-    def update(self, world):
-        if self.grappling:
-            # Grid-based grappling - move one grid space every 3 ticks (slower)
-            if self.grapple_ticks_remaining > 0:
-                # Only move every 3 ticks
-                if self.grapple_ticks_remaining % 3 == 0:
-                    dx = self.hook_target_x - self.x
-                    dy = self.hook_target_y - self.y
-                    
-                    # Move one grid space towards target
-                    if abs(dx) > abs(dy):
-                        # Move horizontally
-                        if dx > 0:
-                            self.x += GRID_SIZE
-                        else:
-                            self.x -= GRID_SIZE
-                    else:
-                        # Move vertically
-                        if dy > 0:
-                            self.y += GRID_SIZE
-                        else:
-                            self.y -= GRID_SIZE
-                
-                self.grapple_ticks_remaining -= 1
-            else:
-                # Grappling complete
-                self.stop_grappling()
-        elif self.falling:
-            # Grid-based falling with delay - move one grid space down per tick
-            if self.fall_ticks_remaining > 0:
-                if self.fall_delay <= 0:
-                    # Time to move down one space
-                    self.y += GRID_SIZE
-                    self.fall_ticks_remaining -= 1
-                    self.fall_delay = 3  # Wait 3 frames before next fall
-                else:
-                    # Still waiting
-                    self.fall_delay -= 1
-            else:
-                # Falling complete
-                self.falling = False
-    
-    def moved_this_tick(self):
-        # Check if player moved a full grid space this update
-        return (self.grappling and self.grapple_ticks_remaining > 0 and self.grapple_ticks_remaining % 3 == 0) or (self.falling and self.fall_ticks_remaining > 0 and self.fall_delay <= 0) or self.just_moved
-    
-    def move_left(self, world, game):
-        # Check if can move left
-        new_x = self.x - GRID_SIZE
-        if self.can_move_to(new_x, self.y, world):
-            self.x = new_x
-            self.just_moved = True  # Mark that player moved
-            # Check if player should fall after moving
-            self.start_falling(world)
-            return True
-        return False
-    
-    def move_right(self, world, game):
-        # Check if can move right
-        new_x = self.x + GRID_SIZE
-        if self.can_move_to(new_x, self.y, world):
-            self.x = new_x
-            self.just_moved = True  # Mark that player moved
-            # Check if player should fall after moving
-            self.start_falling(world)
-            return True
-        return False
-    
-    def jump(self, world, game):
-        # Check if can jump up
-        new_y = self.y - GRID_SIZE
-        if self.can_move_to(self.x, new_y, world):
-            self.y = new_y
-            self.just_moved = True  # Mark that player moved
-            # Check if player should fall after jumping
-            self.start_falling(world)
-            return True
-        return False
-    
-    def can_move_to(self, x, y, world):
-        # Check if position is valid (not inside walls)
-        grid_x = int(x // GRID_SIZE)
-        grid_y = int(y // GRID_SIZE)
-        
-        # Check bounds
-        if grid_x < 0 or grid_x >= len(world[0]) or grid_y < 0 or grid_y >= len(world):
-            return False
-        
-        # Check if position is solid
-        return world[grid_y][grid_x] == 0  # 0 = air, 1 = solid
-    
-    def start_falling(self, world):
-        # Calculate how many spaces the player can fall
-        fall_distance = 0
-        current_y = self.y + GRID_SIZE  # Start checking one space below
-        
-        while self.can_move_to(self.x, current_y, world):
-            fall_distance += 1
-            current_y += GRID_SIZE
-        
-        if fall_distance > 0:
-            self.falling = True
-            self.fall_ticks_remaining = fall_distance
-            return True
-        return False
-    
-    
-    
-    def start_grappling(self, target_x, target_y):
-        self.grappling = True
-        self.hook_target_x = target_x
-        self.hook_target_y = target_y
-        dx = target_x - self.x
-        dy = target_y - self.y
-        self.hook_length = math.sqrt(dx*dx + dy*dy)
-        
-        # Calculate distance in grid spaces
-        grid_distance = max(abs(dx // GRID_SIZE), abs(dy // GRID_SIZE))
-        self.grapple_ticks_remaining = grid_distance * 3  # Make grappling 3x slower
-    
-    def stop_grappling(self):
-        self.grappling = False
+# Movement controls (A/W/D keys) and grappling hook controls (Arrow keys)
+KEY_ACTIONS = {
+    pygame.K_a: Action.LEFT,
+    pygame.K_d: Action.RIGHT,
+    pygame.K_w: Action.JUMP,
+    pygame.K_LEFT: Action.GRAPPLE_LEFT,
+    pygame.K_UP: Action.GRAPPLE_UP,
+    pygame.K_RIGHT: Action.GRAPPLE_RIGHT,
+}
+
+def box_sprite(fill, outline, width):
+    sprite = pygame.Surface((GRID_SIZE, GRID_SIZE))
+    sprite.fill(fill)
+    pygame.draw.rect(sprite, outline, sprite.get_rect(), width)
+    return sprite.convert()
+
+def ellipse_sprite(size, fill, outline, inset):
+    sprite = pygame.Surface((size, size), pygame.SRCALPHA)
+    rect = sprite.get_rect().inflate(-inset, -inset)
+    pygame.draw.ellipse(sprite, fill, rect)
+    pygame.draw.ellipse(sprite, outline, rect, 2)
+    return sprite.convert_alpha()
+
+def build_sprites():
+    # Entities and HUD glyphs, rasterized once in the display's pixel format
+    return {
+        "player": box_sprite(PLAYER_COLOR, (255, 200, 150), 2),
+        "exit": box_sprite(EXIT_COLOR, (200, 200, 0), 3),
+        "poison": ellipse_sprite(GRID_SIZE, POISON_COLOR, (50, 200, 50), 4),
+        "crab": ellipse_sprite(GRID_SIZE, CRAB_COLOR, (150, 50, 50), 4),
+        "bat": ellipse_sprite(GRID_SIZE, (60, 60, 60), (100, 100, 100), 4),  # Dark gray bat, light gray outline
+        "amber": ellipse_sprite(GRID_SIZE - 4, AMBER_COLOR, (255, 215, 0), 0),
+    }
 
 class Game:
-    def __init__(self):
+    def __init__(self, idle_wait=True, level=None, profiler=None, tick_rate=TICK_RATE, fps=FPS, capture=None):
         self.screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
         pygame.display.set_caption("Grapplecore - Cave Adventure")
         self.clock = pygame.time.Clock()
         self.font = pygame.font.Font(None, 36)
-        
-        # Create cave level
-        self.world = self.create_cave_level()
-        
-        # Create player (spawn in air so they can fall)
-        self.player = Player(GRID_SIZE * 2, GRID_SIZE * 5)
-        
-        # Create bat
-        self.bat = Bat(GRID_SIZE * 15, GRID_SIZE)
-        
-        # Game state
-        self.amber_count = 0
+
+        # Game state lives in the headless simulation
+        self.sim = Simulation(level)
+
+        # Presentation state
         self.turn_based = True
-        self.waiting_for_input = True
-        self.game_over = False
         self.fade_alpha = 0
         self.fade_speed = 5
         self.fading_out = False
         self.fading_in = False
-        
-        # Create amber collectibles (empty - only get amber from crabs)
-        self.amber_positions = []
-        
-        # Create poison clouds
-        self.poison_clouds = [
-            (GRID_SIZE * 28, GRID_SIZE * 18),  # Under the exit
-            (GRID_SIZE * 12, GRID_SIZE * 18),  # On ground
-            (GRID_SIZE * 6, GRID_SIZE * 16)    # On first platform
-        ]
-        
-        # Create exit
-        self.exit_x = (SCREEN_WIDTH // GRID_SIZE - 2) * GRID_SIZE  # Top right
-        self.exit_y = GRID_SIZE * 2
-        
-        # Create amber crabs (on ground level)
-        ground_y = (SCREEN_HEIGHT // GRID_SIZE - 3) * GRID_SIZE  # Ground level
-        self.amber_crabs = [
-            AmberCrab(GRID_SIZE * 5, ground_y),   # On ground, left side
-            AmberCrab(GRID_SIZE * 15, ground_y),  # On ground, middle
-            AmberCrab(GRID_SIZE * 25, ground_y)   # On ground, right side
-        ]
-        
-        
+        self.idle_wait = idle_wait  # Block on the event queue instead of ticking while idle
+        self.tick_rate = tick_rate
+        self.fps = fps
+
+        # Camera (top-left of the screen in world pixels), follows the player
+        self.camera_x = 0
+        self.camera_y = 0
+        self.update_camera(center=True)
+
+        # Rendering caches
+        self.sprites = build_sprites()
+        self.fade_surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)).convert()  # Reused for every fade frame
+        self.fade_surface.fill((0, 0, 0))  # Black fade
+        self.terrain = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT)).convert()  # Terrain under the camera
+        self.terrain_key = None  # (camera, world version) the terrain surface was built for
+        self.terrain_blocks = OrderedDict()  # (block x, block y) -> Surface, least recently used first
+        self.terrain_blocks_version = None
+        self.scene_rects = None  # (rect, sprite) pairs drawn last frame; None forces a full redraw
+        self.overlay_drawn = False
+        # Drawing between steps: positions at the start of the last step
+        # (remember_positions) and the camera and player as drawn
+        self.previous = None
+        self.alpha = 1.0
+        self.view_x = self.camera_x
+        self.view_y = self.camera_y
+        self.view_player = (self.sim.player.x, self.sim.player.y)
+
         # Input handling
         self.keys_pressed = set()
-    
-    def create_cave_level(self):
-        # Create a simple cave level
-        world = []
-        height = SCREEN_HEIGHT // GRID_SIZE
-        width = SCREEN_WIDTH // GRID_SIZE
-        
-        # Initialize empty world
-        for y in range(height):
-            row = []
-            for x in range(width):
-                row.append(0)  # 0 = air, 1 = solid
-            world.append(row)
-        
-        # Create ground - just a simple floor
-        for x in range(width):
-            world[height - 2][x] = 1  # Ground level
-        
-        # Create simple walls - just left and right boundaries
-        for y in range(height - 2):
-            world[y][0] = 1  # Left wall
-            world[y][width - 1] = 1  # Right wall
-        
-        # Create ceiling - just top boundary
-        for x in range(width):
-            world[0][x] = 1  # Ceiling
-        
-        # Add just a few simple platforms for testing
-        # Platform 1 - easy to reach
-        for x in range(8, 12):
-            world[height - 6][x] = 1
-        
-        # Platform 2 - slightly higher
-        for x in range(20, 24):
-            world[height - 8][x] = 1
-        
-        # Platform 3 - requires grappling
-        for x in range(15, 18):
-            world[height - 12][x] = 1
-        
-        return world
-    
-    def handle_input(self):
-        for event in pygame.event.get():
+        self.frame = 0  # Updates so far; input logs are timed in frames
+        self.recording = None  # InputLog receiving every accepted action (see replay.py)
+        self.replay = None  # Replayer feeding actions instead of the keyboard
+        self.undo_stack = deque(maxlen=UNDO_DEPTH)  # Snapshots from before each move
+
+        # Optional Profiler (profiler.py); the simulation adds to its counters too
+        self.profiler = profiler
+        self.profiler_surface = None
+        if profiler is not None:
+            self.sim.counters = profiler.counters
+            self.profiler_font = pygame.font.Font(None, 22)
+
+        # Optional Capture (capture.py) receiving every frame drawn by run()
+        self.capture = capture
+
+    def handle_input(self, events=None):
+        if events is None:
+            events = pygame.event.get()
+
+        for event in events:
             if event.type == pygame.QUIT:
                 return False
-            
-            if event.type == pygame.KEYDOWN:
-                if self.turn_based and self.waiting_for_input and not self.game_over:
-                    # Movement controls (A/W/D keys) - grid-based
-                    if event.key == pygame.K_a:
-                        if self.player.move_left(self.world, self):
-                            self.waiting_for_input = False
-                    elif event.key == pygame.K_d:
-                        if self.player.move_right(self.world, self):
-                            self.waiting_for_input = False
-                    elif event.key == pygame.K_w:
-                        if self.player.jump(self.world, self):
-                            self.waiting_for_input = False
-                    # Grappling hook controls (Arrow keys) - only cardinal directions
-                    elif event.key == pygame.K_LEFT:
-                        # Grappling hook left - find nearest solid block or crab
-                        target_x, target_y = self.find_grapple_target(self.player.x, self.player.y, -1, 0)
-                        if target_x is not None:
-                            self.player.start_grappling(target_x, target_y)
-                            self.waiting_for_input = False
-                        # If target_x is None, we hit a crab and turn ends immediately
-                    elif event.key == pygame.K_RIGHT:
-                        # Grappling hook right - find nearest solid block or crab
-                        target_x, target_y = self.find_grapple_target(self.player.x, self.player.y, 1, 0)
-                        if target_x is not None:
-                            self.player.start_grappling(target_x, target_y)
-                            self.waiting_for_input = False
-                        # If target_x is None, we hit a crab and turn ends immediately
-                    elif event.key == pygame.K_UP:
-                        # Grappling hook up - find nearest solid block or crab
-                        target_x, target_y = self.find_grapple_target(self.player.x, self.player.y, 0, -1)
-                        if target_x is not None:
-                            self.player.start_grappling(target_x, target_y)
-                            self.waiting_for_input = False
-                        # If target_x is None, we hit a crab and turn ends immediately
-        
+
+            if event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                self.scene_rects = None  # Window contents were lost, redraw everything
+
+            if event.type == pygame.KEYDOWN and self.replay is None:
+                if self.turn_based and event.key in KEY_ACTIONS:
+                    self.act(KEY_ACTIONS[event.key])
+                elif event.key == UNDO_KEY:
+                    self.undo()
+            if event.type == pygame.KEYDOWN and event.key == PROFILER_KEY and self.profiler is not None:
+                self.profiler.overlay = not self.profiler.overlay
+                self.scene_rects = None
+
+        if self.replay is not None:
+            for action in self.replay.due():
+                if action == UNDO:
+                    self.undo()
+                else:
+                    self.act(action)
+
         return True
-    
-    def find_grapple_target(self, start_x, start_y, dx, dy):
-        # Find the nearest solid block in the given direction
-        current_x = start_x
-        current_y = start_y
-        
-        while True:
-            # Move one grid space in the direction
-            current_x += dx * GRID_SIZE
-            current_y += dy * GRID_SIZE
-            
-            # Check for crab collision first
-            for crab in self.amber_crabs:
-                if crab.alive:
-                    crab_rect = pygame.Rect(crab.x, crab.y, GRID_SIZE, GRID_SIZE)
-                    hook_rect = pygame.Rect(current_x, current_y, GRID_SIZE, GRID_SIZE)
-                    if hook_rect.colliderect(crab_rect):
-                        # Hit a crab - kill it and return None to indicate no movement
-                        crab.alive = False
-                        self.amber_count += 1
-                        return None, None
-            
-            # Check bounds
-            grid_x = int(current_x // GRID_SIZE)
-            grid_y = int(current_y // GRID_SIZE)
-            
-            if grid_x < 0 or grid_x >= len(self.world[0]) or grid_y < 0 or grid_y >= len(self.world):
-                # Hit boundary, return the last valid position
-                return current_x - dx * GRID_SIZE, current_y - dy * GRID_SIZE
-            
-            # Check if this position is solid
-            if self.world[grid_y][grid_x] == 1:  # Solid block found
-                # Return the position one space before the solid block (so player lands next to it)
-                return current_x - dx * GRID_SIZE, current_y - dy * GRID_SIZE
-    
-    
+
+    def ready(self):
+        # The simulation will accept the next action
+        return self.sim.waiting_for_input and self.sim.outcome is None
+
+    def act(self, action):
+        # Blocked moves change nothing, so they are neither undoable nor logged
+        if not self.ready():
+            return
+        before = self.snapshot()
+        amber = self.sim.amber_count
+        if self.sim.apply_action(action) or self.sim.amber_count != amber:  # Moved, or hooked a crab
+            self.undo_stack.append(before)
+            if self.recording is not None:
+                self.recording.add(self.frame, action)
+
+    def undo(self):
+        # Take back the last move, even one that ended the game
+        if not self.undo_stack:
+            return
+        if self.recording is not None:
+            self.recording.add(self.frame, UNDO)
+        frame = self.frame
+        self.restore(self.undo_stack.pop())
+        self.frame = frame  # Time keeps running for input logs
+
+    def snapshot(self):
+        # Simulation, camera and fade state as bytes (the undo stack is not included)
+        return GAME_STATE.pack(self.camera_x, self.camera_y, self.fade_alpha,
+                               self.fading_out, self.fading_in, self.frame) + self.sim.snapshot()
+
+    def restore(self, snapshot):
+        (self.camera_x, self.camera_y, self.fade_alpha, fading_out, fading_in,
+         self.frame) = GAME_STATE.unpack_from(snapshot)
+        self.fading_out = fading_out == 1
+        self.fading_in = fading_in == 1
+        self.sim.restore(memoryview(snapshot)[GAME_STATE.size:])
+        self.update_camera()
+        self.scene_rects = None
+        self.previous = None
+
+    def is_idle(self):
+        # Nothing is falling, grappling or fading, so only input can change the screen
+        return self.sim.is_idle() and not self.fading_out and not self.fading_in
+
     def update(self):
-        if not self.waiting_for_input and not self.game_over:
-            self.player.update(self.world)
-            
-            # Check if player moved a full grid space (for bat and crab synchronization)
-            if self.player.moved_this_tick():
-                self.bat.update()  # Move bat when player moves one grid space
-                # Move all alive crabs
-                for crab in self.amber_crabs:
-                    crab.update()
-                self.player.just_moved = False  # Reset the flag
-                
-                # Check poison cloud collision (only when player actually moves)
-                player_rect = pygame.Rect(self.player.x, self.player.y, GRID_SIZE, GRID_SIZE)
-                for poison_x, poison_y in self.poison_clouds:
-                    poison_rect = pygame.Rect(poison_x, poison_y, GRID_SIZE, GRID_SIZE)
-                    if player_rect.colliderect(poison_rect):
-                        if self.amber_count > 0:
-                            self.amber_count -= 1
-                            # Don't die if we have amber - just lose one amber per movement
-                        else:
-                            # Player dies if they have no amber
-                            self.game_over = True
-                            self.fading_out = True
-                        break
-            
-            # Check amber collection (no scattered ambers - only from crabs)
-            
-            # Create player rectangle for collision detection
-            player_rect = pygame.Rect(self.player.x, self.player.y, GRID_SIZE, GRID_SIZE)
-            
-            
-            
-            # Check exit collision (victory)
-            exit_rect = pygame.Rect(self.exit_x, self.exit_y, GRID_SIZE, GRID_SIZE)
-            if player_rect.colliderect(exit_rect):
-                # Player wins - restart game
-                self.restart_game()
-                self.fading_in = True
-            
-            # Check crab collision (game over)
-            for crab in self.amber_crabs:
-                if crab.alive:
-                    crab_rect = pygame.Rect(crab.x, crab.y, GRID_SIZE, GRID_SIZE)
-                    if player_rect.colliderect(crab_rect):
-                        self.game_over = True
-                        self.fading_out = True
-                        break
-            
-            # Check bat collision (game over)
-            bat_rect = pygame.Rect(self.bat.x, self.bat.y, GRID_SIZE, GRID_SIZE)
-            if player_rect.colliderect(bat_rect):
-                self.game_over = True
-                self.fading_out = True
-            
-            # Check if turn is complete
-            if self.player.grappling or self.player.falling:
-                # Still grappling or falling, continue
-                pass
-            else:
-                # Player has completed their move
-                self.waiting_for_input = True
-        
+        self.frame += 1
+        self.sim.update()
+
+        if self.sim.outcome == Outcome.EXIT:
+            # Player wins - restart game
+            self.restart_game()
+            self.fading_in = True
+        elif self.sim.game_over and not self.fading_out:
+            self.fading_out = True
+
         # Handle fade transitions
         if self.fading_out:
             self.fade_alpha += self.fade_speed
@@ -441,125 +236,368 @@ class Game:
             if self.fade_alpha <= 0:
                 self.fade_alpha = 0
                 self.fading_in = False
-    
+
+        self.update_camera()
+
     def restart_game(self):
-        # Reset game state
-        self.game_over = False
-        self.waiting_for_input = True
-        self.amber_count = 0
-        
-        # Reset player position
-        self.player = Player(GRID_SIZE * 2, GRID_SIZE * 5)
-        
-        # Reset bat position
-        self.bat = Bat(GRID_SIZE * 15, GRID_SIZE)
-        
-        # Reset amber positions
-        self.amber_positions = [
-            (GRID_SIZE * 5, GRID_SIZE * 18),  # On ground, easy to reach
-            (GRID_SIZE * 10, GRID_SIZE * 16), # On first platform
-            (GRID_SIZE * 22, GRID_SIZE * 14), # On second platform
-            (GRID_SIZE * 16, GRID_SIZE * 10), # On high platform (needs grappling)
-            (GRID_SIZE * 25, GRID_SIZE * 18)  # On ground, far right
-        ]
-        
-        # Reset poison clouds
-        self.poison_clouds = [
-            (GRID_SIZE * 28, GRID_SIZE * 18),  # Under the exit
-            (GRID_SIZE * 12, GRID_SIZE * 18),  # On ground
-            (GRID_SIZE * 6, GRID_SIZE * 16)    # On first platform
-        ]
-        
-        # Reset exit
-        self.exit_x = (SCREEN_WIDTH // GRID_SIZE - 2) * GRID_SIZE  # Top right
-        self.exit_y = GRID_SIZE * 2
-        
-        # Reset amber crabs (on ground level)
-        ground_y = (SCREEN_HEIGHT // GRID_SIZE - 3) * GRID_SIZE  # Ground level
-        self.amber_crabs = [
-            AmberCrab(GRID_SIZE * 5, ground_y),   # On ground, left side
-            AmberCrab(GRID_SIZE * 15, ground_y),  # On ground, middle
-            AmberCrab(GRID_SIZE * 25, ground_y)   # On ground, right side
-        ]
-        
-    
-    def draw(self):
-        self.screen.fill(CAVE_COLOR)
-        
-        # Draw world
-        for y in range(len(self.world)):
-            for x in range(len(self.world[0])):
-                if self.world[y][x] == 1:
-                    rect = pygame.Rect(x * GRID_SIZE, y * GRID_SIZE, GRID_SIZE, GRID_SIZE)
-                    pygame.draw.rect(self.screen, ROCK_COLOR, rect)
-                    pygame.draw.rect(self.screen, (100, 80, 60), rect, 2)
-        
-        # Draw player
-        player_rect = pygame.Rect(self.player.x, self.player.y, GRID_SIZE, GRID_SIZE)
-        pygame.draw.rect(self.screen, PLAYER_COLOR, player_rect)
-        pygame.draw.rect(self.screen, (255, 200, 150), player_rect, 2)
-        
-        # Draw grappling hook
-        if self.player.grappling:
-            pygame.draw.line(self.screen, HOOK_COLOR, 
-                           (self.player.x + GRID_SIZE//2, self.player.y + GRID_SIZE//2),
-                           (self.player.hook_target_x, self.player.hook_target_y), 3)
-        
-        # Draw amber collectibles (none - only get amber from crabs)
-        
-        # Draw poison clouds
-        for poison_x, poison_y in self.poison_clouds:
-            poison_rect = pygame.Rect(poison_x + 2, poison_y + 2, GRID_SIZE - 4, GRID_SIZE - 4)
-            pygame.draw.ellipse(self.screen, POISON_COLOR, poison_rect)
-            pygame.draw.ellipse(self.screen, (50, 200, 50), poison_rect, 2)
-        
-        # Draw exit
-        exit_rect = pygame.Rect(self.exit_x, self.exit_y, GRID_SIZE, GRID_SIZE)
-        pygame.draw.rect(self.screen, EXIT_COLOR, exit_rect)
-        pygame.draw.rect(self.screen, (200, 200, 0), exit_rect, 3)
-        
-        # Draw amber crabs
-        for crab in self.amber_crabs:
-            if crab.alive:
-                crab_rect = pygame.Rect(crab.x + 2, crab.y + 2, GRID_SIZE - 4, GRID_SIZE - 4)
-                pygame.draw.ellipse(self.screen, CRAB_COLOR, crab_rect)
-                pygame.draw.ellipse(self.screen, (150, 50, 50), crab_rect, 2)
-        
-        
-        # Draw bat
-        bat_rect = pygame.Rect(self.bat.x + 2, self.bat.y + 2, GRID_SIZE - 4, GRID_SIZE - 4)
-        pygame.draw.ellipse(self.screen, (60, 60, 60), bat_rect)  # Dark gray bat
-        pygame.draw.ellipse(self.screen, (100, 100, 100), bat_rect, 2)  # Light gray outline
-        
-        # Draw collected amber icons
-        for i in range(self.amber_count):
-            amber_x = 10 + (i * (GRID_SIZE + 5))  # Space them out horizontally
-            amber_y = 10
-            amber_rect = pygame.Rect(amber_x, amber_y, GRID_SIZE - 4, GRID_SIZE - 4)
-            pygame.draw.ellipse(self.screen, AMBER_COLOR, amber_rect)
-            pygame.draw.ellipse(self.screen, (255, 215, 0), amber_rect, 2)
-        
-        
-        # Draw fade overlay
-        if self.fade_alpha > 0:
-            fade_surface = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
-            fade_surface.set_alpha(self.fade_alpha)
-            fade_surface.fill((0, 0, 0))  # Black fade
-            self.screen.blit(fade_surface, (0, 0))
-        
-        pygame.display.flip()
-    
+        self.sim.restart()
+        self.update_camera(center=True)
+        self.previous = None  # Nothing to draw moving into place
+
+    def update_camera(self, center=False):
+        # Scroll only when the player leaves the middle third of the screen
+        player = self.sim.player
+        if center:
+            self.camera_x = player.x - SCREEN_WIDTH // 2
+            self.camera_y = player.y - SCREEN_HEIGHT // 2
+        self.camera_x = min(self.camera_x, player.x - SCREEN_WIDTH // 3)
+        self.camera_x = max(self.camera_x, player.x + GRID_SIZE - 2 * SCREEN_WIDTH // 3)
+        self.camera_y = min(self.camera_y, player.y - SCREEN_HEIGHT // 3)
+        self.camera_y = max(self.camera_y, player.y + GRID_SIZE - 2 * SCREEN_HEIGHT // 3)
+
+        # Keep the camera inside the level
+        world = self.sim.world
+        self.camera_x = max(0, min(self.camera_x, world.width * GRID_SIZE - SCREEN_WIDTH))
+        self.camera_y = max(0, min(self.camera_y, world.height * GRID_SIZE - SCREEN_HEIGHT))
+
+        # Only chunks in or near the view are simulated and kept loaded
+        x0, y0, x1, y1 = self.view_cells()
+        self.sim.active_area = (x0 - SIM_MARGIN, y0 - SIM_MARGIN, x1 + SIM_MARGIN, y1 + SIM_MARGIN)
+        world.prefetch(*self.sim.active_area)
+
+    def view_cells(self):
+        # Cells (x0, y0, x1, y1) that are at least partly on screen
+        return (self.camera_x // GRID_SIZE, self.camera_y // GRID_SIZE,
+                -(-(self.camera_x + SCREEN_WIDTH) // GRID_SIZE), -(-(self.camera_y + SCREEN_HEIGHT) // GRID_SIZE))
+
+    def terrain_block(self, block_x, block_y):
+        # Pre-render a square block of terrain once; rebuilt only when the world is edited
+        world = self.sim.world
+        if self.terrain_blocks_version != world.version:
+            self.terrain_blocks.clear()
+            self.terrain_blocks_version = world.version
+
+        key = (block_x, block_y)
+        block = self.terrain_blocks.get(key)
+        if block is not None:
+            self.terrain_blocks.move_to_end(key)
+            return block
+
+        block = pygame.Surface((RENDER_CHUNK * GRID_SIZE, RENDER_CHUNK * GRID_SIZE)).convert()
+        block.fill(CAVE_COLOR)
+        left = block_x * RENDER_CHUNK
+        top = block_y * RENDER_CHUNK
+        tiles = world.region(left, top, left + RENDER_CHUNK, top + RENDER_CHUNK)
+        solid_y, solid_x = TILE_SOLID_LOOKUP[tiles].nonzero()
+        if self.profiler is not None:
+            self.profiler.count("tiles_drawn", len(solid_x))
+        for x, y in zip(solid_x.tolist(), solid_y.tolist()):
+            rect = pygame.Rect(x * GRID_SIZE, y * GRID_SIZE, GRID_SIZE, GRID_SIZE)
+            pygame.draw.rect(block, TILE_COLORS[int(tiles[y, x])], rect)
+            pygame.draw.rect(block, (100, 80, 60), rect, 2)
+
+        self.terrain_blocks[key] = block
+        while len(self.terrain_blocks) > RENDER_CACHE_SIZE:
+            self.terrain_blocks.popitem(last=False)
+        return block
+
+    def build_terrain(self):
+        # Compose the terrain under the camera from the visible pre-rendered blocks
+        self.terrain.fill(CAVE_COLOR)
+        block_pixels = RENDER_CHUNK * GRID_SIZE
+        for block_y in range(self.view_y // block_pixels, (self.view_y + SCREEN_HEIGHT - 1) // block_pixels + 1):
+            for block_x in range(self.view_x // block_pixels, (self.view_x + SCREEN_WIDTH - 1) // block_pixels + 1):
+                self.terrain.blit(self.terrain_block(block_x, block_y),
+                                  (block_x * block_pixels - self.view_x, block_y * block_pixels - self.view_y))
+        self.terrain_key = (self.view_x, self.view_y, self.sim.world.version)
+
+    def build_scene(self):
+        # Everything on screen over the terrain, in paint order, as (screen rect, sprite);
+        # the sprite is a draw function for things that are not pre-rendered (the hook)
+        sim = self.sim
+        player = sim.player
+        player_x, player_y = self.view_player
+        cam_x = self.view_x
+        cam_y = self.view_y
+        sprites = self.sprites
+        scene = [((player_x - cam_x, player_y - cam_y, GRID_SIZE, GRID_SIZE), sprites["player"])]
+
+        if player.grappling:
+            start_x = player_x + GRID_SIZE//2
+            start_y = player_y + GRID_SIZE//2
+            hook_rect = pygame.Rect(min(start_x, player.hook_target_x) - cam_x, min(start_y, player.hook_target_y) - cam_y,
+                                    abs(start_x - player.hook_target_x) + 1, abs(start_y - player.hook_target_y) + 1)
+            scene.append((tuple(hook_rect.inflate(6, 6)), self.draw_hook))
+
+        for poison_x, poison_y in sim.poison_clouds:
+            if self.on_screen(poison_x, poison_y):
+                scene.append(((poison_x - cam_x, poison_y - cam_y, GRID_SIZE, GRID_SIZE), sprites["poison"]))
+
+        if self.on_screen(sim.exit_x, sim.exit_y):
+            scene.append(((sim.exit_x - cam_x, sim.exit_y - cam_y, GRID_SIZE, GRID_SIZE), sprites["exit"]))
+
+        for crab_x, crab_y in self.enemy_positions(sim.crabs, 6):
+            scene.append(((crab_x - cam_x, crab_y - cam_y, GRID_SIZE, GRID_SIZE), sprites["crab"]))
+
+        for bat_x, bat_y in self.enemy_positions(sim.bats, 4):
+            scene.append(((bat_x - cam_x, bat_y - cam_y, GRID_SIZE, GRID_SIZE), sprites["bat"]))
+
+        # Collected amber icons, spaced out horizontally (fixed to the screen)
+        for i in range(sim.amber_count):
+            scene.append(((10 + (i * (GRID_SIZE + 5)), 10, GRID_SIZE - 4, GRID_SIZE - 4), sprites["amber"]))
+
+        return scene
+
+    def enemy_positions(self, group, previous):
+        # Living enemies near the screen, part of the way from their positions
+        # at the start of the last step (self.previous[previous], [previous + 1])
+        view = self.view_cells()
+        if self.alpha >= 1 or self.previous is None or len(self.previous[previous]) != len(group):
+            return group.alive_positions(view)
+        n = len(group)
+        x0, y0, x1, y1 = view
+        shown = group.alive[:n] & group.in_area((x0 - 1, y0 - 1, x1 + 1, y1 + 1))
+        positions = []
+        for current, before in ((group.x, self.previous[previous]), (group.y, self.previous[previous + 1])):
+            before = before[shown]
+            positions.append((before + (current[:n][shown] - before) * self.alpha).astype(int).tolist())
+        return zip(*positions)
+
+    def on_screen(self, x, y):
+        return (self.view_x - GRID_SIZE < x < self.view_x + SCREEN_WIDTH and
+                self.view_y - GRID_SIZE < y < self.view_y + SCREEN_HEIGHT)
+
+    def draw_hook(self, rect):
+        player = self.sim.player
+        player_x, player_y = self.view_player
+        pygame.draw.line(self.screen, HOOK_COLOR,
+                       (player_x + GRID_SIZE//2 - self.view_x, player_y + GRID_SIZE//2 - self.view_y),
+                       (player.hook_target_x - self.view_x, player.hook_target_y - self.view_y), 3)
+
+    def paint(self, scene):
+        # Blit sprites in batches; draw functions run in between to keep the paint order
+        batch = []
+        for rect, sprite in scene:
+            if callable(sprite):
+                if batch:
+                    self.screen.blits(batch, doreturn=False)
+                    batch = []
+                sprite(rect)
+            else:
+                batch.append((sprite, rect[:2]))
+        if batch:
+            self.screen.blits(batch, doreturn=False)
+
+    def profiler_overlay(self):
+        # Profiler text panel, re-rendered every PROFILER_REFRESH frames; None while hidden
+        profiler = self.profiler
+        if profiler is None or not profiler.overlay:
+            return None
+        if self.profiler_surface is None or profiler.frame % PROFILER_REFRESH == 0:
+            lines = [self.profiler_font.render(line, True, (255, 255, 255)) for line in profiler.report()]
+            panel = pygame.Surface((max(line.get_width() for line in lines) + 12,
+                                    sum(line.get_height() for line in lines) + 12)).convert()
+            panel.fill((0, 0, 0))
+            y = 6
+            for line in lines:
+                panel.blit(line, (6, y))
+                y += line.get_height()
+            self.profiler_surface = panel
+        return self.profiler_surface
+
+    def remember_positions(self):
+        # Camera, player and enemy positions at the start of a step, to draw in between steps
+        sim = self.sim
+        bats = len(sim.bats)
+        crabs = len(sim.crabs)
+        self.previous = (self.camera_x, self.camera_y, sim.player.x, sim.player.y,
+                         sim.bats.x[:bats].copy(), sim.bats.y[:bats].copy(),
+                         sim.crabs.x[:crabs].copy(), sim.crabs.y[:crabs].copy())
+
+    def lerp(self, before, after):
+        return int(before + (after - before) * self.alpha)
+
+    def draw(self, alpha=1.0):
+        # alpha: how far to draw moving things from where they were at the start
+        # of the last step (0) to where they are now (1)
+        player = self.sim.player
+        self.alpha = alpha
+        if alpha >= 1 or self.previous is None:
+            self.view_x = self.camera_x
+            self.view_y = self.camera_y
+            self.view_player = (player.x, player.y)
+        else:
+            camera_x, camera_y, player_x, player_y = self.previous[:4]
+            self.view_x = self.lerp(camera_x, self.camera_x)
+            self.view_y = self.lerp(camera_y, self.camera_y)
+            self.view_player = (self.lerp(player_x, player.x), self.lerp(player_y, player.y))
+
+        if self.terrain_key != (self.view_x, self.view_y, self.sim.world.version):
+            # The camera scrolled or the world was edited
+            self.build_terrain()
+            self.scene_rects = None
+
+        scene = self.build_scene()
+        overlay = self.profiler_overlay()
+        if overlay is not None:
+            overlay_rect = overlay.get_rect(topright=(SCREEN_WIDTH - 10, 10))
+
+        # The fade overlay covers the whole screen, so fades redraw everything
+        if self.scene_rects is None or self.fade_alpha > 0 or self.overlay_drawn:
+            self.screen.blit(self.terrain, (0, 0))
+            self.paint(scene)
+
+            # Draw fade overlay
+            if self.fade_alpha > 0:
+                self.fade_surface.set_alpha(self.fade_alpha)
+                self.screen.blit(self.fade_surface, (0, 0))
+            self.overlay_drawn = self.fade_alpha > 0
+
+            if overlay is not None:
+                self.screen.blit(overlay, overlay_rect)
+            pygame.display.flip()
+            self.scene_rects = scene
+            return
+
+        if scene == self.scene_rects and overlay is None:
+            return  # Nothing moved
+
+        # Dirty areas are the previous and current positions of whatever changed
+        # (compared with its sprite, so one thing moving onto another's old spot
+        # still counts); anything drawn over them is repainted too so the paint order holds
+        changed = set(self.scene_rects).symmetric_difference(scene)
+        boxes = [pygame.Rect(rect) for rect, sprite in scene]
+        dirty = [pygame.Rect(rect) for rect, sprite in changed]
+        if overlay is not None:
+            dirty.append(overlay_rect)  # The profiler text changes every few frames
+        dirty.extend(box for item, box in zip(scene, boxes) if item not in changed and box.collidelist(dirty) != -1)
+        if self.profiler is not None:
+            self.profiler.count("rects_allocated", len(boxes) + len(changed))
+
+        self.screen.blits([(self.terrain, rect, rect) for rect in dirty], doreturn=False)
+        self.paint([(rect, sprite) for (rect, sprite), box in zip(scene, boxes) if box.collidelist(dirty) != -1])
+        if overlay is not None:
+            self.screen.blit(overlay, overlay_rect)
+
+        pygame.display.update(dirty)
+        self.scene_rects = scene
+
     def run(self):
+        # Fixed-timestep loop: the simulation steps tick_rate times per second of
+        # real time however fast frames are drawn, catching up after slow frames,
+        # and frames in between steps are drawn part of the way through the last step
         running = True
+        profiler = self.profiler
+        step = 1.0 / self.tick_rate
+        lag = 0.0  # Real time not yet simulated
+        self.draw()
+        last = time.perf_counter()
         while running:
-            running = self.handle_input()
-            self.update()
-            self.draw()
-            self.clock.tick(60)
-        
+            events = None
+            if self.idle_wait and self.is_idle() and self.replay is None:
+                # Sleep until the next event instead of redrawing 60 times a second
+                events = [pygame.event.wait()] + pygame.event.get()
+                last = time.perf_counter()  # Time spent asleep is not simulated
+                lag = 0.0
+            if profiler:
+                profiler.begin_frame()  # Time spent asleep waiting for input is not frame time
+            running = self.handle_input(events)
+            if profiler:
+                profiler.mark("input")
+
+            now = time.perf_counter()
+            lag += now - last
+            last = now
+            steps = 0
+            while lag >= step:
+                if steps == MAX_CATCH_UP:
+                    lag = 0.0
+                    break
+                self.remember_positions()
+                self.update()
+                lag -= step
+                steps += 1
+            if profiler:
+                profiler.mark("update")
+            # At rest nothing is moving, so draw things where they are
+            self.draw(1.0 if self.is_idle() else lag / step)
+            if self.capture is not None:
+                self.capture.frame(self.screen)  # Copied here, encoded on the capture thread
+            if profiler:
+                profiler.mark("draw")
+            self.clock.tick(self.fps)
+            if profiler:
+                profiler.mark("wait")
+                profiler.end_frame()
+
+        if hasattr(self.sim.world, "flush"):
+            self.sim.world.flush()  # Save edits to streamed chunks
+        if self.recording is not None:
+            self.recording.save()
+        if profiler:
+            print("\n".join(profiler.report()))
+            profiler.close()
+        if self.capture is not None:
+            self.capture.close()
+            print(self.capture.report())
         pygame.quit()
         sys.exit()
 
-if __name__ == "__main__":
-    game = Game()
+def open_level(level_path=None, chunks=None):
+    # Level for the command line options; None means the built-in debug room
+    if level_path:
+        return load_level(level_path)
+    if chunks:
+        return default_level(ChunkedWorld(ChunkStore(chunks)))
+    return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Grapplecore - Cave Adventure")
+    parser.add_argument("--no-idle-wait", action="store_true",
+                        help="keep ticking at 60 fps while waiting for input")
+    parser.add_argument("--level", metavar="PATH",
+                        help="play a binary level file (see level.py)")
+    parser.add_argument("--chunks", metavar="DIR",
+                        help="stream a large level from a chunk directory (see chunks.py)")
+    parser.add_argument("--cave", type=int, metavar="SEED",
+                        help="play a procedural cave (see caves.py), generated once and then cached")
+    parser.add_argument("--record", metavar="PATH",
+                        help="record every move to an input log")
+    parser.add_argument("--replay", metavar="PATH",
+                        help="play back an input log in real time (see replay.py)")
+    parser.add_argument("--seek", type=int, metavar="TURN",
+                        help="with --replay, fast-forward to this turn first")
+    parser.add_argument("--tick-rate", type=int, default=TICK_RATE,
+                        help="simulation steps per second (default: %(default)s)")
+    parser.add_argument("--fps", type=int, default=FPS,
+                        help="frame rate cap, 0 for none (default: %(default)s)")
+    parser.add_argument("--profile", nargs="?", const="", metavar="PATH",
+                        help="profile frames (F3 shows the overlay), optionally writing them to a .csv or .jsonl file")
+    parser.add_argument("--capture", metavar="PATH",
+                        help="capture every frame to a PNG directory or a .rgb/.raw video file (see capture.py)")
+    args = parser.parse_args()
+    if args.cave is not None:
+        args.level = cave_path(args.cave, verify=True)
+
+    log = InputLog.load(args.replay) if args.replay else None
+    if log is not None:
+        level = open_level(log.level, log.chunks)
+    else:
+        level = open_level(args.level, args.chunks)
+    profiler = Profiler(args.profile) if args.profile is not None else None
+    capture = None
+    if args.capture:
+        # Frames are only drawn while time passes, so a capture never sleeps on input
+        capture = Capture(args.capture, (SCREEN_WIDTH, SCREEN_HEIGHT), args.fps or args.tick_rate)
+    game = Game(idle_wait=not args.no_idle_wait and capture is None, level=level, profiler=profiler,
+                tick_rate=args.tick_rate, fps=args.fps, capture=capture)
+    if args.record:
+        game.recording = InputLog(args.record, args.level, args.chunks)
+    if log is not None:
+        game.replay = Replayer(game, log)
+        if args.seek:
+            game.replay.seek(args.seek)
     game.run()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+import enum
+
+import numpy as np
+
+# Compact tile grid - one byte per cell, row-major, with a NumPy view for bulk edits.
+
+
+class Tile(enum.IntEnum):
+    AIR = 0
+    ROCK = 1
+    GROUND = 2
+
+
+# Solidity of every possible tile code, indexed by code
+SOLID_TILES = (Tile.ROCK, Tile.GROUND)
+TILE_SOLID = bytes(1 if code in SOLID_TILES else 0 for code in range(256))
+TILE_SOLID_LOOKUP = np.frombuffer(TILE_SOLID, dtype=np.uint8).astype(bool)
+
+
+class TileGrid:
+    def __init__(self, width, height, cells=None):
+        self.width = width
+        self.height = height
+        if cells is None:
+            cells = bytearray(width * height)
+        if len(cells) != width * height:
+            raise ValueError("expected %d cells, got %d" % (width * height, len(cells)))
+
+        # Flat row-major storage; any buffer works (bytearray, mmap, ...)
+        self.cells = cells
+        # 2D NumPy view of the same memory for vectorized passes (tiles[y, x])
+        self.tiles = np.frombuffer(cells, dtype=np.uint8).reshape(height, width)
+        self.version = 0  # Bumped on every edit so caches know when to rebuild
+        self.distances = None  # Optional DistanceIndex, kept up to date by edits
+
+    @classmethod
+    def from_rows(cls, rows):
+        # Convert a list of lists of tile codes
+        grid = cls(len(rows[0]), len(rows))
+        grid.tiles[:, :] = np.asarray(rows, dtype=np.uint8)
+        return grid
+
+    def copy(self):
+        return TileGrid(self.width, self.height, bytearray(self.cells))
+
+    def index(self, x, y):
+        return y * self.width + x
+
+    def in_bounds(self, x, y):
+        return 0 <= x < self.width and 0 <= y < self.height
+
+    def get(self, x, y):
+        return self.cells[y * self.width + x]
+
+    def is_solid(self, x, y):
+        # Anything outside the grid counts as solid
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return TILE_SOLID[self.cells[y * self.width + x]] == 1
+        return True
+
+    def set(self, x, y, tile):
+        i = y * self.width + x
+        if self.cells[i] != tile:
+            self.cells[i] = tile
+            self.edited(x, y, x + 1, y + 1)
+
+    def fill(self, x0, y0, x1, y1, tile):
+        # Fill the rectangle [x0, x1) x [y0, y1)
+        self.tiles[y0:y1, x0:x1] = tile
+        self.edited(x0, y0, x1, y1)
+
+    def paste(self, x0, y0, block):
+        # Copy a 2D array of tile codes with its top-left corner at (x0, y0)
+        block = np.asarray(block, dtype=np.uint8)
+        self.tiles[y0:y0 + block.shape[0], x0:x0 + block.shape[1]] = block
+        self.edited(x0, y0, x0 + block.shape[1], y0 + block.shape[0])
+
+    def edited(self, x0, y0, x1, y1):
+        self.version += 1
+        if self.distances is not None:
+            self.distances.update(max(x0, 0), max(y0, 0), min(x1, self.width), min(y1, self.height))
+
+    def region(self, x0, y0, x1, y1):
+        # Tile codes for cells [x0, x1) x [y0, y1), clipped to the grid
+        return self.tiles[max(y0, 0):max(y1, 0), max(x0, 0):max(x1, 0)]
+
+    def prefetch(self, x0, y0, x1, y1):
+        pass  # Always resident; see ChunkedWorld for streamed levels
+
+    def solid_mask(self):
+        # Boolean array, True where the tile is solid
+        return TILE_SOLID_LOOKUP[self.tiles]
+
+    def build_distance_index(self):
+        self.distances = DistanceIndex(self)
+        return self.distances
+
+    def free_run(self, x, y, dx, dy):
+        # Number of non-solid cells from (x, y) in direction (dx, dy) before a solid tile or the edge
+        if self.distances is not None:
+            return self.distances.free_run(x, y, dx, dy)
+
+        run = 0
+        while not self.is_solid(x + dx * (run + 1), y + dy * (run + 1)):
+            run += 1
+        return run
+
+
+def _runs_forward(solid):
+    # Free cells after each cell along axis 0 before the next solid cell (or the end)
+    n = solid.shape[0]
+    index = np.arange(n).reshape((n,) + (1,) * (solid.ndim - 1))
+    next_solid = np.minimum.accumulate(np.where(solid, index, n)[::-1], axis=0)[::-1]
+    after = np.empty_like(next_solid)
+    after[:-1] = next_solid[1:]
+    after[-1] = n
+    return after - index - 1
+
+
+def _runs_backward(solid):
+    # Free cells before each cell along axis 0 back to the previous solid cell (or the start)
+    n = solid.shape[0]
+    index = np.arange(n).reshape((n,) + (1,) * (solid.ndim - 1))
+    previous_solid = np.maximum.accumulate(np.where(solid, index, -1), axis=0)
+    before = np.empty_like(previous_solid)
+    before[1:] = previous_solid[:-1]
+    before[0] = -1
+    return index - before - 1
+
+
+class DistanceIndex:
+    # Free cells from every cell to the nearest solid tile (or the edge) in each
+    # cardinal direction, so falls and grapple rays are O(1) lookups
+    def __init__(self, grid):
+        self.grid = grid
+        dtype = np.uint16 if max(grid.width, grid.height) <= 0xFFFF else np.uint32
+        shape = (grid.height, grid.width)
+        self.left = np.empty(shape, dtype)
+        self.right = np.empty(shape, dtype)
+        self.up = np.empty(shape, dtype)
+        self.down = np.empty(shape, dtype)
+
+        # Flat memoryviews for fast scalar reads, keyed by direction
+        self.views = {
+            (-1, 0): memoryview(self.left.reshape(-1)),
+            (1, 0): memoryview(self.right.reshape(-1)),
+            (0, -1): memoryview(self.up.reshape(-1)),
+            (0, 1): memoryview(self.down.reshape(-1)),
+        }
+        self.update(0, 0, grid.width, grid.height)
+
+    def update(self, x0, y0, x1, y1):
+        # Recompute after tiles in [x0, x1) x [y0, y1) changed: only their
+        # columns (up/down) and rows (left/right) can be affected
+        if x0 >= x1 or y0 >= y1:
+            return
+        columns = self.grid.solid_mask()[:, x0:x1]
+        self.down[:, x0:x1] = _runs_forward(columns)
+        self.up[:, x0:x1] = _runs_backward(columns)
+
+        rows = TILE_SOLID_LOOKUP[self.grid.tiles[y0:y1, :]].T
+        self.right[y0:y1, :] = _runs_forward(rows).T
+        self.left[y0:y1, :] = _runs_backward(rows).T
+
+    def free_run(self, x, y, dx, dy):
+        return self.views[(dx, dy)][y * self.grid.width + x]
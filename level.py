@@ -0,0 +1,160 @@
+import mmap
+import struct
+import sys
+
+import numpy as np
+
+from grid import Tile, TileGrid
+
+# Level data and the binary level file format.
+#
+# File layout (little-endian):
+#   header    64 bytes, see HEADER
+#   tiles     width * height bytes, row-major tile codes
+#   padding   up to a 4-byte boundary
+#   bats      bat_count records of BAT_DTYPE
+#   crabs     crab_count records of CRAB_DTYPE
+#   poison    poison_count records of POISON_DTYPE
+#
+# Everything is in grid cells. load_level maps the file and uses the tile
+# bytes and entity tables in place, without parsing or copying them.
+
+LEVEL_WIDTH = 32  # Size of the built-in debug room in grid cells
+LEVEL_HEIGHT = 24
+
+MAGIC = b"GCLV"
+FORMAT_VERSION = 1
+# magic, version, reserved, width, height, spawn x/y, exit x/y, bat/crab/poison counts
+HEADER = struct.Struct("<4sHHIIiiiiIII20x")
+
+BAT_DTYPE = np.dtype([("x", "<i4"), ("y", "<i4"), ("ceiling", "<i4"), ("floor", "<i4")])
+CRAB_DTYPE = np.dtype([("x", "<i4"), ("y", "<i4"), ("range", "<i4")])
+POISON_DTYPE = np.dtype([("x", "<i4"), ("y", "<i4")])
+
+
+class Level:
+    # Everything needed to (re)start a level: terrain, spawn point, exit and entity tables
+    def __init__(self, world, spawn_cell, exit_cell, bats, crabs, poison):
+        self.world = world  # TileGrid or ChunkedWorld
+        self.spawn_x, self.spawn_y = spawn_cell
+        self.exit_x, self.exit_y = exit_cell
+        self.bats = bats  # Arrays of BAT_DTYPE, CRAB_DTYPE and POISON_DTYPE records
+        self.crabs = crabs
+        self.poison = poison
+        self.mapping = None  # The mmap backing a loaded level, kept open while in use
+
+
+def create_cave_level():
+    # Create a simple cave level
+    height = LEVEL_HEIGHT
+    width = LEVEL_WIDTH
+    world = TileGrid(width, height)  # Starts as all air
+
+    # Create ground - just a simple floor
+    world.fill(0, height - 2, width, height - 1, Tile.ROCK)
+
+    # Create simple walls - just left and right boundaries
+    world.fill(0, 0, 1, height - 2, Tile.ROCK)
+    world.fill(width - 1, 0, width, height - 2, Tile.ROCK)
+
+    # Create ceiling - just top boundary
+    world.fill(0, 0, width, 1, Tile.ROCK)
+
+    # Add just a few simple platforms for testing
+    # Platform 1 - easy to reach
+    world.fill(8, height - 6, 12, height - 5, Tile.ROCK)
+
+    # Platform 2 - slightly higher
+    world.fill(20, height - 8, 24, height - 7, Tile.ROCK)
+
+    # Platform 3 - requires grappling
+    world.fill(15, height - 12, 18, height - 11, Tile.ROCK)
+
+    return world
+
+
+def default_level(world=None):
+    # The hand-placed debug room; exit, bat and crabs follow the world's size
+    if world is None:
+        world = create_cave_level()
+    width = world.width
+    height = world.height
+    ground = height - 3  # Crabs walk on the ground row
+
+    return Level(
+        world,
+        spawn_cell=(2, 5),  # Spawn in air so the player can fall
+        exit_cell=(width - 2, 2),  # Top right
+        # Bat patrols between the ceiling and the floor
+        bats=np.array([(15, 1, 1, height - 2)], BAT_DTYPE),
+        crabs=np.array([
+            (5, ground, 4),   # On ground, left side
+            (15, ground, 4),  # On ground, middle
+            (25, ground, 4),  # On ground, right side
+        ], CRAB_DTYPE),
+        poison=np.array([
+            (28, 18),  # Under the exit
+            (12, 18),  # On ground
+            (6, 16),   # On first platform
+        ], POISON_DTYPE),
+    )
+
+
+def table_offsets(width, height, bat_count, crab_count):
+    # Byte offsets of the tile array and the three entity tables
+    tiles = HEADER.size
+    bats = tiles + width * height
+    bats += -bats % 4
+    crabs = bats + bat_count * BAT_DTYPE.itemsize
+    poison = crabs + crab_count * CRAB_DTYPE.itemsize
+    return tiles, bats, crabs, poison
+
+
+def write_level(path, level):
+    world = level.world
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, world.width, world.height,
+                            level.spawn_x, level.spawn_y, level.exit_x, level.exit_y,
+                            len(level.bats), len(level.crabs), len(level.poison)))
+        f.write(world.region(0, 0, world.width, world.height).tobytes())
+        f.write(bytes(-(HEADER.size + world.width * world.height) % 4))
+        for table, dtype in ((level.bats, BAT_DTYPE), (level.crabs, CRAB_DTYPE), (level.poison, POISON_DTYPE)):
+            f.write(np.asarray(table, dtype).tobytes())
+
+
+def load_level(path):
+    # Map the file copy-on-write: the game can edit tiles without touching the file
+    with open(path, "rb") as f:
+        mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_COPY)
+
+    if len(mapping) < HEADER.size:
+        raise ValueError("%s: not a Grapplecore level" % path)
+    (magic, version, _, width, height, spawn_x, spawn_y, exit_x, exit_y,
+     bat_count, crab_count, poison_count) = HEADER.unpack_from(mapping, 0)
+    if magic != MAGIC:
+        raise ValueError("%s: not a Grapplecore level" % path)
+    if version != FORMAT_VERSION:
+        raise ValueError("%s: unsupported level format version %d" % (path, version))
+
+    tiles, bats, crabs, poison = table_offsets(width, height, bat_count, crab_count)
+    if len(mapping) < poison + poison_count * POISON_DTYPE.itemsize:
+        raise ValueError("%s: level file is truncated" % path)
+
+    view = memoryview(mapping)
+    level = Level(
+        TileGrid(width, height, view[tiles:tiles + width * height]),
+        spawn_cell=(spawn_x, spawn_y),
+        exit_cell=(exit_x, exit_y),
+        bats=np.frombuffer(mapping, BAT_DTYPE, bat_count, bats),
+        crabs=np.frombuffer(mapping, CRAB_DTYPE, crab_count, crabs),
+        poison=np.frombuffer(mapping, POISON_DTYPE, poison_count, poison),
+    )
+    level.mapping = mapping
+    return level
+
+
+if __name__ == "__main__":
+    # Convert the built-in debug room: python level.py debug_room.gclv
+    if len(sys.argv) != 2:
+        sys.exit("usage: python level.py OUTPUT")
+    write_level(sys.argv[1], default_level())
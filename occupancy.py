@@ -0,0 +1,129 @@
+import numpy as np
+
+# Occupancy grid: how many entities stand in each grid cell, so collision and
+# hook-hit checks are array lookups instead of scans over every entity.
+# Entities are always grid-aligned, so sharing a cell is the same as overlapping.
+
+ONE = np.uint16(1)  # ufunc.at takes a fast path only when the operand matches the counts' dtype
+DENSE_MAX_CELLS = 4 * 1024 * 1024  # Bigger worlds use a sparse occupancy map
+
+
+def make_occupancy(width, height):
+    if width * height <= DENSE_MAX_CELLS:
+        return OccupancyGrid(width, height)
+    return SparseOccupancy()
+
+
+class OccupancyGrid:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.counts = np.zeros((height, width), np.uint16)
+        self.flat = memoryview(self.counts.reshape(-1))  # Fast scalar reads
+
+    def count(self, cell):
+        x, y = cell
+        if 0 <= x < self.width and 0 <= y < self.height:
+            return self.flat[y * self.width + x]
+        return 0  # Entities outside the grid are not tracked
+
+    def add(self, cell):
+        x, y = cell
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.flat[y * self.width + x] += 1
+
+    def remove(self, cell):
+        x, y = cell
+        if 0 <= x < self.width and 0 <= y < self.height:
+            self.flat[y * self.width + x] -= 1
+
+    def move(self, old_cell, new_cell):
+        if old_cell != new_cell:
+            self.remove(old_cell)
+            self.add(new_cell)
+
+    def inside(self, xs, ys):
+        return (xs >= 0) & (xs < self.width) & (ys >= 0) & (ys < self.height)
+
+    def add_many(self, xs, ys):
+        inside = self.inside(xs, ys)
+        np.add.at(self.counts, (ys[inside], xs[inside]), ONE)
+
+    def remove_many(self, xs, ys):
+        inside = self.inside(xs, ys)
+        np.subtract.at(self.counts, (ys[inside], xs[inside]), ONE)
+
+    def nearest_on_ray(self, grid_x, grid_y, dx, dy, max_steps):
+        # Steps from (grid_x, grid_y) in direction (dx, dy) to the first occupied
+        # cell, looking at most max_steps cells ahead; None if there is none
+        if dy == 0:
+            if not 0 <= grid_y < self.height:
+                return None
+            line = self.counts[grid_y]
+            start = grid_x
+        else:
+            if not 0 <= grid_x < self.width:
+                return None
+            line = self.counts[:, grid_x]
+            start = grid_y
+        step = dx + dy
+
+        if step > 0:
+            ahead = line[max(start + 1, 0):max(start + 1 + max_steps, 0)]
+            offset = max(start + 1, 0) - start
+        else:
+            low = max(start - max_steps, 0)
+            ahead = line[low:max(start, 0)][::-1]
+            offset = start - max(start, 0) + 1
+        hits = np.flatnonzero(ahead)
+        if len(hits) == 0:
+            return None
+        return int(hits[0]) + offset
+
+
+class SparseOccupancy:
+    # Same interface as OccupancyGrid, for worlds too large for a dense array
+    def __init__(self):
+        self.counts = {}  # (grid_x, grid_y) -> number of entities
+
+    def count(self, cell):
+        return self.counts.get(cell, 0)
+
+    def add(self, cell):
+        self.counts[cell] = self.counts.get(cell, 0) + 1
+
+    def remove(self, cell):
+        left = self.counts[cell] - 1
+        if left:
+            self.counts[cell] = left
+        else:
+            del self.counts[cell]
+
+    def move(self, old_cell, new_cell):
+        if old_cell != new_cell:
+            self.remove(old_cell)
+            self.add(new_cell)
+
+    def add_many(self, xs, ys):
+        for cell in zip(xs.tolist(), ys.tolist()):
+            self.add(cell)
+
+    def remove_many(self, xs, ys):
+        for cell in zip(xs.tolist(), ys.tolist()):
+            self.remove(cell)
+
+    def nearest_on_ray(self, grid_x, grid_y, dx, dy, max_steps):
+        if len(self.counts) < max_steps:
+            # Fewer occupied cells than ray cells - check each occupied cell instead
+            best = None
+            for cell_x, cell_y in self.counts:
+                step = (cell_x - grid_x) * dx + (cell_y - grid_y) * dy
+                if 0 < step <= max_steps and (best is None or step < best):
+                    if cell_x == grid_x + dx * step and cell_y == grid_y + dy * step:
+                        best = step
+            return best
+
+        for step in range(1, max_steps + 1):
+            if (grid_x + dx * step, grid_y + dy * step) in self.counts:
+                return step
+        return None
@@ -0,0 +1,149 @@
+import argparse
+import multiprocessing
+import os
+import random
+import sys
+from collections import Counter
+
+from level import default_level, load_level
+from simulation import Action, Simulation
+
+# Batch playouts for level QA: many scripted or random-agent games played on
+# the headless simulation, spread over a process pool. Every worker loads the
+# level once; playouts go out in chunks of indices so per-task overhead is
+# paid once per chunk, and results stream back as chunks finish.
+
+CHUNK_SIZE = 64  # Playouts per task
+MAX_TURNS = 200  # Turns before a playout counts as stuck
+ACTIONS = list(Action)
+
+# Per-process state, set up by init_worker
+worker_sim = None
+worker_scripts = None
+
+
+def init_worker(level_path, scripts):
+    global worker_sim, worker_scripts
+    level = load_level(level_path) if level_path else default_level()
+    worker_sim = Simulation(level)
+    worker_scripts = scripts
+
+
+def play(sim, actions, max_turns):
+    # Play one game from the start; returns (outcome value or None, amber, turns)
+    sim.restart()
+    turns = 0
+    for action in actions:
+        if turns == max_turns:
+            break
+        turns += 1
+        outcome = sim.step(action)
+        if outcome is not None:
+            return outcome.value, sim.amber_count, turns
+    return None, sim.amber_count, turns
+
+
+def random_actions(seed, index):
+    rng = random.Random(seed * 1000003 + index)
+    while True:
+        yield rng.choice(ACTIONS)
+
+
+def run_chunk(task):
+    # Worker side: play the playouts [start, stop) and return their results
+    start, stop, seed, max_turns = task
+    results = []
+    for index in range(start, stop):
+        if worker_scripts is not None:
+            actions = worker_scripts[index % len(worker_scripts)]
+        else:
+            actions = random_actions(seed, index)
+        results.append((index,) + play(worker_sim, actions, max_turns))
+    return results
+
+
+def run_playouts(count, level_path=None, scripts=None, seed=0, max_turns=MAX_TURNS,
+                 workers=None, chunk_size=CHUNK_SIZE):
+    # Yield (index, outcome value or None, amber, turns) for every playout, in
+    # completion order. With scripts (lists of Actions) playout i plays
+    # scripts[i % len(scripts)]; otherwise a random agent seeded by (seed, i).
+    tasks = [(start, min(start + chunk_size, count), seed, max_turns)
+             for start in range(0, count, chunk_size)]
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        init_worker(level_path, scripts)
+        for task in tasks:
+            yield from run_chunk(task)
+        return
+
+    with multiprocessing.Pool(workers, init_worker, (level_path, scripts)) as pool:
+        for results in pool.imap_unordered(run_chunk, tasks):
+            yield from results
+
+
+class Summary:
+    # Aggregate of many playout results
+    def __init__(self):
+        self.games = 0
+        self.outcomes = Counter()  # "exit", "bat", "crab", "poison" or None (stuck)
+        self.amber = Counter()  # Amber held at the end -> games
+        self.turns = Counter()  # Turns played -> games
+        self.win_turns = Counter()  # Turns to the exit -> games
+
+    def add(self, result):
+        _, outcome, amber, turns = result
+        self.games += 1
+        self.outcomes[outcome] += 1
+        self.amber[amber] += 1
+        self.turns[turns] += 1
+        if outcome == "exit":
+            self.win_turns[turns] += 1
+
+    @property
+    def win_rate(self):
+        return self.outcomes["exit"] / self.games if self.games else 0.0
+
+    def report(self):
+        lines = ["games: %d" % self.games,
+                 "win rate: %.1f%%" % (100 * self.win_rate)]
+        for outcome in ("bat", "crab", "poison", None):
+            lines.append("%s: %d" % (outcome or "stuck", self.outcomes[outcome]))
+        lines.append("amber: " + " ".join("%d:%d" % item for item in sorted(self.amber.items())))
+        lines.append("mean turns: %.1f" % (sum(t * n for t, n in self.turns.items()) / max(self.games, 1)))
+        if self.win_turns:
+            lines.append("fastest win: %d turns" % min(self.win_turns))
+        return "\n".join(lines)
+
+
+def read_scripts(path):
+    # One playout per line: action names separated by spaces, e.g. "RIGHT GRAPPLE_UP"
+    with open(path) as f:
+        return [[Action[name] for name in line.split()] for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run batch playouts of a Grapplecore level")
+    parser.add_argument("--games", type=int, default=1000)
+    parser.add_argument("--level", metavar="PATH", help="binary level file (default: the debug room)")
+    parser.add_argument("--scripts", metavar="PATH", help="play scripted action lists instead of random agents")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--max-turns", type=int, default=MAX_TURNS)
+    parser.add_argument("--workers", type=int, help="processes (default: one per CPU)")
+    parser.add_argument("--chunk", type=int, default=CHUNK_SIZE, help="playouts per task")
+    parser.add_argument("--progress", type=int, default=0, metavar="N",
+                        help="print a running summary every N games")
+    args = parser.parse_args()
+
+    scripts = read_scripts(args.scripts) if args.scripts else None
+    summary = Summary()
+    for result in run_playouts(args.games, args.level, scripts, args.seed, args.max_turns,
+                               args.workers, args.chunk):
+        summary.add(result)
+        if args.progress and summary.games % args.progress == 0:
+            print("%d/%d games, win rate %.1f%%" % (summary.games, args.games, 100 * summary.win_rate),
+                  file=sys.stderr)
+    print(summary.report())
+
+
+if __name__ == "__main__":
+    main()
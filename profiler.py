@@ -0,0 +1,89 @@
+import csv
+import json
+import time
+from collections import deque
+
+# Opt-in frame profiler. Game.run marks the end of each phase of a frame;
+# game and simulation code add to counters while a profiler is attached.
+# Every frame can be written to a CSV (.csv) or JSON lines file, and the
+# last HISTORY frames are kept for percentiles and the on-screen overlay.
+
+PHASES = ("input", "update", "draw", "wait")
+COUNTERS = ("tiles_drawn", "rects_allocated", "raycast_steps", "entities_updated")
+HISTORY = 600  # Frames kept for percentiles (10 seconds at 60 fps)
+
+
+def percentile(ordered, fraction):
+    # Nearest-rank percentile of an ascending list
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+class Profiler:
+    def __init__(self, path=None, history=HISTORY):
+        self.frame = 0
+        self.times = dict.fromkeys(PHASES, 0.0)  # Milliseconds per phase, this frame
+        self.counters = dict.fromkeys(COUNTERS, 0)  # This frame; shared with the simulation
+        self.history = deque(maxlen=history)  # (frame ms, phase times, counters) per frame
+        self.start = self.last = time.perf_counter()
+        self.overlay = False  # Drawn by Game when True
+
+        self.file = None
+        self.writer = None
+        if path:
+            self.file = open(path, "w", newline="")
+            if path.endswith(".csv"):
+                self.writer = csv.writer(self.file)
+                self.writer.writerow(("frame", "frame_ms") + PHASES + COUNTERS)
+
+    def begin_frame(self):
+        self.start = self.last = time.perf_counter()
+
+    def mark(self, phase):
+        # The phase that just ended took the time since the previous mark
+        now = time.perf_counter()
+        self.times[phase] = (now - self.last) * 1000
+        self.last = now
+
+    def count(self, counter, amount=1):
+        self.counters[counter] += amount
+
+    def end_frame(self):
+        total = (self.last - self.start) * 1000
+        times = tuple(self.times[phase] for phase in PHASES)
+        counters = tuple(self.counters[counter] for counter in COUNTERS)
+        self.history.append((total, times, counters))
+        if self.writer is not None:
+            self.writer.writerow((self.frame, "%.3f" % total) + tuple("%.3f" % t for t in times) + counters)
+        elif self.file is not None:
+            row = {"frame": self.frame, "frame_ms": round(total, 3)}
+            row.update(zip(PHASES, (round(t, 3) for t in times)))
+            row.update(zip(COUNTERS, counters))
+            self.file.write(json.dumps(row) + "\n")
+
+        self.frame += 1
+        for counter in COUNTERS:
+            self.counters[counter] = 0
+
+    def percentiles(self):
+        # Frame time p50, p95 and p99 in milliseconds over the kept history
+        ordered = sorted(total for total, _, _ in self.history)
+        return percentile(ordered, 0.50), percentile(ordered, 0.95), percentile(ordered, 0.99)
+
+    def report(self):
+        # Lines of text summarizing the kept history
+        frames = len(self.history) or 1
+        lines = ["frame ms  p50 %.2f  p95 %.2f  p99 %.2f" % self.percentiles()]
+        for i, phase in enumerate(PHASES):
+            lines.append("%-7s %6.2f ms" % (phase, sum(times[i] for _, times, _ in self.history) / frames))
+        if self.history:
+            _, _, counters = self.history[-1]
+            for counter, value in zip(COUNTERS, counters):
+                lines.append("%s %d" % (counter.replace("_", " "), value))
+        return lines
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
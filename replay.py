@@ -0,0 +1,142 @@
+import argparse
+import json
+import os
+
+from simulation import Action
+
+# Input recording and deterministic replay. The game only changes through the
+# actions the simulation accepts, so a session is fully described by those
+# actions (and, for real-time playback, the frames they came in on). Replayer
+# keeps a checkpoint every CHECKPOINT_INTERVAL turns, so seeking to a turn
+# replays at most that many turns.
+#
+# Log file: a JSON header line ({"version", "level", "chunks"}), then one
+# "frame ACTION" line per accepted action or UNDO.
+
+LOG_VERSION = 1
+UNDO = "UNDO"  # Logged in place of an action when a move is taken back
+CHECKPOINT_INTERVAL = 50  # Turns between replay checkpoints
+
+
+class InputLog:
+    def __init__(self, path=None, level=None, chunks=None):
+        self.path = path
+        self.level = level  # Level file or chunk directory the session was played on
+        self.chunks = chunks
+        self.frames = []  # Frame each action was applied on
+        self.actions = []
+
+    def __len__(self):
+        return len(self.actions)
+
+    def add(self, frame, action):
+        self.frames.append(frame)
+        self.actions.append(action)
+
+    def save(self, path=None):
+        with open(path or self.path, "w") as f:
+            f.write(json.dumps({"version": LOG_VERSION, "level": self.level, "chunks": self.chunks}) + "\n")
+            for frame, action in zip(self.frames, self.actions):
+                f.write("%d %s\n" % (frame, getattr(action, "name", action)))
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            header = json.loads(f.readline())
+            if header.get("version") != LOG_VERSION:
+                raise ValueError("%s: unsupported input log version %r" % (path, header.get("version")))
+            log = cls(path, header.get("level"), header.get("chunks"))
+            for line in f:
+                if line.strip():
+                    frame, name = line.split()
+                    log.add(int(frame), UNDO if name == UNDO else Action[name])
+        return log
+
+
+class Replayer:
+    # Feeds a log's actions to a Game that has just started (or restarted)
+    def __init__(self, game, log, checkpoint_every=CHECKPOINT_INTERVAL):
+        self.game = game
+        self.log = log
+        self.checkpoint_every = checkpoint_every
+        self.turn = 0  # Actions played so far
+        self.last_frame = game.frame  # Frame the previous action was played on
+        self.checkpoints = {}  # Turn -> (Game.snapshot(), undo stack) just before it
+        self.checkpoint()
+
+    @property
+    def finished(self):
+        return self.turn >= len(self.log)
+
+    def settle(self):
+        # Run updates until the game takes input again (falls, grapples, fades, restarts)
+        game = self.game
+        while not game.ready():
+            game.update()
+
+    def checkpoint(self):
+        if self.turn % self.checkpoint_every == 0 and self.turn not in self.checkpoints:
+            self.checkpoints[self.turn] = (self.game.snapshot(), list(self.game.undo_stack))
+
+    def play_next(self):
+        game = self.game
+        self.checkpoint()
+        action = self.log.actions[self.turn]
+        if action == UNDO:
+            game.undo()
+        else:
+            game.act(action)
+        self.turn += 1
+        self.last_frame = game.frame
+
+    def due(self):
+        # Real-time playback: actions (or UNDO) to apply this frame, keeping the recorded
+        # number of frames between actions. Moves wait for the game to take input;
+        # an undo can come at any time.
+        if self.finished or (self.log.actions[self.turn] != UNDO and not self.game.ready()):
+            return []
+        previous = self.log.frames[self.turn - 1] if self.turn else 0
+        if self.game.frame - self.last_frame < self.log.frames[self.turn] - previous:
+            return []
+        action = self.log.actions[self.turn]
+        self.checkpoint()
+        self.turn += 1
+        self.last_frame = self.game.frame
+        return [action]
+
+    def seek(self, turn):
+        # Fast-forward (or rewind) to just before action `turn`, without rendering
+        turn = max(0, min(turn, len(self.log)))
+        start = max(t for t in self.checkpoints if t <= turn)
+        snapshot, undo_stack = self.checkpoints[start]
+        self.game.restore(snapshot)
+        self.game.undo_stack.clear()
+        self.game.undo_stack.extend(undo_stack)
+        self.turn = start
+        self.settle()
+        while self.turn < turn:
+            self.play_next()
+            self.settle()
+        self.last_frame = self.game.frame
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a Grapplecore input log at full speed")
+    parser.add_argument("log")
+    parser.add_argument("--turn", type=int, help="stop before this action (default: play the whole log)")
+    args = parser.parse_args()
+
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")  # Nothing is drawn
+    import game
+
+    log = InputLog.load(args.log)
+    replayer = Replayer(game.Game(idle_wait=False, level=game.open_level(log.level, log.chunks)), log)
+    replayer.seek(len(log) if args.turn is None else args.turn)
+    sim = replayer.game.sim
+    print("turn %d/%d, frame %d" % (replayer.turn, len(log), replayer.game.frame))
+    print("player at %d,%d, amber %d, outcome %s" % (sim.player.x // game.GRID_SIZE, sim.player.y // game.GRID_SIZE,
+                                                     sim.amber_count, sim.outcome and sim.outcome.value))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+import argparse
+import os
+import random
+import sys
+
+import numpy as np
+
+from benchmark import synthetic_level
+from caves import generate_cave
+from level import default_level
+from simulation import OUTCOMES, Action, Simulation, cell_of
+from solver import LevelModel
+from vecenv import BATS, CRABS, PLAYER, VecEnv
+
+# Cross-check of the turn rules. They are written out four times: tick by tick
+# in Simulation.update (the reference), per turn in Simulation.resolve, at cell
+# level in the solver's LevelModel (route() for quiet turns, play_ticks() for
+# the rest) and over NumPy arrays of games in VecEnv. This plays seeded random
+# games through each of them side by side with the tick loop and reports the
+# first turn where they disagree, so a rule changed in one place and not the
+# others fails loudly. A last check plays the same inputs once with every enemy
+# stepped and once with Game's camera-following active_area, which has to give
+# the same game. Exits with status 1 on any mismatch. benchmark.py runs every
+# check before measuring, so a rule change cannot pass the benchmark while one
+# copy disagrees.
+
+# name -> function returning the level
+LEVELS = {
+    "room": default_level,
+    "large": lambda: synthetic_level(2, 1, seed=1),
+    "crowded": lambda: synthetic_level(1, 8, seed=2),
+    "cave": lambda: generate_cave(5, width=60, height=40),
+    "big": lambda: generate_cave(2),  # Several screens across, more crabs than fit in 64 bits
+}
+GAMES = 12  # Games per level and check
+TURNS = 200  # Turns per game at most
+AREA = (0, 0, 20, 15)  # Fixed active_area for the "area" check; the player may leave it
+ACTIONS = list(Action)
+
+
+def play_ticks(sim, action):
+    # A turn the way Game plays it: apply_action(), then update() until idle.
+    # Returns (started, ticks).
+    started = sim.apply_action(action)
+    ticks = 0
+    while not sim.is_idle():
+        sim.update()
+        ticks += 1
+    return started, ticks
+
+
+def check_resolve(level, games, turns, seed, area=None):
+    # Simulation.resolve against the tick loop, both with the given active_area
+    ticked = Simulation(level)
+    resolved = Simulation(level)
+    ticked.active_area = resolved.active_area = area
+    rng = random.Random(seed)
+    for game in range(games):
+        ticked.restart()
+        resolved.restart()
+        for number in range(turns):
+            action = rng.choice(ACTIONS)
+            started, ticks = play_ticks(ticked, action)
+            turn = resolved.resolve(action)
+            if turn.started != started or (started and turn.ticks != ticks):
+                return "game %d turn %d %s: resolve started=%s after %d ticks, update started=%s after %d" % (
+                    game, number, action.name, turn.started, turn.ticks, started, ticks)
+            if resolved.snapshot() != ticked.snapshot():
+                return "game %d turn %d %s: states differ" % (game, number, action.name)
+            if ticked.outcome is not None:
+                break
+    return None
+
+
+def check_area(level, games, turns, seed):
+    return check_resolve(level, games, turns, seed, AREA)
+
+
+def check_camera(level, games, turns, seed):
+    # A game whose active_area follows Game's camera tick by tick against one
+    # where every enemy moves. Enemy positions are compared once the lagging
+    # enemies have caught up (on a copy, so lag keeps building up as in play).
+    os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+    import game
+
+    view = game.Game(idle_wait=False, level=level)
+    limited = view.sim
+    full = Simulation(level)
+    rng = random.Random(seed)
+    for number in range(games):
+        view.restart_game()
+        full.restart()
+        for turn in range(turns):
+            action = rng.choice(ACTIONS)
+            where = "game %d turn %d %s" % (number, turn, action.name)
+            play_ticks(full, action)
+            limited.apply_action(action)
+            while not limited.is_idle():
+                limited.update()  # Game.update, without the fades and restarts
+                view.update_camera()
+            differences = []
+            for name, a, b in (("outcome", limited.outcome, full.outcome),
+                               ("player", vars(limited.player), vars(full.player)),
+                               ("amber", limited.amber_count, full.amber_count),
+                               ("living crabs", limited.crabs.alive[:limited.crabs.count].tolist(),
+                                full.crabs.alive[:full.crabs.count].tolist())):
+                if a != b:
+                    differences.append(name)
+            if differences:
+                return "%s: area-limited game differs in %s" % (where, ", ".join(differences))
+
+            snapshot = limited.snapshot()
+            limited.bats.catch_up()
+            limited.crabs.catch_up()
+            caught_up = limited.snapshot() == full.snapshot()
+            limited.restore(snapshot)
+            if not caught_up:
+                return "%s: enemies differ after catching up" % where
+            if full.outcome is not None:
+                break
+    return None
+
+
+def model_differences(model, state, sim):
+    # Parts of a LevelModel state that disagree with the simulation
+    x, y, fallen, phase, mask, amber = state
+    player = sim.player
+    bat_x, bat_y, crab_x, crab_y = sim.enemy_cells()
+    alive = sim.crabs.alive[:sim.crabs.count]
+    differences = []
+    if (x, y) != cell_of(player.x, player.y):
+        differences.append("player cell")
+    if bool(fallen) != (player.fall_delay > 0):
+        differences.append("fall delay")
+    if amber != sim.amber_count:
+        differences.append("amber")
+    if [bool(mask >> i & 1) for i in range(model.crab_count)] != alive.tolist():
+        differences.append("living crabs")
+    if [model.bats.cell(i, phase) for i in range(len(bat_x))] != list(zip(bat_x.tolist(), bat_y.tolist())):
+        differences.append("bat cells")
+    cells = list(zip(crab_x.tolist(), crab_y.tolist()))
+    if any(alive[i] and model.crabs.cell(i, phase) != cells[i] for i in range(len(cells))):
+        differences.append("crab cells")
+    return differences
+
+
+def check_solver(level, games, turns, seed):
+    # LevelModel.play (quiet routes included) and play_ticks against the tick loop
+    model = LevelModel(level)
+    sim = Simulation(level)
+    rng = random.Random(seed)
+    for game in range(games):
+        state = model.start()
+        sim.restart()
+        for number in range(turns):
+            action = rng.choice(ACTIONS)
+            play_ticks(sim, action)
+            for name, play in (("play", model.play), ("play_ticks", model.play_ticks)):
+                result = play(state, action)
+                outcome, after = (None, state) if result is None else result
+                if outcome != sim.outcome:
+                    return "game %d turn %d %s: %s ended in %s, update in %s" % (
+                        game, number, action.name, name, outcome, sim.outcome)
+                differences = [] if outcome is not None else model_differences(model, after, sim)
+                if differences:
+                    return "game %d turn %d %s: %s differs in %s" % (
+                        game, number, action.name, name, ", ".join(differences))
+            if sim.outcome is not None:
+                break
+            state = after
+    return None
+
+
+def check_vecenv(level, games, turns, seed):
+    # VecEnv against one tick-loop Simulation per game, observations included
+    env = VecEnv(games, level, max_turns=turns + 1)
+    sims = [Simulation(level) for _ in range(games)]
+    width = env.width
+    height = env.height
+    rng = np.random.default_rng(seed)
+    observation = env.reset()
+    for number in range(turns):
+        actions = rng.integers(0, len(ACTIONS), games)
+        observation, rewards, terminated, truncated, outcomes = env.step(actions)
+        for i, sim in enumerate(sims):
+            action = Action(int(actions[i]))
+            play_ticks(sim, action)
+            where = "game %d turn %d %s" % (i, number, action.name)
+            if OUTCOMES.index(sim.outcome) != outcomes[i]:
+                return "%s: VecEnv ended in %s, update in %s" % (where, OUTCOMES[outcomes[i]], sim.outcome)
+            if sim.outcome is not None:
+                sim.restart()  # VecEnv has already restarted the game
+                continue
+            alive = sim.crabs.alive[:sim.crabs.count]
+            bat_x, bat_y, crab_x, crab_y = sim.enemy_cells()
+            bat_cells = bat_y * width + bat_x
+            inside = (crab_x >= 0) & (crab_x < width) & (crab_y >= 0) & (crab_y < height)
+            crab_cells = np.where(inside, crab_y * width + crab_x, width * height)
+            differences = []
+            if cell_of(sim.player.x, sim.player.y) != (env.x[i], env.y[i]):
+                differences.append("player cell")
+            if sim.amber_count != env.amber[i]:
+                differences.append("amber")
+            if not (alive == env.alive[i]).all():
+                differences.append("living crabs")
+            if not (env.bats.at(env.steps[i:i + 1])[0] == bat_cells).all():
+                differences.append("bat cells")
+            if not (env.crabs.at(env.steps[i:i + 1])[0] == crab_cells)[alive].all():
+                differences.append("crab cells")
+            if differences:
+                return "%s: VecEnv differs in %s" % (where, ", ".join(differences))
+
+        # Entity channels of every game, restarted ones included
+        for i, sim in enumerate(sims):
+            bat_x, bat_y, crab_x, crab_y = sim.enemy_cells()
+            alive = sim.crabs.alive[:sim.crabs.count]
+            shown = alive & (crab_x >= 0) & (crab_x < width) & (crab_y >= 0) & (crab_y < height)
+            player_x, player_y = cell_of(sim.player.x, sim.player.y)
+            for channel, ys, xs in ((PLAYER, player_y, player_x),
+                                    (BATS, bat_y, bat_x), (CRABS, crab_y[shown], crab_x[shown])):
+                expected = np.zeros((height, width), np.uint8)
+                expected[ys, xs] = 1
+                if not (observation[i, channel] == expected).all():
+                    return "game %d turn %d: observation channel %d differs" % (i, number, channel)
+    return None
+
+
+# name -> check(level, games, turns, seed), returning a mismatch description or None
+CHECKS = {
+    "resolve": check_resolve,
+    "area": check_area,
+    "solver": check_solver,
+    "vecenv": check_vecenv,
+    "camera": check_camera,
+}
+
+
+def run_checks(levels, checks, games=GAMES, turns=TURNS, seed=0, log=print):
+    # Returns the number of failed checks
+    failures = 0
+    for name in levels:
+        level = LEVELS[name]()
+        for check in checks:
+            mismatch = CHECKS[check](level, games, turns, seed)
+            if mismatch is None:
+                log("%-8s %-8s ok" % (name, check))
+            else:
+                log("%-8s %-8s MISMATCH %s" % (name, check, mismatch))
+                failures += 1
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check that every copy of the Grapplecore turn rules agrees")
+    parser.add_argument("--levels", default=",".join(LEVELS),
+                        help="comma-separated levels to play (default: %(default)s)")
+    parser.add_argument("--checks", default=",".join(CHECKS),
+                        help="comma-separated checks to run (default: %(default)s)")
+    parser.add_argument("--games", type=int, default=GAMES, help="games per level and check")
+    parser.add_argument("--turns", type=int, default=TURNS, help="turns per game at most")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    levels = args.levels.split(",")
+    for name in levels:
+        if name not in LEVELS:
+            parser.error("unknown level %r (choose from %s)" % (name, ", ".join(LEVELS)))
+    checks = args.checks.split(",")
+    for check in checks:
+        if check not in CHECKS:
+            parser.error("unknown check %r (choose from %s)" % (check, ", ".join(CHECKS)))
+
+    failures = run_checks(levels, checks, args.games, args.turns, args.seed)
+    if failures:
+        print("%d check(s) found rule mismatches" % failures)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
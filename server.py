@@ -0,0 +1,342 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+import secrets
+import struct
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from level import default_level, load_level
+from simulation import GRID_SIZE, Action, Simulation
+
+# Many concurrent headless sessions in one process, for tournaments and bots.
+#
+# A session is just its Simulation.snapshot() bytes plus a turn count: one
+# Simulation per level is shared by every session on it, and a request
+# restores the session's snapshot, resolves the turn (Simulation.resolve) and
+# takes a new snapshot. Sessions not used for a while, or beyond the resident
+# limit (least recently used first), are written to disk and read back when
+# they are next used, so memory stays bounded however many sessions exist.
+#
+# Protocol: one JSON object per line each way, over TCP or a Unix socket.
+#   {"op": "new", "level": NAME}                 -> {"session": ID, ...state}
+#   {"op": "act", "session": ID, "action": NAME} -> {"outcome", "cells", "events", ...state}
+#   {"op": "state", "session": ID}               -> {...state}
+#   {"op": "restart", "session": ID}             -> {...state}
+#   {"op": "close", "session": ID}               -> {"closed": ID}
+# "level" is optional (the first level served); action names are Action
+# members (LEFT, GRAPPLE_UP, ...). Failed requests get {"error": message}.
+
+MAX_RESIDENT = 100000  # Sessions kept in memory
+IDLE_SECONDS = 300  # Sessions unused this long are written to disk
+SWEEP_INTERVAL = 10  # Seconds between idle sweeps
+SESSION_HEADER = struct.Struct("<IH")  # Session file: turns, level name length; then the name and snapshot
+SESSION_ID = re.compile(r"[0-9a-f]{16}\Z")
+
+
+class Session:
+    __slots__ = ("id", "level", "state", "turns", "last_used")
+
+    def __init__(self, id, level, state, turns=0):
+        self.id = id
+        self.level = level  # Name of the level
+        self.state = state  # Simulation snapshot
+        self.turns = turns  # Actions played since the last restart
+        self.last_used = time.monotonic()
+
+
+class SessionStore:
+    # Session files are read and written on one disk thread, in request order,
+    # so the event loop never waits on the disk and a later write of a session
+    # always lands after an earlier one
+    def __init__(self, levels, directory, max_resident=MAX_RESIDENT, idle_seconds=IDLE_SECONDS):
+        # levels: name -> Level; the first one is the default
+        self.sims = {name: Simulation(level) for name, level in levels.items()}
+        self.default_level = next(iter(levels))
+        self.directory = directory
+        self.max_resident = max_resident
+        self.idle_seconds = idle_seconds
+        self.sessions = OrderedDict()  # Resident sessions, least recently used first
+        self.writing = {}  # Session id -> (session, task writing its file) while it is written out
+        self.reading = {}  # Session id -> future of its file being read
+        self.loaded = {}  # Level name -> id of the session its Simulation holds
+        self.disk = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sessions")
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, session_id):
+        return os.path.join(self.directory, session_id + ".session")
+
+    async def on_disk(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.disk, function, *args)
+
+    async def create(self, level=None):
+        level = level or self.default_level
+        if level not in self.sims:
+            raise KeyError("unknown level %r" % level)
+        sim = self.sims[level]
+        session = Session(secrets.token_hex(8), level, sim.start)
+        self.sessions[session.id] = session
+        return session
+
+    async def get(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None and session_id in self.writing:
+            # Let the write finish and read the file back like any other, so a
+            # file never outlives its session's return to memory
+            await asyncio.wait([self.writing[session_id][1]])
+            session = self.sessions.get(session_id)  # Back in memory if the write failed
+        if session is None:
+            # Requests for the same session while its file is read share the read
+            future = self.reading.get(session_id)
+            if future is None:
+                future = self.reading[session_id] = asyncio.ensure_future(self.on_disk(self.read, session_id))
+            try:
+                session = await future
+            finally:
+                if self.reading.get(session_id) is future:
+                    del self.reading[session_id]
+            session = self.sessions.get(session_id, session)
+        self.sessions[session_id] = session
+        self.sessions.move_to_end(session_id)
+        session.last_used = time.monotonic()
+        return session
+
+    def sim(self, session):
+        # The level's Simulation, holding this session's state
+        sim = self.sims[session.level]
+        if self.loaded.get(session.level) != session.id:
+            sim.restore(session.state)
+            self.loaded[session.level] = session.id
+        return sim
+
+    async def close(self, session_id):
+        self.sessions.pop(session_id, None)
+        self.writing.pop(session_id, None)
+        for level, loaded in list(self.loaded.items()):
+            if loaded == session_id:
+                del self.loaded[level]
+        if SESSION_ID.match(session_id):
+            await self.on_disk(self.remove, session_id)  # After any write of it still queued
+
+    def read(self, session_id):
+        if not SESSION_ID.match(session_id) or not os.path.exists(self.path(session_id)):
+            raise KeyError("unknown session %r" % session_id)
+        with open(self.path(session_id), "rb") as f:
+            data = f.read()
+        turns, name_length = SESSION_HEADER.unpack_from(data)
+        start = SESSION_HEADER.size + name_length
+        level = data[SESSION_HEADER.size:start].decode()
+        if level not in self.sims:
+            raise KeyError("session %r is on level %r, which is not served" % (session_id, level))
+        os.remove(self.path(session_id))  # The resident copy is the current one now
+        return Session(session_id, level, data[start:], turns)
+
+    def write(self, session):
+        name = session.level.encode()
+        with open(self.path(session.id), "wb") as f:
+            f.write(SESSION_HEADER.pack(session.turns, len(name)) + name + session.state)
+
+    def write_all(self, sessions):
+        # Write sessions out; returns [(session, OSError)] for the ones that failed
+        failed = []
+        for session in sessions:
+            try:
+                self.write(session)
+            except OSError as error:
+                failed.append((session, error))
+        return failed
+
+    def remove(self, session_id):
+        if os.path.exists(self.path(session_id)):
+            os.remove(self.path(session_id))
+
+    async def write_out(self, sessions):
+        # Move sessions already taken out of memory to disk. Sessions that could not
+        # be written go back into memory, and the first error is raised.
+        task = asyncio.ensure_future(self.write_back(sessions))
+        for session in sessions:
+            self.writing[session.id] = (session, task)
+        failed = await task
+        if failed:
+            raise failed[0][1]
+        return len(sessions)
+
+    async def write_back(self, sessions):
+        # The disk half of write_out(); requests for the sessions wait for it
+        failed = await self.on_disk(self.write_all, sessions)
+        errors = {session.id for session, _ in failed}
+        for session in sessions:
+            entry = self.writing.get(session.id)
+            if entry is None or entry[0] is not session:
+                continue  # Closed meanwhile
+            del self.writing[session.id]
+            if session.id in errors and session.id not in self.sessions:
+                self.sessions[session.id] = session
+                self.sessions.move_to_end(session.id, last=False)
+        return failed
+
+    async def evict(self, keep):
+        # Write least recently used sessions to disk until at most `keep` are resident.
+        # Failures only concern the evicted sessions, which stay in memory, so they
+        # are reported here rather than to the client that happened to trigger them.
+        sessions = []
+        while len(self.sessions) > keep:
+            sessions.append(self.sessions.popitem(last=False)[1])
+        if sessions:
+            try:
+                await self.write_out(sessions)
+            except OSError as error:
+                print("could not write sessions out: %s" % error, file=sys.stderr)
+
+    async def evict_idle(self):
+        # Write sessions unused for idle_seconds to disk; returns how many
+        deadline = time.monotonic() - self.idle_seconds
+        sessions = []
+        while self.sessions and next(iter(self.sessions.values())).last_used <= deadline:
+            sessions.append(self.sessions.popitem(last=False)[1])
+        if not sessions:
+            return 0
+        return await self.write_out(sessions)
+
+    def flush(self):
+        # Write every session to disk once the event loop is done with the store
+        self.disk.shutdown(wait=True)
+        sessions = [session for session, _ in self.writing.values()] + list(self.sessions.values())
+        self.writing.clear()
+        self.sessions.clear()
+        failed = self.write_all(sessions)
+        for session, error in failed:
+            print("could not save session %s: %s" % (session.id, error), file=sys.stderr)
+
+    def describe(self, session, sim):
+        player = sim.player
+        return {
+            "session": session.id,
+            "level": session.level,
+            "turn": session.turns,
+            "player": [player.x // GRID_SIZE, player.y // GRID_SIZE],
+            "amber": sim.amber_count,
+            "outcome": sim.outcome and sim.outcome.value,
+            "waiting": sim.waiting_for_input and sim.outcome is None,
+        }
+
+    async def handle(self, request):
+        # One protocol request (a dict) -> reply dict
+        reply = await self.respond(request)
+        await self.evict(self.max_resident)  # Once the session's new state is stored
+        return reply
+
+    async def respond(self, request):
+        op = request.get("op")
+        if op == "new":
+            session = await self.create(request.get("level"))
+            return self.describe(session, self.sim(session))
+        if op == "close":
+            await self.close(str(request.get("session")))
+            return {"closed": request.get("session")}
+        if op not in ("act", "state", "restart"):
+            raise ValueError("unknown op %r" % op)
+
+        session = await self.get(str(request.get("session")))
+        sim = self.sim(session)
+        if op == "state":
+            return self.describe(session, sim)
+        if op == "restart":
+            sim.restart()
+            session.turns = 0
+            session.state = sim.snapshot()
+            return self.describe(session, sim)
+
+        action = request.get("action")
+        if action not in Action.__members__:
+            raise ValueError("unknown action %r" % action)
+        turn = sim.resolve(Action[action])
+        if turn.started:
+            session.turns += 1
+        session.state = sim.snapshot()
+        reply = self.describe(session, sim)
+        reply["started"] = turn.started
+        reply["ticks"] = turn.ticks
+        reply["cells"] = [list(cell) for cell in turn.cells]
+        reply["events"] = [[step, getattr(event, "value", event)] for step, event in turn.events]
+        return reply
+
+
+async def serve_client(store, reader, writer):
+    try:
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            try:
+                reply = await store.handle(json.loads(line))
+            except OSError as error:
+                reply = {"error": "session storage failed: %s" % error}
+            except (ValueError, KeyError, TypeError, AttributeError) as error:
+                reply = {"error": str(error.args[0] if error.args else error)}
+            writer.write(json.dumps(reply).encode() + b"\n")
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def sweep(store, interval=SWEEP_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await store.evict_idle()
+        except OSError as error:
+            print("idle sweep: could not write sessions out: %s" % error, file=sys.stderr)
+
+
+async def run_server(store, host="127.0.0.1", port=8765, unix=None):
+    def client(reader, writer):
+        return serve_client(store, reader, writer)
+
+    if unix:
+        server = await asyncio.start_unix_server(client, unix)
+    else:
+        server = await asyncio.start_server(client, host, port)
+    sweeper = asyncio.create_task(sweep(store))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        sweeper.cancel()
+        store.flush()  # Sessions survive a server restart
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve many headless Grapplecore sessions over JSON lines")
+    parser.add_argument("--level", action="append", metavar="PATH",
+                        help="level file to serve, named after the file (repeatable; default: the debug room)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", metavar="PATH", help="listen on a Unix socket instead of TCP")
+    parser.add_argument("--sessions", default="sessions", metavar="DIR",
+                        help="directory for sessions written out of memory (default: %(default)s)")
+    parser.add_argument("--max-resident", type=int, default=MAX_RESIDENT,
+                        help="sessions kept in memory (default: %(default)s)")
+    parser.add_argument("--idle", type=float, default=IDLE_SECONDS,
+                        help="seconds before an unused session is written to disk (default: %(default)s)")
+    args = parser.parse_args()
+
+    if args.level:
+        levels = OrderedDict((os.path.splitext(os.path.basename(path))[0], load_level(path)) for path in args.level)
+    else:
+        levels = {"debug_room": default_level()}
+    store = SessionStore(levels, args.sessions, args.max_resident, args.idle)
+    try:
+        asyncio.run(run_server(store, args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
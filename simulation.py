@@ -0,0 +1,579 @@
+import enum
+import math
+import struct
+
+from level import LEVEL_HEIGHT, default_level
+from enemies import HORIZONTAL, ROW_BYTES, VERTICAL, PatrolGroup, PatrolView
+from occupancy import make_occupancy
+
+# Headless simulation core - no pygame, no window, no clock.
+# Game (game.py) wraps a Simulation and only adds input, fades and drawing.
+
+# Constants
+GRID_SIZE = 32
+FALL_DELAY = 3  # Ticks between grid steps while falling
+GRAPPLE_TICKS_PER_CELL = 3  # Ticks per grid step while grappling
+# Snapshot header: player x, y, hook target x/y, grapple/fall ticks remaining,
+# fall delay, amber; grappling, falling, just moved, game over, waiting, outcome; hook length
+STATE = struct.Struct("<8i6Bd")
+
+
+class Action(enum.IntEnum):
+    LEFT = 0
+    RIGHT = 1
+    JUMP = 2
+    GRAPPLE_LEFT = 3
+    GRAPPLE_UP = 4
+    GRAPPLE_RIGHT = 5
+
+
+# Grappling hook direction for each grapple action (only cardinal directions)
+GRAPPLE_DIRECTIONS = {
+    Action.GRAPPLE_LEFT: (-1, 0),
+    Action.GRAPPLE_UP: (0, -1),
+    Action.GRAPPLE_RIGHT: (1, 0),
+}
+
+
+class Outcome(enum.Enum):
+    EXIT = "exit"
+    BAT = "bat"
+    CRAB = "crab"
+    POISON = "poison"
+
+
+OUTCOMES = [None] + list(Outcome)  # Outcome <-> snapshot code
+
+
+def cell_of(x, y):
+    # Grid cell of a (grid-aligned) pixel position
+    return int(x // GRID_SIZE), int(y // GRID_SIZE)
+
+
+def bat_group(occupancy=None):
+    return PatrolGroup(VERTICAL, GRID_SIZE, occupancy)
+
+
+def crab_group(occupancy=None):
+    return PatrolGroup(HORIZONTAL, GRID_SIZE, occupancy)
+
+
+class Bat(PatrolView):
+    # View of one bat in a PatrolGroup; a standalone bat gets a group of its own
+    __slots__ = ()
+
+    def __init__(self, x, y, group=None, level_height=LEVEL_HEIGHT):
+        if group is None:
+            group = bat_group()
+        ceiling_y = GRID_SIZE
+        floor_y = (level_height - 2) * GRID_SIZE
+        # Moves one grid space per tick, 1 = moving down, -1 = moving up
+        super().__init__(group, group.add(x, y, ceiling_y, floor_y))
+
+    @property
+    def ceiling_y(self):
+        return int(self.group.low[self.index])
+
+    @property
+    def floor_y(self):
+        return int(self.group.high[self.index])
+
+
+class AmberCrab(PatrolView):
+    # View of one crab in a PatrolGroup; a standalone crab gets a group of its own
+    __slots__ = ()
+
+    def __init__(self, x, y, group=None):
+        if group is None:
+            group = crab_group()
+        move_range = GRID_SIZE * 4  # Move 4 grid spaces back and forth
+        # Moves one grid space per tick, 1 = moving right, -1 = moving left
+        super().__init__(group, group.add(x, y, x, x + move_range))
+
+    @property
+    def start_x(self):
+        return int(self.group.low[self.index])
+
+    @property
+    def move_range(self):
+        return int(self.group.high[self.index] - self.group.low[self.index])
+
+
+class Player:
+    def __init__(self, x, y):
+        self.x = x
+        self.y = y
+        self.grappling = False
+        self.hook_target_x = 0
+        self.hook_target_y = 0
+        self.grapple_ticks_remaining = 0
+        self.falling = False
+        self.fall_ticks_remaining = 0
+        self.fall_delay = 0
+        self.just_moved = False
+
+    def update(self, world):
+        if self.grappling:
+            # Grid-based grappling - move one grid space every 3 ticks (slower)
+            if self.grapple_ticks_remaining > 0:
+                # Only move every 3 ticks
+                if self.grapple_ticks_remaining % GRAPPLE_TICKS_PER_CELL == 0:
+                    dx = self.hook_target_x - self.x
+                    dy = self.hook_target_y - self.y
+
+                    # Move one grid space towards target
+                    if abs(dx) > abs(dy):
+                        # Move horizontally
+                        if dx > 0:
+                            self.x += GRID_SIZE
+                        else:
+                            self.x -= GRID_SIZE
+                    else:
+                        # Move vertically
+                        if dy > 0:
+                            self.y += GRID_SIZE
+                        else:
+                            self.y -= GRID_SIZE
+
+                self.grapple_ticks_remaining -= 1
+            else:
+                # Grappling complete
+                self.stop_grappling()
+        elif self.falling:
+            # Grid-based falling with delay - move one grid space down per tick
+            if self.fall_ticks_remaining > 0:
+                if self.fall_delay <= 0:
+                    # Time to move down one space
+                    self.y += GRID_SIZE
+                    self.fall_ticks_remaining -= 1
+                    self.fall_delay = FALL_DELAY  # Wait 3 frames before next fall
+                else:
+                    # Still waiting
+                    self.fall_delay -= 1
+            else:
+                # Falling complete
+                self.falling = False
+
+    def moved_this_tick(self):
+        # Check if player moved a full grid space this update
+        return (self.grappling and self.grapple_ticks_remaining > 0 and self.grapple_ticks_remaining % GRAPPLE_TICKS_PER_CELL == 0) or (self.falling and self.fall_ticks_remaining > 0 and self.fall_delay <= 0) or self.just_moved
+
+    def move_left(self, world, game):
+        # Check if can move left
+        new_x = self.x - GRID_SIZE
+        if self.can_move_to(new_x, self.y, world):
+            self.x = new_x
+            self.just_moved = True  # Mark that player moved
+            # Check if player should fall after moving
+            self.start_falling(world)
+            return True
+        return False
+
+    def move_right(self, world, game):
+        # Check if can move right
+        new_x = self.x + GRID_SIZE
+        if self.can_move_to(new_x, self.y, world):
+            self.x = new_x
+            self.just_moved = True  # Mark that player moved
+            # Check if player should fall after moving
+            self.start_falling(world)
+            return True
+        return False
+
+    def jump(self, world, game):
+        # Check if can jump up
+        new_y = self.y - GRID_SIZE
+        if self.can_move_to(self.x, new_y, world):
+            self.y = new_y
+            self.just_moved = True  # Mark that player moved
+            # Check if player should fall after jumping
+            self.start_falling(world)
+            return True
+        return False
+
+    def can_move_to(self, x, y, world):
+        # Check if position is valid (inside the grid and not inside walls)
+        return not world.is_solid(int(x // GRID_SIZE), int(y // GRID_SIZE))
+
+    def start_falling(self, world):
+        # Calculate how many spaces the player can fall (O(1) with the world's distance index)
+        fall_distance = world.free_run(int(self.x // GRID_SIZE), int(self.y // GRID_SIZE), 0, 1)
+
+        if fall_distance > 0:
+            self.falling = True
+            self.fall_ticks_remaining = fall_distance
+            return True
+        return False
+
+    def start_grappling(self, target_x, target_y):
+        self.grappling = True
+        self.hook_target_x = target_x
+        self.hook_target_y = target_y
+        dx = target_x - self.x
+        dy = target_y - self.y
+        self.hook_length = math.sqrt(dx*dx + dy*dy)
+
+        # Calculate distance in grid spaces
+        grid_distance = max(abs(dx // GRID_SIZE), abs(dy // GRID_SIZE))
+        self.grapple_ticks_remaining = grid_distance * GRAPPLE_TICKS_PER_CELL  # Make grappling 3x slower
+
+    def stop_grappling(self):
+        self.grappling = False
+
+
+class Turn:
+    # One action played out by Simulation.resolve(). Step 0 is the start of the
+    # turn; a step follows every tick on which the player changed cell or the
+    # enemies moved (a lateral move or jump happens before the first tick, on
+    # tick 0). Cells are grid cells.
+    def __init__(self, action, cell):
+        self.action = action
+        self.started = False  # False if the action did nothing (or only hooked a crab)
+        self.outcome = None  # Outcome the turn ended in, if any
+        self.ticks = 0  # update() calls the turn took
+        self.cells = [cell]  # Player cell at each step
+        self.step_ticks = [0]  # Tick of each step
+        # With record=True, (bat xs, bat ys, crab xs, crab ys) cell arrays at each
+        # step, dead crabs included (only the hook kills crabs, before the first step)
+        self.enemies = []
+        self.events = []  # (step, event): "amber" (crab hooked), "poison" (amber lost) or an Outcome
+
+
+class Simulation:
+    def __init__(self, level=None):
+        # Load the level (the built-in debug room by default)
+        if level is None:
+            level = default_level()
+        self.level = level
+        self.world = level.world  # TileGrid or ChunkedWorld; edits survive restarts
+        self.world.build_distance_index()
+        # Cells (x0, y0, x1, y1) where enemies move; None simulates the whole level.
+        # Enemies elsewhere catch up when their patrol reaches it again, so the
+        # game plays the same either way as long as the player stays well inside.
+        self.active_area = None
+        self.start = None  # Snapshot of the freshly built level; restarts just restore it
+        self.counters = None  # Profiler counters to add to, if any (see profiler.py)
+        self.restart()
+
+    def set_tile(self, grid_x, grid_y, tile):
+        # Edit the terrain; world.version tells renderers to rebuild their caches
+        self.world.set(grid_x, grid_y, tile)
+
+    def restart(self):
+        if self.start is not None:
+            self.restore(self.start)
+            return
+        self.build()
+        self.start = self.snapshot()
+
+    def build(self):
+        # Create game state from the level's spawn point and entity tables
+        level = self.level
+        self.game_over = False
+        self.outcome = None
+        self.waiting_for_input = True
+        self.amber_count = 0
+
+        self.player = Player(level.spawn_x * GRID_SIZE, level.spawn_y * GRID_SIZE)
+
+        # Enemies live in packed arrays, indexed by grid cell for collisions
+        width = self.world.width
+        height = self.world.height
+        bats = level.bats
+        self.bats = bat_group(make_occupancy(width, height))
+        self.bats.add_many(bats["x"] * GRID_SIZE, bats["y"] * GRID_SIZE,
+                           bats["ceiling"] * GRID_SIZE, bats["floor"] * GRID_SIZE)
+        self.bat = Bat.of(self.bats, 0) if len(bats) else None
+
+        crabs = level.crabs
+        self.crabs = crab_group(make_occupancy(width, height))
+        self.crabs.add_many(crabs["x"] * GRID_SIZE, crabs["y"] * GRID_SIZE,
+                            crabs["x"] * GRID_SIZE, (crabs["x"] + crabs["range"]) * GRID_SIZE)
+        self.amber_crabs = [AmberCrab.of(self.crabs, i) for i in range(len(crabs))]
+
+        self.poison_clouds = [(x * GRID_SIZE, y * GRID_SIZE) for x, y in level.poison.tolist()]
+        self.exit_x = level.exit_x * GRID_SIZE
+        self.exit_y = level.exit_y * GRID_SIZE
+
+        self.index_entities()
+
+    def snapshot(self):
+        # All mutable game state as bytes: a few microseconds to take or restore,
+        # and safe to keep, compare or write out. Terrain edits are not included.
+        player = self.player
+        return STATE.pack(player.x, player.y, player.hook_target_x, player.hook_target_y,
+                          player.grapple_ticks_remaining, player.fall_ticks_remaining,
+                          player.fall_delay, self.amber_count, player.grappling, player.falling,
+                          player.just_moved, self.game_over, self.waiting_for_input,
+                          OUTCOMES.index(self.outcome), getattr(player, "hook_length", 0.0)) + \
+            self.bats.snapshot() + self.crabs.snapshot()
+
+    def restore(self, snapshot):
+        # Return to a snapshot() of this level
+        player = self.player
+        (player.x, player.y, player.hook_target_x, player.hook_target_y,
+         player.grapple_ticks_remaining, player.fall_ticks_remaining, player.fall_delay,
+         self.amber_count, grappling, falling, just_moved, game_over, waiting, outcome,
+         player.hook_length) = STATE.unpack_from(snapshot)
+        player.grappling = grappling == 1
+        player.falling = falling == 1
+        player.just_moved = just_moved == 1
+        self.game_over = game_over == 1
+        self.waiting_for_input = waiting == 1
+        self.outcome = OUTCOMES[outcome]
+        snapshot = memoryview(snapshot)
+        split = STATE.size + self.bats.count * ROW_BYTES
+        self.bats.restore(snapshot[STATE.size:split])
+        self.crabs.restore(snapshot[split:])
+
+    def index_entities(self):
+        # Rebuild the cell lookups for static hazards; call after editing them
+        self.poison_cells = {cell_of(poison_x, poison_y) for poison_x, poison_y in self.poison_clouds}
+        self.exit_cell = cell_of(self.exit_x, self.exit_y)
+
+    def is_idle(self):
+        # Nothing will change until the next action
+        return self.waiting_for_input or self.outcome is not None
+
+    def apply_action(self, action):
+        # Start a turn; returns True if the player started moving
+        if not self.waiting_for_input or self.outcome is not None:
+            return False
+
+        if action == Action.LEFT:
+            started = self.player.move_left(self.world, self)
+        elif action == Action.RIGHT:
+            started = self.player.move_right(self.world, self)
+        elif action == Action.JUMP:
+            started = self.player.jump(self.world, self)
+        else:
+            # Grappling hook - find nearest solid block or crab
+            dx, dy = GRAPPLE_DIRECTIONS[action]
+            target_x, target_y = self.find_grapple_target(self.player.x, self.player.y, dx, dy)
+            started = target_x is not None
+            if started:
+                self.player.start_grappling(target_x, target_y)
+            # If target_x is None, we hit a crab and turn ends immediately
+
+        if started:
+            self.waiting_for_input = False
+        return started
+
+    def find_grapple_target(self, start_x, start_y, dx, dy):
+        # Find the nearest solid block in the given direction (the boundary counts as solid)
+        grid_x = int(start_x // GRID_SIZE)
+        grid_y = int(start_y // GRID_SIZE)
+        distance = self.world.free_run(grid_x, grid_y, dx, dy)
+        if self.counters is not None:
+            self.counters["raycast_steps"] += distance + 1
+
+        # Check for crab collision first - the hook stops at the first crab on
+        # its way, including one sitting in the solid block itself
+        if self.active_area is not None:
+            # The ray can leave the active area; crabs that may be on it must be up to date
+            end_x = grid_x + dx * (distance + 1)
+            end_y = grid_y + dy * (distance + 1)
+            self.crabs.catch_up((min(grid_x, end_x), min(grid_y, end_y), max(grid_x, end_x) + 1, max(grid_y, end_y) + 1))
+        step = self.crabs.occupancy.nearest_on_ray(grid_x, grid_y, dx, dy, distance + 1)
+        if step is not None:
+            # Hit a crab - kill it and return None to indicate no movement
+            self.crabs.kill(self.crabs.find_at((grid_x + dx * step, grid_y + dy * step)))
+            self.amber_count += 1
+            return None, None
+
+        # Return the position one space before the solid block (so player lands next to it)
+        return start_x + dx * distance * GRID_SIZE, start_y + dy * distance * GRID_SIZE
+
+    def die(self, outcome):
+        self.game_over = True
+        self.outcome = outcome
+
+    def update(self):
+        # Advance the current turn by one tick
+        if self.is_idle():
+            return
+
+        player = self.player
+        player.update(self.world)
+
+        # Check if player moved a full grid space (for bat and crab synchronization)
+        if player.moved_this_tick():
+            self.bats.step(self.active_area)  # Move bats when player moves one grid space
+            self.crabs.step(self.active_area)  # Move all alive crabs in one vectorized pass
+            if self.counters is not None:
+                self.counters["entities_updated"] += len(self.bats) + len(self.crabs)
+            player.just_moved = False  # Reset the flag
+
+            # Check poison cloud collision (only when player actually moves)
+            if cell_of(player.x, player.y) in self.poison_cells:
+                if self.amber_count > 0:
+                    self.amber_count -= 1
+                    # Don't die if we have amber - just lose one amber per movement
+                else:
+                    # Player dies if they have no amber
+                    self.die(Outcome.POISON)
+                    return
+
+        player_cell = cell_of(player.x, player.y)
+
+        # Check exit collision (victory)
+        if player_cell == self.exit_cell:
+            self.outcome = Outcome.EXIT
+            self.waiting_for_input = True
+            return
+
+        # Check crab collision (game over)
+        if self.crabs.occupancy.count(player_cell):
+            self.die(Outcome.CRAB)
+            return
+
+        # Check bat collision (game over)
+        if self.bats.occupancy.count(player_cell):
+            self.die(Outcome.BAT)
+            return
+
+        # Check if turn is complete
+        if not player.grappling and not player.falling:
+            # Player has completed their move
+            self.waiting_for_input = True
+
+    def enemy_cells(self):
+        bats = self.bats
+        crabs = self.crabs
+        return (bats.x[:bats.count] // GRID_SIZE, bats.y[:bats.count] // GRID_SIZE,
+                crabs.x[:crabs.count] // GRID_SIZE, crabs.y[:crabs.count] // GRID_SIZE)
+
+    def resolve(self, action, record=False):
+        # Play a whole turn in one call: the same result as apply_action() and then
+        # update() until idle, but ticks where only a countdown runs are skipped and
+        # collisions are checked only when the player or the enemies moved.
+        # Returns a Turn; record=True also keeps enemy positions at every step.
+        player = self.player
+        turn = Turn(action, cell_of(player.x, player.y))
+        amber = self.amber_count
+        turn.started = self.apply_action(action)
+        if record:
+            turn.enemies.append(self.enemy_cells())
+        if not turn.started:
+            if self.amber_count > amber:
+                turn.events.append((0, "amber"))
+            turn.outcome = self.outcome
+            return turn
+
+        cells = turn.cells
+        step_ticks = turn.step_ticks
+        events = turn.events
+        x = player.x
+        y = player.y
+        if player.just_moved:
+            cells.append(cell_of(x, y))
+            step_ticks.append(0)
+            if record:
+                turn.enemies.append(turn.enemies[0])
+
+        bats = self.bats
+        crabs = self.crabs
+        bat_cells = bats.occupancy
+        crab_cells = crabs.occupancy
+        area = self.active_area
+        counters = self.counters
+        grappling = player.grappling
+        remaining = player.grapple_ticks_remaining
+        target_x = player.hook_target_x
+        target_y = player.hook_target_y
+        falling = player.falling
+        fall_left = player.fall_ticks_remaining
+        delay = player.fall_delay
+        just_moved = player.just_moved
+        checked = False  # The current cell has been checked against the current enemies
+        tick = 0
+        while True:
+            tick += 1
+            moved_cell = False
+            if grappling:
+                if remaining > 0:
+                    if remaining % GRAPPLE_TICKS_PER_CELL == 0:
+                        dx = target_x - x
+                        dy = target_y - y
+                        if abs(dx) > abs(dy):
+                            x += GRID_SIZE if dx > 0 else -GRID_SIZE
+                        else:
+                            y += GRID_SIZE if dy > 0 else -GRID_SIZE
+                        moved_cell = True
+                    remaining -= 1
+                else:
+                    grappling = False
+            elif falling:
+                if fall_left > 0:
+                    if delay <= 0:
+                        y += GRID_SIZE
+                        fall_left -= 1
+                        delay = FALL_DELAY
+                        moved_cell = True
+                    elif delay > 1 and checked and not just_moved:
+                        # Nothing happens until the delay is about to run out
+                        tick += delay - 2
+                        delay = 1
+                    else:
+                        delay -= 1
+                else:
+                    falling = False
+
+            moved = (just_moved or (grappling and remaining > 0 and remaining % GRAPPLE_TICKS_PER_CELL == 0)
+                     or (falling and fall_left > 0 and delay <= 0))
+            if moved or moved_cell:
+                cell = (x // GRID_SIZE, y // GRID_SIZE)
+                if moved:
+                    bats.step(area)
+                    crabs.step(area)
+                    if counters is not None:
+                        counters["entities_updated"] += len(bats) + len(crabs)
+                    just_moved = False
+                cells.append(cell)
+                step_ticks.append(tick)
+                if record:
+                    turn.enemies.append(self.enemy_cells() if moved else turn.enemies[-1])
+                if moved and cell in self.poison_cells:
+                    if self.amber_count > 0:
+                        self.amber_count -= 1
+                        events.append((len(cells) - 1, "poison"))
+                    else:
+                        self.die(Outcome.POISON)
+                        break
+                checked = False
+
+            if not checked:
+                cell = (x // GRID_SIZE, y // GRID_SIZE)
+                if cell == self.exit_cell:
+                    self.outcome = Outcome.EXIT
+                    self.waiting_for_input = True
+                    break
+                if crab_cells.count(cell):
+                    self.die(Outcome.CRAB)
+                    break
+                if bat_cells.count(cell):
+                    self.die(Outcome.BAT)
+                    break
+                checked = True
+
+            if not grappling and not falling:
+                self.waiting_for_input = True
+                break
+
+        player.x = x
+        player.y = y
+        player.grappling = grappling
+        player.grapple_ticks_remaining = remaining
+        player.falling = falling
+        player.fall_ticks_remaining = fall_left
+        player.fall_delay = delay
+        player.just_moved = just_moved
+        turn.ticks = tick
+        turn.outcome = self.outcome
+        if self.outcome is not None:
+            events.append((len(cells) - 1, self.outcome))
+        return turn
+
+    def step(self, action):
+        # Play a whole turn as fast as possible; returns the outcome (None while the game goes on)
+        return self.resolve(action).outcome
@@ -0,0 +1,573 @@
+import argparse
+import heapq
+import math
+import time
+
+from level import default_level, load_level
+from simulation import GRAPPLE_DIRECTIONS, Action, Outcome
+
+# Level solver. Enemies only move when the player moves, and every patrol is
+# periodic, so the game seen at turn boundaries is a finite graph over
+# (player cell, fall delay, enemy phase, crab alive mask, amber). LevelModel
+# plays one turn in that graph at cell level - exactly as Simulation does it
+# tick by tick - and solve() runs an A* search over it. Enemies move everywhere;
+# Simulation.active_area only delays when far-off enemies are brought up to date.
+#
+# A state is a tuple (x, y, fallen, phase, mask, amber):
+#   x, y     player cell
+#   fallen   1 once the player has fallen: the fall delay then stays at
+#            FALL_DELAY, so the first cell of the next fall waits for it
+#   phase    enemy steps taken so far, folded into the patrols' common cycle
+#   mask     bit i set while crab i is alive
+#   amber    amber carried
+#
+# More amber is never worse (it only buys poison clouds and counts at the
+# exit), so a state is dropped when another with the same cell, phase and
+# crabs has at least as much amber in no more turns. Once an exit is found,
+# states that cannot end with more amber (amber carried plus living crabs a
+# hook can reach), or with as much in fewer turns, are dropped too.
+#
+# The search branches on these tuples, not on Simulation.snapshot() bytes. A
+# snapshot holds pixel positions, directions and lag for every enemy; the tuple
+# folds all of that into one phase, packs into a single int key, and play()
+# replays a turn at cell level (often from a cached route) about fifty times
+# faster than restore() plus resolve(). rulecheck.py keeps the two in step.
+
+MAX_STATES = 2000000  # Transposition table bound, in states
+TIME_LIMIT = 10.0  # Seconds the search may take; None for no limit
+CLOCK_EVERY = 1024  # States expanded between looks at the clock
+
+
+def patrol_cycle(position, direction, low, high):
+    # Positions (in cells) of a patrolling enemy after 0, 1, 2, ... steps, as
+    # (positions, preperiod, period): it repeats from positions[preperiod] on
+    seen = {}
+    positions = []
+    while (position, direction) not in seen:
+        seen[position, direction] = len(positions)
+        positions.append(position)
+        if direction == 1:
+            position += 1
+            if position >= high:
+                direction = -1
+        else:
+            position -= 1
+            if position <= low:
+                direction = 1
+    start = seen[position, direction]
+    return positions, start, len(positions) - start
+
+
+class Patrols:
+    # Where every enemy of one kind stands after any number of steps
+    def __init__(self, xs, ys, lows, highs, horizontal):
+        self.cells = []  # Per enemy: cell after each step of its trajectory
+        self.starts = []
+        self.periods = []
+        self.by_cell = {}  # Cell -> enemies whose patrol passes through it
+        self.by_row = {}  # Row -> enemies whose patrol crosses it
+        self.by_column = {}
+        self.bounds = []  # Per enemy: (x0, y0, x1, y1), inclusive box around its patrol
+        for i, (x, y, low, high) in enumerate(zip(xs, ys, lows, highs)):
+            if horizontal:
+                positions, start, period = patrol_cycle(x, 1, low, high)
+                cells = [(p, y) for p in positions]
+            else:
+                positions, start, period = patrol_cycle(y, 1, low, high)
+                cells = [(x, p) for p in positions]
+            for cell in sorted(set(cells)):
+                self.by_cell.setdefault(cell, []).append(i)
+            for row in sorted({cell[1] for cell in cells}):
+                self.by_row.setdefault(row, []).append(i)
+            for column in sorted({cell[0] for cell in cells}):
+                self.by_column.setdefault(column, []).append(i)
+            self.bounds.append((min(c[0] for c in cells), min(c[1] for c in cells),
+                                max(c[0] for c in cells), max(c[1] for c in cells)))
+            self.cells.append(cells)
+            self.starts.append(start)
+            self.periods.append(period)
+
+    def cell(self, i, steps):
+        start = self.starts[i]
+        if steps >= start:
+            steps = start + (steps - start) % self.periods[i]
+        return self.cells[i][steps]
+
+    def at(self, cell, steps, mask=-1):
+        # Lowest index of an enemy (alive in mask) standing in cell, or None
+        for i in self.by_cell.get(cell, ()):
+            if mask >> i & 1 and self.cell(i, steps) == cell:
+                return i
+        return None
+
+
+class LevelModel:
+    def __init__(self, level):
+        self.level = level
+        self.world = level.world
+        self.world.build_distance_index()
+        self.spawn = (level.spawn_x, level.spawn_y)
+        self.exit = (level.exit_x, level.exit_y)
+        self.poison = {(x, y) for x, y in level.poison.tolist()}
+
+        bats = level.bats
+        self.bats = Patrols(bats["x"].tolist(), bats["y"].tolist(),
+                            bats["ceiling"].tolist(), bats["floor"].tolist(), horizontal=False)
+        crabs = level.crabs
+        self.crabs = Patrols(crabs["x"].tolist(), crabs["y"].tolist(), crabs["x"].tolist(),
+                             (crabs["x"] + crabs["range"]).tolist(), horizontal=True)
+        self.crab_count = len(crabs)
+        # Cells where a collision check can find anything; play() skips the rest
+        self.watched = set(self.bats.by_cell) | set(self.crabs.by_cell) | {self.exit}
+        self.routes = {}  # (x, y, fallen, action) -> quiet route, see route()
+
+        # Enemy phases: every patrol has settled into its cycle after `preperiod`
+        # steps and all of them repeat together every `period` steps
+        patrols = self.bats.starts + self.crabs.starts
+        self.preperiod = max(patrols, default=0)
+        self.period = 1
+        for period in self.bats.periods + self.crabs.periods:
+            self.period = self.period * period // math.gcd(self.period, period)
+        self.phases = self.preperiod + self.period
+
+    def start(self):
+        return (self.spawn[0], self.spawn[1], 0, 0, (1 << self.crab_count) - 1, 0)
+
+    def key(self, state):
+        # Pack a state into one int for the transposition table
+        x, y, fallen, phase, mask, amber = state
+        key = ((y * self.world.width + x) * 2 + fallen) * self.phases + phase
+        return ((key << self.crab_count) | mask) * (self.crab_count + 1) + amber
+
+    def fold(self, phase):
+        if phase >= self.phases:
+            phase = self.preperiod + (phase - self.preperiod) % self.period
+        return phase
+
+    def check(self, x, y, phase, mask):
+        # Collision checks the simulation runs on every tick, in its order
+        cell = (x, y)
+        if cell == self.exit:
+            return Outcome.EXIT
+        if self.crabs.at(cell, phase, mask) is not None:
+            return Outcome.CRAB
+        if self.bats.at(cell, phase) is not None:
+            return Outcome.BAT
+        return None
+
+    def play(self, state, action):
+        # Play one turn from state. Returns (outcome, state after the turn):
+        # outcome is an Outcome if the turn ended the game, else None.
+        # Returns None if the action does nothing (blocked move, grapple
+        # against an adjacent wall).
+        x, y, fallen, phase, mask, amber = state
+        route_key = (x, y, fallen, action)
+        route = self.routes.get(route_key, False)
+        if route is False:
+            route = self.routes[route_key] = self.route(x, y, fallen, action)
+        if route is None:
+            return None
+        if route is not True and amber >= route[4]:
+            # Nothing along the way depends on the enemies: skip the ticks
+            end_x, end_y, fallen, steps, poisoned = route
+            return None, (end_x, end_y, fallen, self.fold(phase + steps), mask, amber - poisoned)
+        return self.play_ticks(state, action)
+
+    def route(self, x, y, fallen, action):
+        # The part of a turn that does not depend on the enemies. Returns
+        # (end x, end y, fallen, enemy steps, poison hits) if the player
+        # meets neither an enemy's patrol, a crab's hook line nor the exit;
+        # True if play_ticks() has to work it out; None if the action does nothing.
+        watched = self.watched
+        poison = self.poison
+
+        if action in GRAPPLE_DIRECTIONS:
+            dx, dy = GRAPPLE_DIRECTIONS[action]
+            distance = self.world.free_run(x, y, dx, dy)
+            if self.crab_near_ray(x, y, dx, dy, distance + 1):
+                return True
+            if distance == 0:
+                return True if (x, y) in watched else None
+            poisoned = 0
+            for moved in range(1, distance + 1):
+                x += dx
+                y += dy
+                if (x, y) in watched:
+                    return True
+                if moved < distance and (x, y) in poison:
+                    poisoned += 1
+            return x, y, fallen, distance - 1, poisoned
+
+        if action == Action.LEFT:
+            x -= 1
+        elif action == Action.RIGHT:
+            x += 1
+        else:
+            y -= 1
+        if self.world.is_solid(x, y):
+            return None
+        fall = self.world.free_run(x, y, 0, 1)
+        if fall:
+            if not fallen:
+                y += 1
+                fall -= 1
+            fallen = 1
+        poisoned = 0
+        for dropped in range(fall + 1):
+            if (x, y) in watched:
+                return True
+            if (x, y) in poison:
+                poisoned += 1
+            if dropped:
+                y += 1
+        if (x, y) in watched:
+            return True
+        return x, y, fallen, fall + 1, poisoned
+
+    def play_ticks(self, state, action):
+        # play() tick by tick, at cell level
+        x, y, fallen, phase, mask, amber = state
+        world = self.world
+        watched = self.watched
+        poison = self.poison
+
+        if action in GRAPPLE_DIRECTIONS:
+            dx, dy = GRAPPLE_DIRECTIONS[action]
+            distance = world.free_run(x, y, dx, dy)
+            crab = self.grapple_crab(x, y, dx, dy, distance + 1, phase, mask)
+            if crab is not None:
+                # The hook kills the crab; the turn ends without moving
+                return None, (x, y, fallen, phase, mask & ~(1 << crab), amber + 1)
+            if distance == 0:
+                # A single tick in place; it only matters if the player starts on something
+                outcome = self.check(x, y, phase, mask)
+                return None if outcome is None else (outcome, state)
+
+            # One cell every GRAPPLE_TICKS_PER_CELL ticks; enemies step between cells
+            for moved in range(1, distance + 1):
+                x += dx
+                y += dy
+                if (x, y) in watched:
+                    outcome = self.check(x, y, phase, mask)
+                    if outcome is not None:
+                        return outcome, (x, y, fallen, phase, mask, amber)
+                if moved < distance:
+                    phase += 1
+                    if (x, y) in poison:
+                        if amber == 0:
+                            return Outcome.POISON, (x, y, fallen, phase, mask, amber)
+                        amber -= 1
+                    if (x, y) in watched:
+                        outcome = self.check(x, y, phase, mask)
+                        if outcome is not None:
+                            return outcome, (x, y, fallen, phase, mask, amber)
+            return None, (x, y, fallen, self.fold(phase), mask, amber)
+
+        if action == Action.LEFT:
+            x -= 1
+        elif action == Action.RIGHT:
+            x += 1
+        else:
+            y -= 1
+        if world.is_solid(x, y):
+            return None
+
+        fall = world.free_run(x, y, 0, 1)
+        if fall:
+            if not fallen:
+                # No fall delay yet: the first cell of the fall happens on the same tick
+                y += 1
+                fall -= 1
+            fallen = 1
+
+        # Enemies step once on the move's own tick, then again before each
+        # further cell of the fall, while the player is still in the cell above
+        for dropped in range(fall + 1):
+            phase += 1
+            if (x, y) in poison:
+                if amber == 0:
+                    return Outcome.POISON, (x, y, fallen, phase, mask, amber)
+                amber -= 1
+            if (x, y) in watched:
+                outcome = self.check(x, y, phase, mask)
+                if outcome is not None:
+                    return outcome, (x, y, fallen, phase, mask, amber)
+            if dropped:
+                y += 1
+                if (x, y) in watched:
+                    outcome = self.check(x, y, phase, mask)
+                    if outcome is not None:
+                        return outcome, (x, y, fallen, phase, mask, amber)
+        return None, (x, y, fallen, self.fold(phase), mask, amber)
+
+    def landings(self, x, y, action):
+        # Cells a turn can end in if no enemy interferes: where the move stops,
+        # plus the exit if the player passes through it (a fall can skip the
+        # exit check on its first tick, so both count)
+        world = self.world
+        if action in GRAPPLE_DIRECTIONS:
+            dx, dy = GRAPPLE_DIRECTIONS[action]
+            distance = world.free_run(x, y, dx, dy)
+            if distance == 0:
+                return ()
+            end = (x + dx * distance, y + dy * distance)
+            steps = (self.exit[0] - x) * dx + (self.exit[1] - y) * dy
+            if 0 < steps <= distance and self.exit == (x + dx * steps, y + dy * steps):
+                return end, self.exit
+            return end,
+
+        if action == Action.LEFT:
+            x -= 1
+        elif action == Action.RIGHT:
+            x += 1
+        else:
+            y -= 1
+        if world.is_solid(x, y):
+            return ()
+        fall = world.free_run(x, y, 0, 1)
+        if x == self.exit[0] and y <= self.exit[1] <= y + fall:
+            return (x, y + fall), self.exit
+        return (x, y + fall),
+
+    def exit_distances(self):
+        # Fewest turns from each cell the player can reach to the exit, ignoring
+        # enemies and poison. Enemies can only stop a move early (a crab on the
+        # hook's ray) or end the game, never shorten the way, so these are lower
+        # bounds; cells missing from the result can never reach the exit.
+        sources = {self.spawn: []}  # Cell -> cells one turn before it
+        queue = [self.spawn]
+        for x, y in queue:
+            for action in Action:
+                for cell in self.landings(x, y, action):
+                    if cell not in sources:
+                        sources[cell] = []
+                        queue.append(cell)
+                    sources[cell].append((x, y))
+
+        distances = {}
+        if self.exit in sources:
+            distances[self.exit] = 0
+            queue = [self.exit]
+            for cell in queue:
+                for source in sources[cell]:
+                    if source not in distances:
+                        distances[source] = distances[cell] + 1
+                        queue.append(source)
+        return distances
+
+    def crab_near_ray(self, x, y, dx, dy, reach):
+        # Whether any crab's patrol crosses the hook's ray
+        end_x = x + dx * reach
+        end_y = y + dy * reach
+        ray = (min(x + dx, end_x), min(y + dy, end_y), max(x + dx, end_x), max(y + dy, end_y))
+        line = self.crabs.by_row.get(y, ()) if dy == 0 else self.crabs.by_column.get(x, ())
+        for i in line:
+            x0, y0, x1, y1 = self.crabs.bounds[i]
+            if x0 <= ray[2] and ray[0] <= x1 and y0 <= ray[3] and ray[1] <= y1:
+                return True
+        return False
+
+    def hookable(self, cells):
+        # Mask of the crabs a hook thrown from any of the cells could ever reach
+        mask = 0
+        for x, y in cells:
+            for dx, dy in GRAPPLE_DIRECTIONS.values():
+                reach = self.world.free_run(x, y, dx, dy) + 1
+                end_x = x + dx * reach
+                end_y = y + dy * reach
+                ray = (min(x + dx, end_x), min(y + dy, end_y), max(x + dx, end_x), max(y + dy, end_y))
+                for i in (self.crabs.by_row.get(y, ()) if dy == 0 else self.crabs.by_column.get(x, ())):
+                    x0, y0, x1, y1 = self.crabs.bounds[i]
+                    if x0 <= ray[2] and ray[0] <= x1 and y0 <= ray[3] and ray[1] <= y1:
+                        mask |= 1 << i
+        return mask
+
+    def grapple_crab(self, x, y, dx, dy, reach, phase, mask):
+        # Lowest-index living crab nearest along the hook's ray, within reach cells
+        line = self.crabs.by_row.get(y, ()) if dy == 0 else self.crabs.by_column.get(x, ())
+        best = None
+        for i in line:
+            if not mask >> i & 1:
+                continue
+            crab_x, crab_y = self.crabs.cell(i, phase)
+            if (crab_y if dy == 0 else crab_x) != (y if dy == 0 else x):
+                continue
+            steps = (crab_x - x) * dx + (crab_y - y) * dy
+            if 0 < steps <= reach and (best is None or (steps, i) < best):
+                best = (steps, i)
+        return None if best is None else best[1]
+
+
+class SolveResult:
+    def __init__(self):
+        self.complete = True  # False if the state bound, time limit or stop_at_exit cut the search short
+        self.stopped = None  # What cut it short: "exit" (stop_at_exit), "states" or "time"
+        self.states = 0  # Distinct states reached
+        self.shortest = None  # Fewest-turn action list reaching the exit
+        self.shortest_amber = 0
+        self.best = None  # Action list reaching the exit with the most amber (fewest turns among those)
+        self.best_amber = None
+
+    @property
+    def reachable(self):
+        # True or False; None if the search stopped before deciding
+        if self.shortest is not None:
+            return True
+        return False if self.complete else None
+
+    @property
+    def optimal(self):
+        # Whether best is proven to collect the most amber (the shortest solution
+        # is the shortest one whenever it is found)
+        return self.complete and self.best is not None
+
+    @property
+    def turns(self):
+        return None if self.shortest is None else len(self.shortest)
+
+
+def dominated(front, amber, turns):
+    # Whether another (amber, turns) entry of a state's front beats or ties it
+    for other_amber, other_turns in front:
+        if other_amber >= amber and other_turns <= turns and (other_amber, other_turns) != (amber, turns):
+            return True
+    return False
+
+
+def solve(level, max_states=MAX_STATES, stop_at_exit=False, time_limit=TIME_LIMIT):
+    # A* over turns from the level's start, guided by the enemy-free turn
+    # counts of LevelModel.exit_distances(). Explores every state that can
+    # still reach the exit with more amber unless stop_at_exit is set; after
+    # the first exit, states carrying the most amber are expanded first.
+    # Past max_states or time_limit seconds it returns the best found so far.
+    deadline = None if time_limit is None else time.perf_counter() + time_limit
+    model = level if isinstance(level, LevelModel) else LevelModel(level)
+    result = SolveResult()
+    distances = model.exit_distances()
+    start = model.start()
+    if (start[0], start[1]) not in distances:
+        return result  # Not even an empty level would let the player out
+
+    root = model.key(start)
+    table = {root: (None, None, 0)}  # Transposition table: key -> (parent key, action, turns)
+    # Key without the amber -> [(amber, turns)] that no other entry dominates
+    amber_levels = model.crab_count + 1
+    hookable = model.hookable(distances)
+
+    def hopeless(state, turns):
+        # Whether the state can no longer beat the best exit found so far
+        if result.best is None:
+            return False
+        most = state[5] + bin(state[4] & hookable).count("1")
+        return most < result.best_amber or (
+            most == result.best_amber and turns + distances[state[0], state[1]] >= len(result.best))
+
+    fronts = {root // amber_levels: [(0, 0)]}
+    frontier = [(distances[start[0], start[1]], 0, root, start)]
+    actions = list(Action)
+    amber_first = False  # Frontier ordered by (-amber, turns estimate) instead of the estimate
+    expanded = 0
+
+    while frontier:
+        expanded += 1
+        if deadline is not None and expanded % CLOCK_EVERY == 0 and time.perf_counter() > deadline:
+            result.complete = False
+            result.stopped = "time"
+            break
+        _, turns, key, state = heapq.heappop(frontier)
+        if table[key][2] < turns:
+            continue  # Reached again by a shorter path since it was queued
+        if dominated(fronts[key // amber_levels], state[5], turns) or hopeless(state, turns):
+            continue  # Beaten since it was queued
+        for action in actions:
+            played = model.play(state, action)
+            if played is None:
+                continue
+            outcome, after = played
+            if outcome == Outcome.EXIT:
+                # The first exit found is a shortest one: the heuristic never overestimates
+                amber = after[5]
+                if result.shortest is None:
+                    result.shortest = path(table, key, action)
+                    result.shortest_amber = amber
+                    if stop_at_exit:
+                        result.complete = False
+                        result.stopped = "exit"
+                        result.states = len(table)
+                        return result
+                    # From now on only amber can improve: expand states carrying the
+                    # most amber first, so good exits are found early and bound the rest
+                    frontier = [((-s[5], f), t, k, s) for f, t, k, s in frontier]
+                    heapq.heapify(frontier)
+                    amber_first = True
+                if (result.best_amber is None or amber > result.best_amber or
+                        (amber == result.best_amber and turns + 1 < len(result.best))):
+                    result.best = path(table, key, action)
+                    result.best_amber = amber
+                continue
+            if outcome is not None:
+                continue  # Died
+            remaining = distances.get((after[0], after[1]))
+            if remaining is None:
+                continue  # The exit is out of reach from there
+            after_key = model.key(after)
+            seen = table.get(after_key)
+            if seen is not None and seen[2] <= turns + 1:
+                continue
+            base = after_key // amber_levels
+            front = fronts.get(base, [])
+            amber = after[5]
+            if dominated(front, amber, turns + 1) or hopeless(after, turns + 1):
+                continue
+            if seen is None and len(table) >= max_states:
+                result.complete = False
+                result.stopped = result.stopped or "states"
+                continue
+            table[after_key] = (key, action, turns + 1)
+            fronts[base] = [(a, t) for a, t in front if a > amber or t < turns + 1] + [(amber, turns + 1)]
+            estimate = turns + 1 + remaining
+            heapq.heappush(frontier, ((-amber, estimate) if amber_first else estimate, turns + 1, after_key, after))
+
+    result.states = len(table)
+    return result
+
+
+def path(table, key, last_action):
+    actions = [last_action]
+    while table[key][0] is not None:
+        key, action, _ = table[key]
+        actions.append(action)
+    actions.reverse()
+    return actions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the shortest and the most-amber ways through a Grapplecore level")
+    parser.add_argument("level", nargs="?", help="level file (default: the debug room)")
+    parser.add_argument("--max-states", type=int, default=MAX_STATES,
+                        help="transposition table bound (default: %(default)s)")
+    parser.add_argument("--time-limit", type=float, default=TIME_LIMIT,
+                        help="seconds to search before settling for the best found so far (default: %(default)s)")
+    parser.add_argument("--stop-at-exit", action="store_true",
+                        help="stop at the shortest solution instead of searching for the most amber")
+    args = parser.parse_args()
+
+    level = load_level(args.level) if args.level else default_level()
+    result = solve(level, args.max_states, args.stop_at_exit, args.time_limit)
+    stopped = {"exit": " (stopped at the first exit)", "states": " (state bound hit)", "time": " (time limit hit)"}
+    print("states explored: %d%s" % (result.states, stopped.get(result.stopped, "")))
+    if result.reachable is None:
+        print("exit not found before the search stopped")
+    elif not result.reachable:
+        print("exit is unreachable")
+    else:
+        print("shortest: %d turns, %d amber: %s" % (result.turns, result.shortest_amber,
+                                                  " ".join(a.name for a in result.shortest)))
+        if not args.stop_at_exit:
+            print("most amber (%s): %d turns, %d amber: %s" % (
+                "optimal" if result.optimal else "best found so far", len(result.best), result.best_amber,
+                " ".join(a.name for a in result.best)))
+
+
+if __name__ == "__main__":
+    main()
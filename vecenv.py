@@ -0,0 +1,296 @@
+import numpy as np
+
+from level import default_level
+from simulation import OUTCOMES, Action, Outcome
+from solver import Patrols
+
+# Many games of one level stepped together, for training agents. The state of
+# every game lives in packed arrays (player cell, fallen flag, enemy steps,
+# crab alive flags, amber) and a step plays one turn for all of them with NumPy
+# operations over the games, following the same cell-level turn rules as the
+# solver's LevelModel.play_ticks (and so Simulation). Enemy positions are
+# looked up from their periodic patrols by step count, so enemies are never
+# stepped one by one.
+#
+# Observations are an (N, CHANNELS, height, width) uint8 tensor, reused from
+# step to step; see the channel constants. Finished games restart right away:
+# the observation after a step shows the new game where one ended.
+
+# Observation channels
+TILES = 0  # Tile codes
+PLAYER = 1
+BATS = 2
+CRABS = 3  # Living crabs
+POISON = 4
+EXIT = 5
+CHANNELS = 6
+
+MAX_TURNS = 200  # Turns before a game is cut off
+REWARDS = {None: 0.0, Outcome.EXIT: 1.0, Outcome.BAT: -1.0, Outcome.CRAB: -1.0, Outcome.POISON: -1.0}
+
+NONE = 0  # Outcome codes, as in snapshots: OUTCOMES.index(outcome)
+EXIT_CODE = OUTCOMES.index(Outcome.EXIT)
+BAT_CODE = OUTCOMES.index(Outcome.BAT)
+CRAB_CODE = OUTCOMES.index(Outcome.CRAB)
+POISON_CODE = OUTCOMES.index(Outcome.POISON)
+
+# Cell offsets of every action: moves for LEFT/RIGHT/JUMP, hook direction for grapples
+ACTION_DX = np.array([-1, 1, 0, -1, 0, 1])
+ACTION_DY = np.array([0, 0, -1, 0, -1, 0])
+
+
+class PatrolTable:
+    # Cell index (y * width + x) of every enemy of one kind after any number of
+    # steps. Cells outside the level (a patrol can run into the border) map to
+    # width * height, which no player cell matches.
+    def __init__(self, patrols, width, height):
+        count = len(patrols.cells)
+        length = max((len(cells) for cells in patrols.cells), default=1)
+        self.cells = np.zeros((count, length), np.int64)
+        for i, cells in enumerate(patrols.cells):
+            self.cells[i, :len(cells)] = [y * width + x if 0 <= x < width and 0 <= y < height else width * height
+                                          for x, y in cells]
+        self.starts = np.array(patrols.starts, np.int64)
+        self.periods = np.array(patrols.periods, np.int64)
+        self.rows = np.arange(count)
+
+    def at(self, steps):
+        # (games, enemies) cell indices after steps (one count per game)
+        steps = steps[:, None]
+        phase = np.where(steps < self.starts, steps, self.starts + (steps - self.starts) % self.periods)
+        return self.cells[self.rows, phase]
+
+
+class VecEnv:
+    def __init__(self, count, level=None, max_turns=MAX_TURNS, observe=True):
+        if level is None:
+            level = default_level()
+        world = level.world
+        distances = world.build_distance_index()
+        self.count = count
+        self.width = width = world.width
+        self.height = height = world.height
+        self.max_turns = max_turns
+
+        # Static tables: solidity (padded with rock so moves off the edge are blocked),
+        # fall distances and hook distances per direction
+        self.solid = np.ones((height + 2, width + 2), bool)
+        self.solid[1:-1, 1:-1] = world.solid_mask()
+        self.fall = distances.down.astype(np.int64)
+        self.reach = np.stack([distances.left, distances.up, distances.right]).astype(np.int64)
+        self.poison = np.zeros(width * height, bool)
+        for x, y in level.poison.tolist():
+            self.poison[y * width + x] = True
+        self.exit = level.exit_y * width + level.exit_x
+        self.spawn = (level.spawn_x, level.spawn_y)
+
+        bats = level.bats
+        self.bats = PatrolTable(Patrols(bats["x"].tolist(), bats["y"].tolist(), bats["ceiling"].tolist(),
+                                        bats["floor"].tolist(), horizontal=False), width, height)
+        crabs = level.crabs
+        self.crabs = PatrolTable(Patrols(crabs["x"].tolist(), crabs["y"].tolist(), crabs["x"].tolist(),
+                                         (crabs["x"] + crabs["range"]).tolist(), horizontal=True), width, height)
+        self.crab_count = len(crabs)
+        # Cells some enemy passes through; only games standing there need a lookup
+        self.watched = np.zeros(width * height + 1, bool)
+        self.watched[self.bats.cells.reshape(-1)] = True
+        self.watched[self.crabs.cells.reshape(-1)] = True
+
+        # Per-game state
+        self.x = np.zeros(count, np.int64)
+        self.y = np.zeros(count, np.int64)
+        self.fallen = np.zeros(count, bool)
+        self.steps = np.zeros(count, np.int64)  # Enemy steps since the game started
+        self.alive = np.zeros((count, len(crabs)), bool)  # Living crabs
+        self.amber = np.zeros(count, np.int64)
+        self.turns = np.zeros(count, np.int64)
+
+        self.observation = None
+        if observe:
+            self.observation = np.zeros((count, CHANNELS, height, width), np.uint8)
+            self.observation[:, TILES] = world.tiles
+            self.observation[:, POISON] = self.poison.reshape(height, width)
+            self.observation[:, EXIT, level.exit_y, level.exit_x] = 1
+        self.marks = None  # Entity cells set in the observation, cleared on the next step
+
+    def reset(self):
+        self.restart(np.arange(self.count))
+        return self.observe()
+
+    def restart(self, games):
+        self.x[games] = self.spawn[0]
+        self.y[games] = self.spawn[1]
+        self.fallen[games] = False
+        self.steps[games] = 0
+        self.alive[games] = True
+        self.amber[games] = 0
+        self.turns[games] = 0
+
+    def step(self, actions):
+        # Play one turn in every game. actions: one Action per game (ints).
+        # Returns (observation, rewards, terminated, truncated, outcomes), where
+        # outcomes holds OUTCOMES indices (0 while the game goes on).
+        actions = np.asarray(actions, np.int64)
+        outcomes = np.zeros(self.count, np.int8)
+        grapple = actions >= Action.GRAPPLE_LEFT
+        games = np.flatnonzero(~grapple)
+        self.move(games, actions[games], outcomes)
+        games = np.flatnonzero(grapple)
+        self.grapple(games, actions[games], outcomes)
+
+        self.turns += 1
+        terminated = outcomes != NONE
+        truncated = ~terminated & (self.turns >= self.max_turns)
+        rewards = np.zeros(self.count, np.float32)
+        for outcome, reward in REWARDS.items():
+            if outcome is not None and reward:
+                rewards[outcomes == OUTCOMES.index(outcome)] = reward
+        finished = np.flatnonzero(terminated | truncated)
+        if len(finished):
+            self.restart(finished)
+        return self.observe(), rewards, terminated, truncated, outcomes
+
+    def collide(self, games):
+        # Outcome codes of the collision checks at the games' current cells, in the simulation's order
+        cells = self.y[games] * self.width + self.x[games]
+        codes = np.zeros(len(games), np.int8)
+        near = np.flatnonzero(self.watched[cells])
+        if len(near):
+            near_games = games[near]
+            near_cells = cells[near, None]
+            steps = self.steps[near_games]
+            if self.crab_count:
+                crab = ((self.crabs.at(steps) == near_cells) & self.alive[near_games]).any(axis=1)
+                codes[near[crab]] = CRAB_CODE
+            if len(self.bats.rows):
+                bat = (self.bats.at(steps) == near_cells).any(axis=1)
+                codes[near[bat & (codes[near] == NONE)]] = BAT_CODE
+        codes[cells == self.exit] = EXIT_CODE
+        return codes
+
+    def settle(self, games, codes, outcomes):
+        # Record outcomes; returns the mask of games still playing
+        ended = codes != NONE
+        outcomes[games[ended]] = codes[ended]
+        return ~ended
+
+    def poisoned(self, games, outcomes):
+        # Poison check after an enemy step: costs one amber, or the game without any
+        hit = self.poison[self.y[games] * self.width + self.x[games]]
+        if not hit.any():
+            return np.ones(len(games), bool)
+        dead = hit & (self.amber[games] == 0)
+        self.amber[games[hit & ~dead]] -= 1
+        outcomes[games[dead]] = POISON_CODE
+        return ~dead
+
+    def move(self, games, actions, outcomes):
+        # LEFT, RIGHT, JUMP: move one cell, then fall as far as possible
+        x = self.x[games] + ACTION_DX[actions]
+        y = self.y[games] + ACTION_DY[actions]
+        free = ~self.solid[y + 1, x + 1]
+        games = games[free]
+        x = x[free]
+        y = y[free]
+        fall = self.fall[y, x]
+        # Before the first fall there is no fall delay: the first cell drops on the move's own tick
+        first = (fall > 0) & ~self.fallen[games]
+        self.fallen[games] |= fall > 0
+        self.x[games] = x
+        self.y[games] = y + first
+        fall = fall - first
+
+        # The enemies step on the move's tick and again before every further cell
+        dropped = 0
+        while len(games):
+            self.steps[games] += 1
+            keep = self.poisoned(games, outcomes)
+            games = games[keep]
+            fall = fall[keep]
+            keep = self.settle(games, self.collide(games), outcomes)
+            games = games[keep]
+            fall = fall[keep]
+            if dropped:
+                self.y[games] += 1
+                keep = self.settle(games, self.collide(games), outcomes)
+                games = games[keep]
+                fall = fall[keep]
+            keep = fall > dropped
+            games = games[keep]
+            fall = fall[keep]
+            dropped += 1
+
+    def grapple(self, games, actions, outcomes):
+        dx = ACTION_DX[actions]
+        dy = ACTION_DY[actions]
+        x = self.x[games]
+        y = self.y[games]
+        distance = self.reach[actions - Action.GRAPPLE_LEFT, y, x]
+
+        # The hook stops at the nearest living crab on its ray (lowest index on a tie):
+        # the crab dies, amber is collected and the turn ends there
+        if self.crab_count and len(games):
+            cells = self.crabs.at(self.steps[games])
+            crab_x = cells % self.width
+            crab_y = cells // self.width
+            along = (crab_x - x[:, None]) * dx[:, None] + (crab_y - y[:, None]) * dy[:, None]
+            on_ray = np.where(dy[:, None] == 0, crab_y == y[:, None], crab_x == x[:, None])
+            hit = on_ray & self.alive[games] & (along > 0) & (along <= distance[:, None] + 1)
+            hooked = hit.any(axis=1)
+            if hooked.any():
+                key = np.where(hit, along * self.crab_count + self.crabs.rows, np.iinfo(np.int64).max)
+                crab = key[hooked].argmin(axis=1)
+                self.alive[games[hooked], crab] = False
+                self.amber[games[hooked]] += 1
+                keep = ~hooked
+                games, dx, dy, distance = games[keep], dx[keep], dy[keep], distance[keep]
+
+        # Hooking an adjacent wall is a single tick in place
+        still = distance == 0
+        if still.any():
+            self.settle(games[still], self.collide(games[still]), outcomes)
+            keep = ~still
+            games, dx, dy, distance = games[keep], dx[keep], dy[keep], distance[keep]
+
+        # One cell at a time; the enemies step between cells
+        moved = 1
+        while len(games):
+            self.x[games] += dx
+            self.y[games] += dy
+            keep = self.settle(games, self.collide(games), outcomes)
+            games, dx, dy, distance = games[keep], dx[keep], dy[keep], distance[keep]
+            more = distance > moved
+            between = games[more]
+            if len(between):
+                self.steps[between] += 1
+                keep = self.poisoned(between, outcomes)
+                keep[keep] = self.settle(between[keep], self.collide(between[keep]), outcomes)
+                more[more] = keep
+            games, dx, dy, distance = games[more], dx[more], dy[more], distance[more]
+            moved += 1
+
+    def observe(self):
+        # The observation tensor with the entity channels updated for every game
+        observation = self.observation
+        if observation is None:
+            return None
+        if self.marks is not None:
+            for games, channel, ys, xs in self.marks:
+                observation[games, channel, ys, xs] = 0
+
+        every = np.arange(self.count)
+        marks = [(every, PLAYER, self.y.copy(), self.x.copy())]
+        for channel, table, alive in ((BATS, self.bats, None), (CRABS, self.crabs, self.alive)):
+            if not len(table.rows):
+                continue
+            cells = table.at(self.steps)
+            shown = cells < self.width * self.height
+            if alive is not None:
+                shown &= alive
+            games = np.broadcast_to(every[:, None], cells.shape)[shown]
+            cells = cells[shown]
+            marks.append((games, channel, cells // self.width, cells % self.width))
+        for games, channel, ys, xs in marks:
+            observation[games, channel, ys, xs] = 1
+        self.marks = marks
+        return observation